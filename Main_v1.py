@@ -1,33 +1,79 @@
+import os
 import sys
 sys.path.append("E:/venv/Lib/site-packages")
 
 import pygame
 import math
 import random
+import secrets
 import time
 import socket
+import struct
 import threading
-import pickle
-import sys
+import asyncio
+import traceback
+import zlib
+
+from dungeon_net import (SnapshotHistory, SnapshotReceiver, WireCodec, WireFormatError, NodeSchema, RecordSchema,
+                         TableSchema, FieldType, EnumField, OptionalField, ArrayField, FrameReader, send_frame,
+                         FixedRate, FixedTimestep, TickScheduler, LoadMeter, AdaptiveSendRate, PendingInputs, InputQueue, InterpolationBuffer, EventStream, EventReceiver, SnapshotPublisher, SnapshotBroadcast, FrameCompressor,
+                         DatagramConnection, MAX_DATAGRAM_SIZE, ConnectionMetrics,
+                         encode_frame, read_frame_async)
+try:
+    from enemy_batch import EnemyBatch # Needs NumPy, which the game otherwise doesn't
+except ImportError:
+    EnemyBatch = None
 
 # --- Networking Constants ---
 HOST = '' # Listen on all available interfaces for the server
 PORT = 5050 # Port for the game connection
-RECV_BUFFER_SIZE = 4096 * 2 # Increased buffer size for larger game state data (two mazes)
+RECV_BUFFER_SIZE = 4096 * 2 # Initial size of each connection's receive buffer; it grows for larger frames
+NET_SEND_RATE = 60 # Snapshots (server, at most) and input messages (client) sent per second
+MIN_NET_SEND_RATE = 20 # The server lowers a client's snapshot rate down to this when its link or the server can't keep up
+SEAT_MAX_BUFFERED = 16 * 1024 # Match server: bytes queued for a client that count as a fully backed-up send path
+SIM_RATE = 60 # Fixed simulation steps per second, independent of the render FPS
+INTERPOLATION_DELAY = 0.1 # Seconds the client draws remote players and enemies behind the newest snapshot
+MAX_EXTRAPOLATION = 0.25 # Seconds the client keeps remote entities moving when snapshots stop arriving
+NET_TRANSPORT = 'udp' if '--udp' in sys.argv else 'tcp' # Threaded server and client: UDP avoids TCP's head-of-line stalls
+NET_COMPRESSION = '--no-compression' not in sys.argv # Offer/accept compressed frames; turn off on a LAN to save CPU
+# Preset zlib dictionary of typical snapshots (python bench_net.py --train-dict); found next to this file so
+# the dedicated server can be started from any directory
+SNAPSHOT_ZDICT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot_zdict.bin')
+NET_METRICS_FILE = os.environ.get('DUNGEON_NET_METRICS') # If set, connection metrics are appended to this file as JSON lines
+NET_METRICS_DUMP_INTERVAL = 1.0 # Seconds between two lines of NET_METRICS_FILE
+SESSION_GRACE_PERIOD = 30.0 # Seconds the threaded server holds (pauses) a dropped client's maze for it to resume
+# Server: simulate each maze's enemies as NumPy arrays (see enemy_batch.py) instead of one by one
+BATCHED_ENEMIES = '--batched-enemies' in sys.argv
 
 # --- Pygame Initialization ---
-pygame.init()
-pygame.mixer.init()
+# A dedicated server (--dedicated, or --match-server) never draws or plays sound: it
+# skips the window, fonts and mixer and only starts SDL's timer for pygame.time.get_ticks().
+HEADLESS = '--dedicated' in sys.argv or '--match-server' in sys.argv or os.environ.get('DUNGEON_HEADLESS') == '1'
+SPECTATE = '--spectate' in sys.argv # Client: watch a match on a dedicated server instead of playing
 
-# Get screen info after Pygame init but before setting the mode
-infoObject = pygame.display.Info()
 DEFAULT_SCREEN_WIDTH = 800
 DEFAULT_SCREEN_HEIGHT = 600
 
-actual_display_width = max(DEFAULT_SCREEN_WIDTH, infoObject.current_w) if infoObject.current_w else DEFAULT_SCREEN_WIDTH
-actual_display_height = max(DEFAULT_SCREEN_HEIGHT, infoObject.current_h) if infoObject.current_h else DEFAULT_SCREEN_HEIGHT
-
-# --- Game Constants (initial definitions, TILE_SIZE will be calculated) ---
+if HEADLESS:
+    try:
+        from pygame._sdl2 import init_subsystem, INIT_TIMER
+        init_subsystem(INIT_TIMER)
+    except (ImportError, pygame.error):
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+        pygame.init()
+    actual_display_width = DEFAULT_SCREEN_WIDTH
+    actual_display_height = DEFAULT_SCREEN_HEIGHT
+else:
+    pygame.init()
+    pygame.mixer.init()
+
+    # Get screen info after Pygame init but before setting the mode
+    infoObject = pygame.display.Info()
+    actual_display_width = max(DEFAULT_SCREEN_WIDTH, infoObject.current_w) if infoObject.current_w else DEFAULT_SCREEN_WIDTH
+    actual_display_height = max(DEFAULT_SCREEN_HEIGHT, infoObject.current_h) if infoObject.current_h else DEFAULT_SCREEN_HEIGHT
+
+# --- Game Constants (initial definitions, TILE_SIZE is set with the maze dimensions) ---
 INFO_BAR_HEIGHT = 80
 FPS = 60
 FONT_SIZE = 24
@@ -728,20 +774,26 @@ music_files = {
 maze_width_tiles = len(ALL_LEVEL_MAPS[0][0])
 maze_height_tiles = len(ALL_LEVEL_MAPS[0])
 
-# Calculate TILE_SIZE based on a single maze's dimensions
-tile_size_from_width = (actual_display_width - MAZE_GAP) // (maze_width_tiles * 2) # Divide by 2 for two mazes side-by-side, account for gap
-tile_size_from_height = (actual_display_height - INFO_BAR_HEIGHT) // maze_height_tiles
-
-TILE_SIZE = max(20, min(tile_size_from_width, tile_size_from_height, 40))
+# TILE_SIZE is the simulation's scale, not the display's: snapshots carry pixel positions at this
+# tile size, so the server (headless or not) and every client must agree on it
+TILE_SIZE = 40
 
-# Redefine game dimensions based on the new TILE_SIZE and two mazes
+# Game dimensions for two mazes at TILE_SIZE
 game_width_single_maze = maze_width_tiles * TILE_SIZE
 game_area_height_single_maze = maze_height_tiles * TILE_SIZE
 game_width_total = (2 * game_width_single_maze) + MAZE_GAP # Added MAZE_GAP here
 game_height_total = game_area_height_single_maze + INFO_BAR_HEIGHT
 
-screen = pygame.display.set_mode((game_width_total, game_height_total))
-pygame.display.set_caption("Dungeon Explorer Multiplayer")
+# A display too small for the game gets a scaled-down window: frames are drawn at TILE_SIZE
+# onto `screen` and present_frame() scales them to the window
+display_scale = min(1.0, actual_display_width / game_width_total, actual_display_height / game_height_total)
+
+if HEADLESS:
+    screen = window = None
+else:
+    window = pygame.display.set_mode((int(game_width_total * display_scale), int(game_height_total * display_scale)))
+    pygame.display.set_caption("Dungeon Explorer Multiplayer")
+    screen = window if display_scale == 1.0 else pygame.Surface((game_width_total, game_height_total))
 
 PLAYER_SPEED = max(1, int(0.1 * TILE_SIZE))
 ENEMY_SPEED_PATROL = max(0.5, 0.04 * TILE_SIZE) 
@@ -764,8 +816,12 @@ ELECTRICITY_PARTICLE_COUNT = 80
 ELECTRICITY_EFFECT_DURATION_MS = 1000
 BONUS_ENEMIES_TO_SPAWN = 2
 
-font = pygame.font.Font(None, FONT_SIZE)
-large_font = pygame.font.Font(None, FONT_SIZE * 2)
+if HEADLESS:
+    font = large_font = overlay_font = None
+else:
+    font = pygame.font.Font(None, FONT_SIZE)
+    large_font = pygame.font.Font(None, FONT_SIZE * 2)
+    overlay_font = pygame.font.Font(None, FONT_SIZE * 3 // 4)
 
 # --- Global Networking Variables ---
 server_socket = None # Server's listening socket
@@ -773,6 +829,19 @@ client_socket = None # Client's connection to server, or server's connection to
 is_server_instance = False # True if this instance is the server
 is_connected = False # True once a client/server connection is established
 game_running_flag = True # Controls main game loop and threads
+client_input_queue = InputQueue() # Server: numbered inputs from the client, applied one per simulation step
+pending_inputs = PendingInputs() # Client: inputs predicted locally that the server has not applied yet
+client_event_stream = EventStream() # Server: gameplay events the connected client has not acknowledged yet
+snapshot_publisher = SnapshotPublisher() # Server: the game state as of the last finished simulation tick
+server_load = LoadMeter(SIM_RATE) # Server: share of each simulation step's time budget it takes to run
+prediction_lock = threading.Lock() # Client: keeps the game loop and the snapshot reader off the local player at the same time
+client_connection = None # Server: connection of the client playing maze 2; replaced when the client resumes
+session_token = 0 # Server: the client's session token; client: the token to resume with after a disconnect (0: none yet)
+session_lost_at = None # Server: when the client's connection dropped, while its maze is held for it
+reconnect_deadline = None # Client: while reconnecting, the time.monotonic() at which the session is given up
+net_metrics = None # ConnectionMetrics of the current client/server connection; F3 shows them in-game
+show_net_overlay = False
+remote_interpolation = InterpolationBuffer(INTERPOLATION_DELAY, MAX_EXTRAPOLATION, snap_distance=TILE_SIZE * 2) # Client: remote entity positions per snapshot
 
 # --- Helper Functions for Grid-Pixel Conversion ---
 def get_tile_pixel_coords(row, col, x_offset=0):
@@ -784,6 +853,10 @@ def get_tile_indices(pixel_x, pixel_y, x_offset=0):
 def get_tile_center_pixel_coords(row, col, x_offset=0):
     return (col * TILE_SIZE) + TILE_SIZE // 2 + x_offset, (row * TILE_SIZE) + TILE_SIZE // 2
 
+def level_map_hash(level_map):
+    # Sent in level manifests so the client can check its local copy of the map
+    return zlib.crc32('\n'.join(''.join(row) for row in level_map).encode('utf-8'))
+
 # --- Fireworks Classes ---
 class FireworkParticle:
     def __init__(self, x, y, vx, vy, color, radius, lifespan, is_rocket=False, is_trail=False, can_reexplode=False):
@@ -1049,12 +1122,29 @@ class GameObject:
     def __init__(self, x, y, width, height, color):
         self.rect = pygame.Rect(x, y, width, height)
         self.color = color
+        self.prev_topleft = self.rect.topleft # Position before the latest simulation step
+        self.smoothed_topleft = None # Client: interpolated position of a remote entity, drawn instead of rect
+        self.entity_id = 0 # Enemies and collectibles: stable ID assigned by their MazeState, used as snapshot key
 
     def draw(self, surface, x_offset=0):
         draw_rect = self.rect.copy()
         draw_rect.x += x_offset
         pygame.draw.rect(surface, self.color, draw_rect)
 
+    def render_rect(self, x_offset=0, alpha=1.0):
+        """Returns the rect to draw: `alpha` of the way from prev_topleft to the current position."""
+        draw_rect = self.rect.copy()
+        if self.smoothed_topleft is not None:
+            draw_rect.topleft = (round(self.smoothed_topleft[0]) + x_offset, round(self.smoothed_topleft[1]))
+            return draw_rect
+        prev_x, prev_y = self.prev_topleft
+        # A jump of more than a tile is a respawn or level change, not movement
+        if abs(draw_rect.x - prev_x) <= TILE_SIZE and abs(draw_rect.y - prev_y) <= TILE_SIZE:
+            draw_rect.x = round(prev_x + (draw_rect.x - prev_x) * alpha)
+            draw_rect.y = round(prev_y + (draw_rect.y - prev_y) * alpha)
+        draw_rect.x += x_offset
+        return draw_rect
+
 class Wall(GameObject):
     def __init__(self, x, y):
         super().__init__(x, y, TILE_SIZE, TILE_SIZE, BLUE)
@@ -1157,7 +1247,7 @@ class Player(GameObject):
         self.animation_timer = 0
         self.animation_interval = 100
 
-    def update(self, walls_list, x_offset=0):
+    def update(self, wall_grid, x_offset=0):
         epsilon = self.speed / 2.0
         at_tile_center = math.hypot(self.rect.centerx - self.target_x, self.rect.centery - self.target_y) < epsilon
 
@@ -1173,7 +1263,7 @@ class Player(GameObject):
                     next_tile_center_x, next_tile_center_y = get_tile_center_pixel_coords(potential_next_row, potential_next_col, x_offset)
                     temp_rect = pygame.Rect(next_tile_center_x - self.rect.width // 2, next_tile_center_y - self.rect.height // 2, self.rect.width, self.rect.height)
 
-                    if not self.check_collisions(walls_list, test_rect=temp_rect):
+                    if not self.check_collisions(wall_grid, test_rect=temp_rect):
                         self.current_direction = self.desired_direction
                         self.target_x, self.target_y = next_tile_center_x, next_tile_center_y
                     else:
@@ -1211,32 +1301,18 @@ class Player(GameObject):
         elif self.current_direction == NO_DIRECTION:
             self.mouth_open = False
 
-    def check_collisions(self, walls_list, test_rect=None):
+    def check_collisions(self, wall_grid, test_rect=None):
         rect_to_check = test_rect if test_rect else self.rect
-        for wall_obj in walls_list:
-            if rect_to_check.colliderect(wall_obj.rect):
-                return True
-        return False
+        return wall_grid.blocks(rect_to_check)
 
-    def attack(self, enemies_list, walls_list, current_map_layout_ref):
+    def attack(self, enemy_index, breakable_index, current_map_layout_ref):
         now = pygame.time.get_ticks()
         if now - self.last_attack_time > PLAYER_ATTACK_COOLDOWN_MS:
             self.last_attack_time = now
 
-            targets_hit = []
-
-            for enemy in enemies_list:
-                dist = math.hypot(self.rect.centerx - enemy.rect.centerx,
-                                  self.rect.centery - enemy.rect.centery)
-                if dist < PLAYER_ATTACK_RANGE:
-                    targets_hit.append(enemy)
-
-            for wall_obj in walls_list:
-                if isinstance(wall_obj, BreakableWall):
-                    dist = math.hypot(self.rect.centerx - wall_obj.rect.centerx,
-                                      self.rect.centery - wall_obj.rect.centery)
-                    if dist < PLAYER_ATTACK_RANGE:
-                        targets_hit.append(wall_obj)
+            # Only the enemies and breakable walls on the tiles in range (see SpatialHash)
+            targets_hit = enemy_index.query_radius(self.rect.centerx, self.rect.centery, PLAYER_ATTACK_RANGE)
+            targets_hit += breakable_index.query_radius(self.rect.centerx, self.rect.centery, PLAYER_ATTACK_RANGE)
 
             for target in targets_hit:
                 if isinstance(target, Player):
@@ -1262,10 +1338,9 @@ class Player(GameObject):
     def add_score(self, amount):
         self.score += amount
 
-    def draw(self, surface, x_offset=0):
-        draw_center = (self.rect.centerx + x_offset, self.rect.centery)
-        draw_rect = self.rect.copy()
-        draw_rect.x += x_offset
+    def draw(self, surface, x_offset=0, alpha=1.0):
+        draw_rect = self.render_rect(x_offset, alpha)
+        draw_center = draw_rect.center
 
         pygame.draw.circle(surface, self.color, draw_center, self.rect.width // 2)
 
@@ -1344,6 +1419,8 @@ class Player(GameObject):
         return {
             'x': self.rect.x,
             'y': self.rect.y,
+            'target_x': self.target_x,
+            'target_y': self.target_y,
             'health': self.health,
             'keys': self.keys,
             'score': self.score,
@@ -1356,6 +1433,8 @@ class Player(GameObject):
     def set_state(self, state):
         self.rect.x = state['x']
         self.rect.y = state['y']
+        self.target_x = state['target_x']
+        self.target_y = state['target_y']
         self.health = state['health']
         self.keys = state['keys']
         self.score = state['score']
@@ -1381,7 +1460,7 @@ class Enemy(GameObject):
         if self.health < 0:
             self.health = 0
 
-    def update(self, player_obj, walls_list): # Enemy now targets only its own player
+    def update(self, player_obj, wall_grid, flow_field=None): # Enemy now targets only its own player
         original_pos = self.rect.topleft
         dx, dy = 0, 0
 
@@ -1395,7 +1474,10 @@ class Enemy(GameObject):
             self.state = "patrol"
             self.speed = ENEMY_SPEED_PATROL
 
-        if self.state == "chase":
+        if self.state == "chase" and flow_field is not None:
+            self.follow_flow_field(player_obj, wall_grid, flow_field)
+            return
+        elif self.state == "chase":
             dx = player_obj.rect.centerx - self.rect.centerx
             dy = player_obj.rect.centery - self.rect.centery
         elif self.state == "patrol":
@@ -1420,18 +1502,35 @@ class Enemy(GameObject):
         self.rect.x += int(move_x)
         self.rect.y += int(move_y)
 
-        collided = False
-        for wall_obj in walls_list:
-            if not isinstance(wall_obj, BreakableWall) and self.rect.colliderect(wall_obj.rect):
-                collided = True
-                break
-        
-        if collided:
+        # Enemies pass through breakable walls
+        if wall_grid.blocks(self.rect, breakable=False):
             self.rect.topleft = original_pos
 
         self.rect.left = max(0, min(self.rect.left, game_width_single_maze - self.rect.width))
         self.rect.top = max(0, min(self.rect.top, game_area_height_single_maze - self.rect.height))
 
+    def follow_flow_field(self, player_obj, wall_grid, flow_field):
+        """Chase step along the maze's flow field: toward the center of the next tile on the path to the player."""
+        row, col = get_tile_indices(*self.rect.center)
+        step_x, step_y = flow_field.step_at(row, col)
+        if (step_x, step_y) == NO_DIRECTION: # On the player's tile, or cut off from it
+            target_x, target_y = player_obj.rect.center
+        else:
+            target_x, target_y = get_tile_center_pixel_coords(row + step_y, col + step_x)
+
+        # One axis at a time, so an enemy slightly off a corridor's center line slides along the wall
+        # into it instead of stopping dead
+        step = int(max(-self.speed, min(self.speed, target_x - self.rect.centerx)))
+        if step:
+            self.rect.x += step
+            if wall_grid.blocks(self.rect, breakable=False):
+                self.rect.x -= step
+        step = int(max(-self.speed, min(self.speed, target_y - self.rect.centery)))
+        if step:
+            self.rect.y += step
+            if wall_grid.blocks(self.rect, breakable=False):
+                self.rect.y -= step
+
     def perform_attack(self, player_obj):
         now = pygame.time.get_ticks()
         if now - self.last_attack_time > ENEMY_ATTACK_COOLDOWN_MS:
@@ -1441,9 +1540,8 @@ class Enemy(GameObject):
                 player_obj.take_damage(ENEMY_ATTACK_DAMAGE)
                 self.last_attack_time = now
 
-    def draw(self, surface, x_offset=0):
-        draw_rect = self.rect.copy()
-        draw_rect.x += x_offset
+    def draw(self, surface, x_offset=0, alpha=1.0):
+        draw_rect = self.render_rect(x_offset, alpha)
         pygame.draw.rect(surface, self.color, draw_rect)
         if self.health < self.max_health:
             health_bar_width = self.rect.width
@@ -1522,12 +1620,234 @@ class Collectible(GameObject):
         self.rect.y = state['y']
         self.item_type = state['item_type'] # This is redundant but kept for consistency
 
+TILE_FLOOR = 0
+TILE_WALL = 1
+TILE_BREAKABLE = 2
+
+class TileGrid:
+    """What each tile of a maze holds (TILE_FLOOR, TILE_WALL or TILE_BREAKABLE), one byte per tile.
+
+    Collision checks look only at the few tiles a rect overlaps instead of every wall of the level.
+    """
+    def __init__(self, map_layout=()):
+        self.rows = len(map_layout)
+        self.cols = max((len(row) for row in map_layout), default=0)
+        self.cells = bytearray(self.rows * self.cols)
+        self.version = 0 # Bumped by every set(), so what is derived from the grid knows when to rebuild
+        for r_idx, row in enumerate(map_layout):
+            for c_idx, tile_char in enumerate(row):
+                if tile_char == '#':
+                    self.cells[r_idx * self.cols + c_idx] = TILE_WALL
+                elif tile_char == 'B':
+                    self.cells[r_idx * self.cols + c_idx] = TILE_BREAKABLE
+
+    def load_cells(self, rows, cols, cells):
+        """Replaces the whole grid with a copy of `cells` (rows * cols bytes, as in self.cells)."""
+        self.rows = rows
+        self.cols = cols
+        self.cells = bytearray(cells)
+        self.version += 1
+
+    def set(self, row, col, tile):
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            self.cells[row * self.cols + col] = tile
+            self.version += 1
+
+    def blocks(self, rect, breakable=True):
+        """True if `rect` (maze coordinates) overlaps a wall, or a breakable wall unless `breakable` is False."""
+        first_col = max(0, rect.left // TILE_SIZE)
+        last_col = min(self.cols - 1, (rect.right - 1) // TILE_SIZE)
+        first_row = max(0, rect.top // TILE_SIZE)
+        last_row = min(self.rows - 1, (rect.bottom - 1) // TILE_SIZE)
+        if first_col > last_col:
+            return False # Left or right of the maze
+        for row in range(first_row, last_row + 1):
+            row_start = row * self.cols
+            for tile in self.cells[row_start + first_col:row_start + last_col + 1]:
+                if tile == TILE_WALL or (tile == TILE_BREAKABLE and breakable):
+                    return True
+        return False
+
+FLOW_DIRECTIONS = (UP, DOWN, LEFT, RIGHT)
+
+class FlowField:
+    """The first step of a shortest path to one target tile from every tile of a maze.
+
+    Built by a breadth-first search from the target over a TileGrid; enemies walk through breakable
+    walls, so only TILE_WALL blocks. One field is shared by all the enemies of a maze, which makes
+    chasing a single lookup per enemy per step.
+    """
+    def __init__(self, wall_grid, target_row, target_col):
+        self.target = (target_row, target_col)
+        self.grid_version = wall_grid.version
+        self.rows = wall_grid.rows
+        self.cols = wall_grid.cols
+        self.steps = bytearray(self.rows * self.cols) # 1 + index into FLOW_DIRECTIONS; 0: target or no path
+
+        if not (0 <= target_row < self.rows and 0 <= target_col < self.cols):
+            return
+        cells = wall_grid.cells
+        visited = bytearray(self.rows * self.cols)
+        queue = [target_row * self.cols + target_col]
+        visited[queue[0]] = 1
+        for index in queue: # The list grows while it is walked: a FIFO queue without popping
+            row, col = divmod(index, self.cols)
+            for code, (dx, dy) in enumerate(FLOW_DIRECTIONS, 1):
+                # The neighbor that reaches this tile by stepping (dx, dy)
+                n_row, n_col = row - dy, col - dx
+                if 0 <= n_row < self.rows and 0 <= n_col < self.cols:
+                    neighbor = n_row * self.cols + n_col
+                    if not visited[neighbor] and cells[neighbor] != TILE_WALL:
+                        visited[neighbor] = 1
+                        self.steps[neighbor] = code
+                        queue.append(neighbor)
+
+    def step_at(self, row, col):
+        """The (dx, dy) step toward the target from (row, col); NO_DIRECTION on the target or where it can't be reached."""
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            code = self.steps[row * self.cols + col]
+            if code:
+                return FLOW_DIRECTIONS[code - 1]
+        return NO_DIRECTION
+
+class SpatialHash:
+    """Objects bucketed by the tile their rect's center is on, for neighborhood queries.
+
+    No object is larger than a tile, so one that overlaps a rect has its center at most one tile
+    outside of it. Objects that move must be passed to move() after every step.
+    """
+    def __init__(self, objects=()):
+        self.buckets = {} # (row, col) -> {obj: None}, kept in insertion order
+        self.cells = {} # obj -> the (row, col) it is filed under
+        for obj in objects:
+            self.add(obj)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def add(self, obj):
+        cell = get_tile_indices(*obj.rect.center)
+        self.cells[obj] = cell
+        self.buckets.setdefault(cell, {})[obj] = None
+
+    def remove(self, obj):
+        cell = self.cells.pop(obj, None)
+        if cell is not None:
+            bucket = self.buckets[cell]
+            del bucket[obj]
+            if not bucket:
+                del self.buckets[cell]
+
+    def move(self, obj):
+        if self.cells.get(obj) != get_tile_indices(*obj.rect.center):
+            self.remove(obj)
+            self.add(obj)
+
+    def query_rect(self, rect):
+        """The objects whose rect overlaps `rect`."""
+        first_row, first_col = get_tile_indices(rect.left, rect.top)
+        last_row, last_col = get_tile_indices(rect.right - 1, rect.bottom - 1)
+        return [obj for obj in self._near(first_row - 1, last_row + 1, first_col - 1, last_col + 1)
+                if rect.colliderect(obj.rect)]
+
+    def query_radius(self, x, y, radius):
+        """The objects whose rect's center is less than `radius` away from (x, y)."""
+        first_row, first_col = get_tile_indices(x - radius, y - radius)
+        last_row, last_col = get_tile_indices(x + radius, y + radius)
+        return [obj for obj in self._near(first_row, last_row, first_col, last_col)
+                if math.hypot(obj.rect.centerx - x, obj.rect.centery - y) < radius]
+
+    def _near(self, first_row, last_row, first_col, last_col):
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                bucket = self.buckets.get((row, col))
+                if bucket:
+                    yield from bucket
+
+class CompiledLevel:
+    """A level map parsed once: everything MazeState.load_level needs to build the level, without the map.
+
+    Only tuples, strings and bytes, so one CompiledLevel is shared by every maze that loads the level
+    (see compiled_level); the mazes build their own walls, enemies and collectibles from it.
+    """
+    def __init__(self, level_map):
+        self.map_hash = level_map_hash(level_map)
+        layout = [list(row) for row in level_map]
+        walls = [] # (row, col, breakable) in map order
+        enemy_spawns = [] # Enemy centers
+        collectible_spawns = [] # (x, y, item_type), tile top-lefts
+        self.player_spawn = None # Player center; None keeps the maze's current player
+        self.exit_rect = None # (x, y, width, height)
+        self.electricity_spawn = None
+        item_types = {'G': 'gold', 'H': 'health', 'K': 'key'}
+
+        for r_idx, row in enumerate(layout):
+            for c_idx, tile_char in enumerate(row):
+                x, y = get_tile_pixel_coords(r_idx, c_idx)
+                if tile_char == '#' or tile_char == 'B':
+                    walls.append((r_idx, c_idx, tile_char == 'B'))
+                elif tile_char == 'P':
+                    self.player_spawn = (x + TILE_SIZE // 2, y + TILE_SIZE // 2)
+                elif tile_char == 'E':
+                    enemy_spawns.append((x + TILE_SIZE // 2, y + TILE_SIZE // 2))
+                elif tile_char in item_types:
+                    collectible_spawns.append((x, y, item_types[tile_char]))
+                elif tile_char == 'L':
+                    self.exit_rect = (x, y, TILE_SIZE, TILE_SIZE)
+                elif tile_char == 'Z':
+                    self.electricity_spawn = (x + TILE_SIZE // 2, y + TILE_SIZE // 2)
+                    layout[r_idx][c_idx] = '.'
+
+        if self.electricity_spawn is None:
+            self.electricity_spawn = self._fallback_electricity_spawn(layout)
+
+        self.layout = tuple(''.join(row) for row in layout) # With the 'Z' tile cleared
+        self.walls = tuple(walls)
+        self.enemy_spawns = tuple(enemy_spawns)
+        self.collectible_spawns = tuple(collectible_spawns)
+        grid = TileGrid(layout)
+        self.rows = grid.rows
+        self.cols = grid.cols
+        self.cells = bytes(grid.cells)
+
+    def _fallback_electricity_spawn(self, layout):
+        """A level without a 'Z' tile: the first floor tile of the bottom-right 2x2 corner, else the last tile."""
+        fallback_col = maze_width_tiles - 2
+        fallback_row = maze_height_tiles - 2
+        for r_offset in range(2):
+            for c_offset in range(2):
+                r = min(maze_height_tiles - 1, fallback_row + r_offset)
+                c = min(maze_width_tiles - 1, fallback_col + c_offset)
+                if layout[r][c] == '.':
+                    fx, fy = get_tile_pixel_coords(r, c)
+                    return (fx + TILE_SIZE // 2, fy + TILE_SIZE // 2)
+        fx, fy = get_tile_pixel_coords(maze_height_tiles - 1, maze_width_tiles - 1)
+        return (fx + TILE_SIZE // 2, fy + TILE_SIZE // 2)
+
+compiled_levels = {} # (level index, map hash) -> CompiledLevel, filled by compiled_level()
+
+def compiled_level(level_index, level_map):
+    """The CompiledLevel of `level_map`, parsed on its first load only. Keyed by content too, so a
+    changed map is parsed again instead of loading a stale copy."""
+    key = (level_index, level_map_hash(level_map))
+    level = compiled_levels.get(key)
+    if level is None:
+        level = compiled_levels[key] = CompiledLevel(level_map)
+    return level
+
 class MazeState:
-    def __init__(self, player_id):
+    def __init__(self, player_id, electricity_particles=None):
         self.player = None
         self.enemies = []
         self.collectibles = []
         self.walls = []
+        self.wall_grid = TileGrid() # Same walls as self.walls, by tile, for collision checks
+        # Server: enemies, collectibles and breakable walls by tile, for the pickup, contact and attack checks
+        self.enemy_index = SpatialHash()
+        self.collectible_index = SpatialHash()
+        self.breakable_index = SpatialHash()
+        self.flow_field = None # Server: toward the player's tile, for chasing enemies (see chase_field)
+        self.enemy_batch = None # Server with BATCHED_ENEMIES: the enemies' movement state, row i for self.enemies[i]
         self.level_exit_rect = None
         self.current_map_layout = []
         self.score = 0
@@ -1542,8 +1862,17 @@ class MazeState:
         self.level_21_initial_enemy_data = []
         self.level_21_respawn_pending = False
         self.player_id = player_id # 1 for server's maze, 2 for client's maze
+        # Each match on the multi-match server passes its own list; otherwise the global one is shared
+        self.electricity_particles = electricity_particles if electricity_particles is not None else electricity_particles_global
+        self.level_map_hash = 0
+        self.wall_changes = {} # (row, col) -> {'health': h} for every breakable wall hit this level
+        self.last_input_seq = 0 # Newest client input applied to this maze's player (server), or acknowledged (client)
+        self.next_entity_id = 1 # Never reset, so an ID is not reused for a different entity in a later level
+        self.loaded_manifest = None # Client: the level manifest the walls were last built from
+        self.events = [] # Server: gameplay events not yet handed to the event streams (see take_events)
 
     def load_level(self, level_map):
+        level = compiled_level(self.current_level_index, level_map)
         self.enemies.clear()
         self.collectibles.clear()
         self.walls.clear()
@@ -1556,61 +1885,29 @@ class MazeState:
         self.level_21_initial_enemy_data.clear()
         self.level_21_respawn_pending = False
 
-        self.current_map_layout = [list(row) for row in level_map]
-
-        temp_enemies = []
-        electricity_z_found = False
+        self.current_map_layout = [list(row) for row in level.layout]
+        self.level_map_hash = level.map_hash
+        self.wall_changes = {}
+
+        self._build_walls(level)
+        if level.player_spawn:
+            self.player = Player(*level.player_spawn, self.player_id)
+        for x, y in level.enemy_spawns:
+            self.enemies.append(self._assign_entity_id(Enemy(x, y)))
+            if self.current_level_index == 20: # Level 21 is index 20
+                self.level_21_initial_enemy_data.append(('E', x, y))
+        for x, y, item_type in level.collectible_spawns:
+            self.collectibles.append(self._assign_entity_id(Collectible(x, y, item_type)))
+        if level.exit_rect:
+            self.level_exit_rect = pygame.Rect(level.exit_rect)
+        self.electricity_spawn_location = level.electricity_spawn
 
-        for r_idx, row in enumerate(self.current_map_layout):
-            for c_idx, tile_char in enumerate(row):
-                x, y = get_tile_pixel_coords(r_idx, c_idx) # Use 0 offset for internal maze coords
-                
-                if tile_char == '#':
-                    self.walls.append(Wall(x, y))
-                elif tile_char == 'B':
-                    self.walls.append(BreakableWall(x, y, self.current_map_layout, r_idx, c_idx))
-                elif tile_char == 'P':
-                    # Player starts at 'P'
-                    self.player = Player(x + TILE_SIZE // 2, y + TILE_SIZE // 2, self.player_id)
-                elif tile_char == 'E':
-                    temp_enemies.append(Enemy(x + TILE_SIZE // 2, y + TILE_SIZE // 2))
-                    if self.current_level_index == 20: # Level 21 is index 20
-                        self.level_21_initial_enemy_data.append(('E', x + TILE_SIZE // 2, y + TILE_SIZE // 2))
-                elif tile_char == 'G':
-                    self.collectibles.append(Collectible(x, y, 'gold'))
-                elif tile_char == 'H':
-                    self.collectibles.append(Collectible(x, y, 'health'))
-                elif tile_char == 'K':
-                    self.collectibles.append(Collectible(x, y, 'key'))
-                elif tile_char == 'L':
-                    self.level_exit_rect = pygame.Rect(x, y, TILE_SIZE, TILE_SIZE)
-                elif tile_char == 'Z':
-                    self.electricity_spawn_location = (x + TILE_SIZE // 2, y + TILE_SIZE // 2)
-                    electricity_z_found = True
-                    self.current_map_layout[r_idx][c_idx] = '.'
-
-        self.enemies.extend(temp_enemies)
         self.initial_enemy_count = len(self.enemies)
-
-        if not electricity_z_found:
-            fallback_col = maze_width_tiles - 2
-            fallback_row = maze_height_tiles - 2
-            
-            found_fallback = False
-            for r_offset in range(2):
-                for c_offset in range(2):
-                    r = min(maze_height_tiles - 1, fallback_row + r_offset)
-                    c = min(maze_width_tiles - 1, fallback_col + c_offset)
-                    if self.current_map_layout[r][c] == '.':
-                        fx, fy = get_tile_pixel_coords(r, c)
-                        self.electricity_spawn_location = (fx + TILE_SIZE // 2, fy + TILE_SIZE // 2)
-                        found_fallback = True
-                        break
-                if found_fallback: break
-            
-            if not found_fallback:
-                fx, fy = get_tile_pixel_coords(maze_height_tiles - 1, maze_width_tiles - 1)
-                self.electricity_spawn_location = (fx + TILE_SIZE // 2, fy + TILE_SIZE // 2)
+        self.enemy_index = SpatialHash(self.enemies)
+        self.collectible_index = SpatialHash(self.collectibles)
+        self.breakable_index = SpatialHash(w for w in self.walls if isinstance(w, BreakableWall))
+        self.flow_field = None
+        self.enemy_batch = self._build_enemy_batch() if BATCHED_ENEMIES else None
 
         # Restore player's current stats
         if self.player:
@@ -1618,58 +1915,147 @@ class MazeState:
             self.player.score = self.score
             self.player.keys = self.keys
 
+    def _build_walls(self, level):
+        """The level's walls and wall grid; breakable walls keep a reference to self.current_map_layout."""
+        for row, col, breakable in level.walls:
+            x, y = get_tile_pixel_coords(row, col)
+            if breakable:
+                self.walls.append(BreakableWall(x, y, self.current_map_layout, row, col))
+            else:
+                self.walls.append(Wall(x, y))
+        self.wall_grid = TileGrid()
+        self.wall_grid.load_cells(level.rows, level.cols, level.cells)
+
+    def _assign_entity_id(self, obj):
+        obj.entity_id = self.next_entity_id
+        self.next_entity_id += 1
+        return obj
+
+    def chase_field(self):
+        """The flow field toward the player's tile, rebuilt only when the player changed tile or a wall fell."""
+        target = get_tile_indices(*self.player.rect.center)
+        field = self.flow_field
+        if field is None or field.target != target or field.grid_version != self.wall_grid.version:
+            self.flow_field = FlowField(self.wall_grid, *target)
+        return self.flow_field
+
+    def _build_enemy_batch(self):
+        if EnemyBatch is None:
+            print("Warning: --batched-enemies needs NumPy; simulating enemies one by one.")
+            return None
+        batch = EnemyBatch(TILE_SIZE, TILE_SIZE - int(4 * (TILE_SIZE / 40.0)), game_width_single_maze,
+                           game_area_height_single_maze, ENEMY_SPEED_PATROL, ENEMY_SPEED_CHASE, TILE_SIZE * 5,
+                           ENEMY_PATROL_DISTANCE, ENEMY_ATTACK_COOLDOWN_MS, FLOW_DIRECTIONS)
+        batch.set_walls(self.wall_grid.cells, self.wall_grid.rows, self.wall_grid.cols, TILE_WALL) # Enemies pass through breakable walls
+        for enemy in self.enemies:
+            self._add_to_enemy_batch(batch, enemy)
+        return batch
+
+    def _add_to_enemy_batch(self, batch, enemy):
+        batch.append(enemy.rect.x, enemy.rect.y, enemy.patrol_target[0], enemy.patrol_target[1],
+                     enemy.next_patrol_move_time, enemy.last_attack_time)
+
+    def _spawn_enemy(self, x, y):
+        enemy = self._assign_entity_id(Enemy(x, y))
+        self.enemies.append(enemy)
+        self.enemy_index.add(enemy)
+        if self.enemy_batch is not None:
+            self._add_to_enemy_batch(self.enemy_batch, enemy)
+
+    def _update_enemy_batch(self):
+        """Steps every enemy through the batch and copies what changed back onto the Enemy objects, which
+        the snapshots, the spatial hash and the player's attacks still use."""
+        batch = self.enemy_batch
+        hits = batch.update(pygame.time.get_ticks(), tuple(self.player.rect), self.chase_field().steps)
+        for i in batch.changed.tolist():
+            enemy = self.enemies[i]
+            enemy.rect.topleft = (int(batch.x[i]), int(batch.y[i]))
+            enemy.state = "chase" if batch.state[i] else "patrol"
+            enemy.speed = ENEMY_SPEED_CHASE if batch.state[i] else ENEMY_SPEED_PATROL
+            enemy.patrol_target = (int(batch.target_x[i]), int(batch.target_y[i]))
+            enemy.next_patrol_move_time = int(batch.next_patrol[i])
+            self.enemy_index.move(enemy)
+        if hits:
+            self.health = max(0, self.health - hits * ENEMY_ATTACK_DAMAGE)
+            self.player.health = self.health # Update player's health for UI
+
     def update_game_logic(self):
         # Player update
         if self.player:
-            self.player.update(self.walls)
-
-        # Collectibles collision
-        for collectible in self.collectibles[:]:
-            if self.player and self.player.rect.colliderect(collectible.rect):
-                if collectible.item_type == 'gold':
-                    self.score += GOLD_VALUE
-                elif collectible.item_type == 'health':
-                    self.health += HEALTH_POTION_HEAL
-                    if self.health > 100: self.health = 100
-                    self.player.health = self.health # Update player's health for UI
-                elif collectible.item_type == 'key':
-                    self.keys += 1
-                    print(f"DEBUG (Server): Player {self.player_id} collected a key. Keys: {self.keys}") # DEBUG PRINT
-                self.collectibles.remove(collectible)
+            self.player.update(self.wall_grid)
+
+        # Collectibles collision: only the ones on the tiles around the player
+        touched_collectibles = self.collectible_index.query_rect(self.player.rect) if self.player else []
+        for collectible in touched_collectibles:
+            if collectible.item_type == 'gold':
+                self.score += GOLD_VALUE
+            elif collectible.item_type == 'health':
+                self.health += HEALTH_POTION_HEAL
+                if self.health > 100: self.health = 100
+                self.player.health = self.health # Update player's health for UI
+            elif collectible.item_type == 'key':
+                self.keys += 1
+                print(f"DEBUG (Server): Player {self.player_id} collected a key. Keys: {self.keys}") # DEBUG PRINT
+            self.collectibles.remove(collectible)
+            self.collectible_index.remove(collectible)
+            self.add_event('collectible_picked', collectible.rect.x, collectible.rect.y, collectible.entity_id,
+                           ITEM_TYPES.index(collectible.item_type))
         
-        # Enemy updates and collision
+        # Enemy updates
+        if self.enemy_batch is not None:
+            if self.player and self.enemies:
+                self._update_enemy_batch() # Movement and melee hits, all enemies at once
+            touching_enemies = []
+        else:
+            flow_field = self.chase_field() if self.player and self.enemies else None
+            for enemy in self.enemies:
+                enemy.update(self.player, self.wall_grid, flow_field) # Enemies now target only their own player
+                self.enemy_index.move(enemy)
+
+            # Enemy collision: only the enemies on the tiles around the player
+            touching_enemies = self.enemy_index.query_rect(self.player.rect) if self.player else []
+        for enemy in touching_enemies:
+            now = pygame.time.get_ticks()
+            if now - enemy.last_attack_time > ENEMY_ATTACK_COOLDOWN_MS: # Check cooldown
+                self.health -= ENEMY_ATTACK_DAMAGE
+                self.player.health = self.health # Update player's health for UI
+                enemy.last_attack_time = now
+                print(f"DEBUG (Server): Player {self.player_id} took {ENEMY_ATTACK_DAMAGE} damage. Current health: {self.health}") # DEBUG PRINT
+                if self.health < 0: self.health = 0
+
+        if self.enemy_batch is not None and any(enemy.health <= 0 for enemy in self.enemies):
+            self.enemy_batch.keep([enemy.health > 0 for enemy in self.enemies])
         for enemy in self.enemies[:]: # Iterate over copy for safe removal
-            enemy.update(self.player, self.walls) # Enemies now target only their own player
-            
-            if self.player and enemy.rect.colliderect(self.player.rect): # Check for collision
-                now = pygame.time.get_ticks()
-                if now - enemy.last_attack_time > ENEMY_ATTACK_COOLDOWN_MS: # Check cooldown
-                    self.health -= ENEMY_ATTACK_DAMAGE
-                    self.player.health = self.health # Update player's health for UI
-                    enemy.last_attack_time = now
-                    print(f"DEBUG (Server): Player {self.player_id} took {ENEMY_ATTACK_DAMAGE} damage. Current health: {self.health}") # DEBUG PRINT
-                    if self.health < 0: self.health = 0
-
             if enemy.health <= 0:
                 self.enemies.remove(enemy)
+                self.enemy_index.remove(enemy)
                 self.score += 50
+                self.add_event('enemy_killed', enemy.rect.x, enemy.rect.y, enemy.entity_id)
                 
                 if self.initial_enemy_count > 0 and len(self.enemies) == 0 and not self.bonus_enemies_spawned_this_level:
                     self.trigger_electricity_event()
 
-        # Breakable wall destruction
+        # Breakable wall damage and destruction (the only wall changes sent to the client)
         for wall_obj in self.walls[:]:
-            if isinstance(wall_obj, BreakableWall) and wall_obj.health <= 0:
-                self.walls.remove(wall_obj)
-                self.current_map_layout[wall_obj.row][wall_obj.col] = '.'
-                self.score += 10 # Score for destroying a wall
+            if isinstance(wall_obj, BreakableWall) and wall_obj.health < wall_obj.max_health:
+                tile = (wall_obj.row, wall_obj.col)
+                health = max(0, wall_obj.health)
+                if self.wall_changes.get(tile, {}).get('health') != health:
+                    self.wall_changes[tile] = {'health': health}
+                if wall_obj.health <= 0:
+                    self.walls.remove(wall_obj)
+                    self.breakable_index.remove(wall_obj)
+                    self.current_map_layout[wall_obj.row][wall_obj.col] = '.'
+                    self.wall_grid.set(wall_obj.row, wall_obj.col, TILE_FLOOR)
+                    self.score += 10 # Score for destroying a wall
+                    self.add_event('wall_destroyed', wall_obj.rect.x, wall_obj.rect.y)
 
         # Update electricity particles if active
         if self.electricity_active:
-            for p in electricity_particles_global[:]: # Electricity particles are global for now
+            for p in self.electricity_particles[:]:
                 p.update()
                 if p.lifespan <= 0:
-                    electricity_particles_global.remove(p)
+                    self.electricity_particles.remove(p)
 
             if pygame.time.get_ticks() - self.electricity_spawn_time > ELECTRICITY_EFFECT_DURATION_MS:
                 self.electricity_active = False
@@ -1678,7 +2064,7 @@ class MazeState:
                     for enemy_data in self.level_21_initial_enemy_data:
                         spawn_x = self.electricity_spawn_location[0] + random.randint(-TILE_SIZE//2, TILE_SIZE//2)
                         spawn_y = self.electricity_spawn_location[1] + random.randint(-TILE_SIZE//2, TILE_SIZE//2)
-                        self.enemies.append(Enemy(spawn_x, spawn_y))
+                        self._spawn_enemy(spawn_x, spawn_y)
                     
                     self.level_21_respawn_pending = False
                     self.initial_enemy_count = len(self.enemies)
@@ -1688,7 +2074,7 @@ class MazeState:
                     for _ in range(BONUS_ENEMIES_TO_SPAWN):
                         spawn_x = self.electricity_spawn_location[0] + random.randint(-TILE_SIZE//2, TILE_SIZE//2)
                         spawn_y = self.electricity_spawn_location[1] + random.randint(-TILE_SIZE//2, TILE_SIZE//2)
-                        self.enemies.append(Enemy(spawn_x, spawn_y))
+                        self._spawn_enemy(spawn_x, spawn_y)
                     self.initial_enemy_count = len(self.enemies)
                     self.bonus_enemies_spawned_this_level = False
 
@@ -1696,26 +2082,30 @@ class MazeState:
         if not self.bonus_enemies_spawned_this_level:
             self.electricity_active = True
             self.electricity_spawn_time = pygame.time.get_ticks()
-            electricity_particles_global.clear() # Clear global particles
+            self.electricity_particles.clear()
             for _ in range(ELECTRICITY_PARTICLE_COUNT):
-                electricity_particles_global.append(ElectricityParticle(self.electricity_spawn_location[0], self.electricity_spawn_location[1]))
+                self.electricity_particles.append(ElectricityParticle(self.electricity_spawn_location[0], self.electricity_spawn_location[1]))
             
             self.bonus_enemies_spawned_this_level = True
+            self.add_event('electricity_triggered', *self.electricity_spawn_location)
 
             if self.current_level_index == 20:
                 self.level_21_respawn_pending = True
 
+    def add_event(self, event_type, x=0, y=0, entity_id=0, value=0):
+        """Records a one-off gameplay event for the clients (fields as in GAME_EVENT_FIELD)."""
+        self.events.append({'type': event_type, 'maze': self.player_id, 'entity_id': entity_id,
+                            'x': int(x), 'y': int(y), 'value': value})
+
+    def take_events(self):
+        events, self.events = self.events, []
+        return events
+
     def get_serializable_state(self):
+        # Entity tables are keyed by entity ID so snapshot deltas can address single entities
         players_state = self.player.get_state() if self.player else None
-        enemies_state = [e.get_state() for e in self.enemies]
-        collectibles_state = [c.get_state() for c in self.collectibles]
-        
-        walls_state = []
-        for w in self.walls:
-            w_state = w.get_state()
-            if isinstance(w, BreakableWall):
-                w_state['is_breakable'] = True # Mark breakable walls
-            walls_state.append(w_state)
+        enemies_state = {e.entity_id: e.get_state() for e in self.enemies}
+        collectibles_state = {c.entity_id: c.get_state() for c in self.collectibles}
 
         exit_rect_state = None
         if self.level_exit_rect:
@@ -1725,7 +2115,9 @@ class MazeState:
             'player': players_state,
             'enemies': enemies_state,
             'collectibles': collectibles_state,
-            'walls': walls_state,
+            # Walls are rebuilt by the client from the manifest; only breakable-wall hits are sent
+            'level_manifest': {'level_index': self.current_level_index, 'map_hash': self.level_map_hash},
+            'wall_changes': dict(self.wall_changes),
             'score': self.score,
             'health': self.health, # Ensure MazeState's health is serialized
             'keys': self.keys,
@@ -1735,48 +2127,121 @@ class MazeState:
             'electricity_spawn_time': self.electricity_spawn_time,
             'bonus_enemies_spawned_this_level': self.bonus_enemies_spawned_this_level,
             'level_21_respawn_pending': self.level_21_respawn_pending,
-            'player_id': self.player_id
+            'player_id': self.player_id,
+            'last_input_seq': self.last_input_seq
         }
 
     def set_state(self, state):
         # Update MazeState's core attributes first
+        self._set_scalar_state(state)
+        self._set_player_state(state)
+
+        for table_key, objects, factory in self._entity_tables():
+            self._sync_table(objects, state.get(table_key, {}), factory)
+
+        if state['level_manifest'] != self.loaded_manifest:
+            self.load_level_geometry(state['level_manifest'])
+        self._apply_wall_changes(state['wall_changes'], state['wall_changes'].keys())
+
+    def apply_delta(self, delta, state):
+        """Patches this view in place; `state` is the full maze state `delta` leads to."""
+        self._set_scalar_state(state)
+        replaced = delta.get('set', {}).keys()
+        table_deltas = delta.get('sub', {})
+        changed_keys = replaced | table_deltas.keys()
+        if 'player' in changed_keys or 'health' in changed_keys:
+            self._set_player_state(state)
+
+        for table_key, objects, factory in self._entity_tables():
+            if table_key in replaced:
+                self._sync_table(objects, state[table_key], factory)
+            elif table_key in table_deltas:
+                self._patch_table(objects, table_deltas[table_key], state[table_key], factory)
+
+        if 'level_manifest' in changed_keys:
+            # New level: rebuild the walls locally and replay every hit recorded for it so far
+            self.load_level_geometry(state['level_manifest'])
+            self._apply_wall_changes(state['wall_changes'], state['wall_changes'].keys())
+        elif 'wall_changes' in replaced:
+            self._apply_wall_changes(state['wall_changes'], state['wall_changes'].keys())
+        elif 'wall_changes' in table_deltas:
+            wall_delta = table_deltas['wall_changes']
+            self._apply_wall_changes(state['wall_changes'], wall_delta.get('set', {}).keys() | wall_delta.get('sub', {}).keys())
+
+    def _entity_tables(self):
+        """(snapshot key, object list, factory) for every table of entities keyed by entity ID."""
+        return (('enemies', self.enemies, lambda e_state: Enemy(0, 0)),
+                ('collectibles', self.collectibles, lambda c_state: Collectible(0, 0, c_state['item_type'])))
+
+    def _sync_table(self, objects, table_state, factory):
+        """Makes `objects` match a whole table, reusing the objects whose entity ID is still in it."""
+        objects_by_id = {obj.entity_id: obj for obj in objects}
+        synced = []
+        for entity_id, obj_state in table_state.items():
+            obj = objects_by_id.get(entity_id)
+            if obj is None:
+                obj = factory(obj_state)
+                obj.entity_id = entity_id
+            obj.set_state(obj_state)
+            synced.append(obj)
+        objects[:] = synced
+
+    def _patch_table(self, objects, table_delta, table_state, factory):
+        """Applies a table delta to the matching objects; only spawned and despawned entities create or drop objects."""
+        removed = set(table_delta.get('del', ()))
+        if removed:
+            objects[:] = [obj for obj in objects if obj.entity_id not in removed]
+
+        updated = table_delta.get('set', {}).keys() | table_delta.get('sub', {}).keys()
+        if updated:
+            objects_by_id = {obj.entity_id: obj for obj in objects}
+            for entity_id in updated:
+                obj_state = table_state[entity_id]
+                obj = objects_by_id.get(entity_id)
+                if obj is None:
+                    obj = factory(obj_state)
+                    obj.entity_id = entity_id
+                    objects.append(obj)
+                obj.set_state(obj_state)
+
+    def load_level_geometry(self, manifest):
+        """Client side: builds the static walls from the local copy of the level named by a manifest."""
+        level_index = manifest['level_index']
+        level = compiled_level(level_index, ALL_LEVEL_MAPS[level_index])
+        if level.map_hash != manifest['map_hash']:
+            print(f"[CLIENT] Warning: local map for level {level_index + 1} differs from the server's, walls may not match")
+
+        self.current_map_layout = [list(row) for row in level.layout]
+        self.level_map_hash = manifest['map_hash']
+        self.loaded_manifest = manifest
+        self.walls.clear()
+        self._build_walls(level)
+
+    def _apply_wall_changes(self, wall_changes, tiles):
+        """Sets the health of the breakable walls at `tiles`; walls down to 0 health are removed."""
+        walls_by_tile = {(w.row, w.col): w for w in self.walls if isinstance(w, BreakableWall)}
+        destroyed = set()
+        for tile in tiles:
+            wall_obj = walls_by_tile.get(tile)
+            if wall_obj is None:
+                continue
+            health = wall_changes[tile]['health']
+            if health < wall_obj.health:
+                wall_obj.last_hit_time = pygame.time.get_ticks() # Keep the hit flash on the client
+            wall_obj.health = health
+            if health <= 0:
+                destroyed.add(wall_obj)
+                self.current_map_layout[wall_obj.row][wall_obj.col] = '.'
+                self.wall_grid.set(wall_obj.row, wall_obj.col, TILE_FLOOR)
+        if destroyed:
+            self.walls[:] = [w for w in self.walls if w not in destroyed]
+
+    def _set_scalar_state(self, state):
         self.score = state.get('score', 0)
         self.health = state.get('health', 100) # Update MazeState's health from received state
         self.keys = state.get('keys', 0)
         self.current_level_index = state.get('current_level_index', 0)
 
-        if state['player']:
-            if self.player:
-                self.player.set_state(state['player'])
-            else: # Create player if it doesn't exist (e.g., on initial sync)
-                self.player = Player(state['player']['x'], state['player']['y'], state['player']['player_id'])
-                self.player.set_state(state['player'])
-            # Ensure player's health matches MazeState's health after setting player state
-            self.player.health = self.health
-        
-        self.enemies.clear()
-        for e_state in state.get('enemies', []):
-            new_enemy = Enemy(0, 0)
-            new_enemy.set_state(e_state)
-            self.enemies.append(new_enemy)
-
-        self.collectibles.clear()
-        for c_state in state.get('collectibles', []):
-            new_collectible = Collectible(0, 0, c_state['item_type'])
-            new_collectible.set_state(c_state)
-            self.collectibles.append(new_collectible)
-
-        new_walls = []
-        for w_state in state.get('walls', []):
-            if w_state.get('is_breakable'):
-                new_wall = BreakableWall(0, 0, None, w_state['row'], w_state['col'])
-                new_wall.set_state(w_state)
-            else:
-                new_wall = Wall(0, 0)
-                new_wall.set_state(w_state)
-            new_walls.append(new_wall)
-        self.walls[:] = new_walls
-
         exit_rect_state = state.get('level_exit_rect')
         if exit_rect_state:
             self.level_exit_rect = pygame.Rect(exit_rect_state[0], exit_rect_state[1], exit_rect_state[2], exit_rect_state[3])
@@ -1787,6 +2252,17 @@ class MazeState:
         self.electricity_spawn_time = state.get('electricity_spawn_time', 0)
         self.bonus_enemies_spawned_this_level = state.get('bonus_enemies_spawned_this_level', False)
         self.level_21_respawn_pending = state.get('level_21_respawn_pending', False)
+        self.last_input_seq = state.get('last_input_seq', 0)
+
+    def _set_player_state(self, state):
+        if state['player']:
+            if self.player:
+                self.player.set_state(state['player'])
+            else: # Create player if it doesn't exist (e.g., on initial sync)
+                self.player = Player(state['player']['x'], state['player']['y'], state['player']['player_id'])
+                self.player.set_state(state['player'])
+            # Ensure player's health matches MazeState's health after setting player state
+            self.player.health = self.health
 
 # --- Game State Instances ---
 # Server will have two actual game states
@@ -1796,6 +2272,8 @@ maze_state_p2 = None # Client's maze and player, controlled by client input
 # Client will have two view-only game states
 maze_state_p1_view = None # View of server's maze
 maze_state_p2_view = None # View of client's own maze
+local_player_id = 2 # Client: which maze it controls, assigned by the server's welcome message
+SPECTATOR_ID = 0 # local_player_id of a client that only watches
 
 # Global electricity particles (shared for visual effect across both mazes on a screen)
 electricity_particles_global = []
@@ -1863,101 +2341,442 @@ class AnimatedCoinVisual:
 animating_coins_p1_visual = []
 animating_coins_p2_visual = []
 
-# Store previous collectible states to detect removals
-previous_collectibles_p1 = []
-previous_collectibles_p2 = []
+# --- Wire Format ---
+# Schemas for the binary messages exchanged between server and client. Bump
+# WIRE_VERSION whenever a schema changes so mismatched builds refuse to talk.
+WIRE_VERSION = 13
+MSG_SNAPSHOT = 1 # Server -> client: snapshot delta
+MSG_INPUT = 2 # Client -> server: unacknowledged numbered inputs, snapshot ack and event ack
+MSG_WELCOME = 3 # Server -> client, first message: the player slot (SPECTATOR_ID to watch), match and session token assigned to the client
+MSG_JOIN = 4 # Client -> server, first message: play, watch a match (match_id 0: any) or resume a session (session_token 0: new)
+MSG_MATCH_STATUS = 5 # Server -> client, reliable: level and game state, sent when they change
+MSG_PING = 6 # Either way, about once a second: the sender's clock in ms, for the round trip time
+MSG_PONG = 7 # Answer to MSG_PING, echoing its stamp
+
+DIRECTIONS = (NO_DIRECTION, UP, DOWN, LEFT, RIGHT)
+ITEM_TYPES = ('gold', 'health', 'key')
+EVENT_TYPES = ('collectible_picked', 'enemy_killed', 'wall_destroyed', 'electricity_triggered', 'level_advanced')
+DIRECTION_FIELD = EnumField(*DIRECTIONS)
+# One simulation step of client input: (input seq, desired direction)
+INPUT_COMMAND_FIELD = FieldType('IB', pack=lambda c: (c[0], DIRECTIONS.index(c[1])), unpack=lambda v: (v[0], DIRECTIONS[v[1]]))
+
+PLAYER_WIRE_SCHEMA = NodeSchema(fields=[
+    ('x', 'h'), ('y', 'h'), ('target_x', 'h'), ('target_y', 'h'), ('health', 'h'), ('keys', 'H'), ('score', 'i'),
+    ('desired_direction', DIRECTION_FIELD), ('current_direction', DIRECTION_FIELD),
+    ('mouth_open', '?'), ('player_id', 'B')
+])
+
+ENEMY_WIRE_RECORD = RecordSchema(
+    ('x', 'h'), ('y', 'h'), ('health', 'h'), ('state', EnumField('patrol', 'chase')),
+    ('patrol_target_x', 'i'), ('patrol_target_y', 'i'), ('next_patrol_move_time', 'I')
+)
+
+COLLECTIBLE_WIRE_RECORD = RecordSchema(
+    ('x', 'h'), ('y', 'h'), ('item_type', EnumField(*ITEM_TYPES))
+)
+
+WALL_CHANGE_WIRE_RECORD = RecordSchema(('health', 'h'))
+
+LEVEL_MANIFEST_WIRE_SCHEMA = NodeSchema(fields=[('level_index', 'B'), ('map_hash', 'I')])
+
+MAZE_WIRE_SCHEMA = NodeSchema(
+    fields=[
+        ('score', 'i'), ('health', 'h'), ('keys', 'H'), ('current_level_index', 'B'),
+        ('level_exit_rect', OptionalField(FieldType('hhhh'))),
+        ('electricity_active', '?'), ('electricity_spawn_time', 'I'),
+        ('bonus_enemies_spawned_this_level', '?'), ('level_21_respawn_pending', '?'), ('player_id', 'B'),
+        ('last_input_seq', 'I')
+    ],
+    tables={
+        'enemies': TableSchema('I', ENEMY_WIRE_RECORD), # Keyed by entity ID
+        'collectibles': TableSchema('I', COLLECTIBLE_WIRE_RECORD), # Keyed by entity ID
+        'wall_changes': TableSchema('BB', WALL_CHANGE_WIRE_RECORD) # Keyed by (row, col)
+    },
+    children={'player': PLAYER_WIRE_SCHEMA, 'level_manifest': LEVEL_MANIFEST_WIRE_SCHEMA}
+)
+
+# A numbered gameplay event: (event seq, {'type', 'maze', 'entity_id', 'x', 'y', 'value'}). 'value' is the
+# ITEM_TYPES index for collectible_picked and the new level index for level_advanced.
+GAME_EVENT_FIELD = FieldType(
+    'IBBIhhH',
+    pack=lambda e: (e[0], EVENT_TYPES.index(e[1]['type']), e[1]['maze'], e[1]['entity_id'], e[1]['x'], e[1]['y'], e[1]['value']),
+    unpack=lambda v: (v[0], {'type': EVENT_TYPES[v[1]], 'maze': v[2], 'entity_id': v[3], 'x': v[4], 'y': v[5], 'value': v[6]})
+)
+
+ELECTRICITY_PARTICLE_FIELD = FieldType('fffBBB', pack=lambda p: (p[0], p[1], p[2], *p[3]), unpack=lambda v: (v[0], v[1], v[2], v[3:]))
+
+GAME_WIRE_SCHEMA = NodeSchema(
+    fields=[
+        ('overall_game_state', 'b'), ('winning_player_id', 'B'),
+        ('electricity_particles_global', ArrayField(ELECTRICITY_PARTICLE_FIELD))
+    ],
+    children={'maze_state_p1': MAZE_WIRE_SCHEMA, 'maze_state_p2': MAZE_WIRE_SCHEMA}
+)
+
+game_wire_codec = WireCodec(WIRE_VERSION, {
+    MSG_SNAPSHOT: NodeSchema(fields=[('seq', 'I'), ('base', 'I'), ('events', ArrayField(GAME_EVENT_FIELD))],
+                             delta_children={'delta': GAME_WIRE_SCHEMA}),
+    MSG_INPUT: NodeSchema(fields=[('inputs', ArrayField(INPUT_COMMAND_FIELD)), ('ack', 'I'), ('event_ack', 'I')]),
+    # 'compression': dictionary ID of the FrameCompressor offered (join) or accepted (welcome), 0 for none
+    MSG_WELCOME: NodeSchema(fields=[('player_id', 'B'), ('match_id', 'I'), ('compression', 'I'), ('session_token', 'Q')]),
+    MSG_JOIN: NodeSchema(fields=[('spectate', '?'), ('match_id', 'I'), ('compression', 'I'), ('session_token', 'Q')]),
+    MSG_MATCH_STATUS: NodeSchema(fields=[('overall_game_state', 'b'), ('winning_player_id', 'B'), ('level_index', 'B')]),
+    MSG_PING: NodeSchema(fields=[('stamp', 'I')]),
+    MSG_PONG: NodeSchema(fields=[('stamp', 'I')])
+}, required={ # Every message is sent whole, so a missing field means a truncated or forged one
+    MSG_SNAPSHOT: ('seq', 'base', 'events', 'delta'),
+    MSG_INPUT: ('inputs', 'ack', 'event_ack'),
+    MSG_WELCOME: ('player_id', 'match_id', 'compression', 'session_token'),
+    MSG_JOIN: ('spectate', 'match_id', 'compression', 'session_token'),
+    MSG_MATCH_STATUS: ('overall_game_state', 'winning_player_id', 'level_index'),
+    MSG_PING: ('stamp',),
+    MSG_PONG: ('stamp',)
+})
 
 # --- Networking Functions ---
 
-def send_game_state(sock, state_data):
-    """Sends the entire game state from server to client."""
+def load_frame_compressor():
+    """The FrameCompressor built from SNAPSHOT_ZDICT_FILE, or None if compression is off or the dictionary is missing."""
+    if not NET_COMPRESSION:
+        return None
     try:
-        serialized_data = pickle.dumps(state_data)
-        sock.sendall(serialized_data)
-    except (socket.error, TypeError) as e:
-        print(f"Error sending game state: {e}")
-        global is_connected, game_running_flag
-        is_connected = False
-        game_running_flag = False # Stop game if connection breaks
+        with open(SNAPSHOT_ZDICT_FILE, 'rb') as zdict_file:
+            return FrameCompressor(zdict_file.read())
+    except OSError as e:
+        print(f"Frame compression disabled, cannot read {SNAPSHOT_ZDICT_FILE}: {e}")
+        return None
 
-def receive_game_state(sock):
-    """Receives game state from the server."""
-    try:
-        data = b''
-        while True:
-            packet = sock.recv(RECV_BUFFER_SIZE)
-            if not packet:
-                break
-            data += packet
-            if len(packet) < RECV_BUFFER_SIZE: # Assume packet is complete if it's smaller than buffer
-                break
-        if data:
-            return pickle.loads(data)
-    except (socket.error, EOFError, pickle.UnpicklingError) as e:
-        print(f"Error receiving game state: {e}")
-        global is_connected, game_running_flag
-        is_connected = False
-        game_running_flag = False # Stop game if connection breaks
+frame_compressor = load_frame_compressor()
+
+def offered_compression():
+    return frame_compressor.dictionary_id if frame_compressor else 0
+
+def accept_compression(offered_id):
+    """Server side: the compressor to use with a client that offered `offered_id`, or None."""
+    if frame_compressor and offered_id == frame_compressor.dictionary_id:
+        return frame_compressor
     return None
 
-def server_thread_function(conn, addr):
-    """Handles communication with a single client."""
-    global is_connected, game_running_flag, maze_state_p1, maze_state_p2, overall_game_state, winning_player_id
+class TcpGameConnection:
+    """Client/server connection over TCP: every message is one frame, delivered reliably and in order.
+
+    `metrics` covers everything sent and received. Pings from the peer are
+    answered, and its pongs recorded, inside receive_any(). An error closes
+    the connection; `open` tells the threads using it when to stop.
+    """
+
+    def __init__(self, sock, name):
+        self.sock = sock
+        self.open = True
+        self.metrics = ConnectionMetrics(name)
+        self.frame_reader = FrameReader(sock, RECV_BUFFER_SIZE, metrics=self.metrics)
+        self.compressor = None # Set once both ends agreed on compression in the join/welcome handshake
+        self.send_lock = threading.Lock() # The reader thread sends pongs while the writer sends everything else
+
+    def use_compression(self, compressor):
+        self.compressor = self.frame_reader.compressor = compressor
+
+    def send(self, msg_type, message, reliable=False):
+        try:
+            payload = self.encode(msg_type, message)
+            with self.send_lock:
+                self._send_payload(payload, reliable)
+        except (socket.error, struct.error, KeyError, TypeError) as e:
+            self.broken("sending", e)
+
+    def ping(self):
+        """Sends a ping if one is due (see ConnectionMetrics.ping_stamp)."""
+        stamp = self.metrics.ping_stamp()
+        if stamp is not None:
+            self.send(MSG_PING, {'stamp': stamp})
+
+    def receive(self, expected_type):
+        """Returns the next message, or None once the connection is closed or broken."""
+        received = self.receive_any(expected_type)
+        return received[1] if received else None
+
+    def receive_any(self, *expected_types):
+        """Returns the next message as (msg_type, message) if it is one of `expected_types`."""
+        try:
+            while True:
+                data = self._read_payload()
+                if data is None:
+                    return None
+                msg_type, message = self.decode(data)
+                if msg_type == MSG_PING:
+                    self.send(MSG_PONG, message)
+                elif msg_type == MSG_PONG:
+                    self.metrics.record_pong(message['stamp'])
+                elif msg_type in expected_types:
+                    return msg_type, message
+                else:
+                    raise WireFormatError(f"expected message type {expected_types}, got {msg_type}")
+        except (socket.error, WireFormatError) as e:
+            self.broken("receiving", e)
+        return None
+
+    def encode(self, msg_type, message):
+        start = time.perf_counter()
+        payload = game_wire_codec.encode(msg_type, message)
+        self.metrics.record_time('encode', time.perf_counter() - start)
+        if msg_type == MSG_SNAPSHOT:
+            self.metrics.record_snapshot_size(len(payload))
+        return payload
+
+    def decode(self, payload):
+        start = time.perf_counter()
+        msg_type, message = game_wire_codec.decode(payload)
+        self.metrics.record_time('decode', time.perf_counter() - start)
+        if msg_type == MSG_SNAPSHOT:
+            self.metrics.record_snapshot_size(len(payload))
+        return msg_type, message
+
+    def broken(self, action, error):
+        if self.open:
+            print(f"Error {action} game state: {error}")
+        self.close()
+
+    def close(self):
+        self.open = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR) # Wakes up a thread blocked in recv on this socket
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _send_payload(self, payload, reliable):
+        send_frame(self.sock, payload, self.compressor, self.metrics) # Everything on TCP is reliable
+
+    def _read_payload(self):
+        return self.frame_reader.read_frame()
+
+class UdpGameConnection(TcpGameConnection):
+    """Client/server connection over UDP (see DatagramConnection).
+
+    Snapshots, inputs and pings are sent unreliably and a late one is dropped;
+    the handshake and MSG_MATCH_STATUS go on the reliable sub-channel.
+    """
+
+    def __init__(self, datagrams, name):
+        self.sock = datagrams.sock
+        self.datagrams = datagrams
+        self.open = True
+        self.metrics = datagrams.metrics = ConnectionMetrics(name)
+        self.send_lock = threading.Lock()
+
+    def use_compression(self, compressor):
+        self.datagrams.compressor = compressor
+
+    def close(self):
+        self.open = False
+        self.datagrams.close()
+
+    def _send_payload(self, payload, reliable):
+        self.datagrams.send(payload, reliable)
+
+    def _read_payload(self):
+        return self.datagrams.receive()
+
+def match_status(state):
+    """The MSG_MATCH_STATUS message for a published snapshot."""
+    return {'overall_game_state': state['overall_game_state'], 'winning_player_id': state['winning_player_id'],
+            'level_index': state['maze_state_p1']['current_level_index']}
+
+def resync_events(event_stream, snapshot_history, peer):
+    """Server side: a client fell so far behind on events that its stream overflowed.
+
+    Rather than drop events it would never notice missing, the stream is cleared and the
+    client gets a full snapshot, which carries the state those events changed.
+    """
+    print(f"Event stream to {peer} overflowed ({event_stream.max_pending} unacknowledged); sending a full snapshot")
+    event_stream.resync()
+    snapshot_history.reset()
+
+def build_game_snapshot(maze_p1, maze_p2, game_state, winner_id, electricity_particles):
+    """Collects everything a client needs to mirror one match for one tick."""
+    return {
+        'maze_state_p1': maze_p1.get_serializable_state() if maze_p1 else None,
+        'maze_state_p2': maze_p2.get_serializable_state() if maze_p2 else None,
+        'overall_game_state': game_state,
+        'winning_player_id': winner_id,
+        'electricity_particles_global': [(p.x, p.y, p.radius, p.color) for p in electricity_particles]
+    }
+
+def encode_spectator_snapshot(seq, base_seq, delta, events):
+    """Payload of one snapshot message shared by all spectators of a match (see SnapshotBroadcast)."""
+    return game_wire_codec.encode(MSG_SNAPSHOT, {'seq': seq, 'base': base_seq, 'delta': delta, 'events': events})
+
+def build_full_game_state():
+    """Snapshot of the single match run by the threaded server."""
+    return build_game_snapshot(maze_state_p1, maze_state_p2, overall_game_state, winning_player_id, electricity_particles_global)
+
+def publish_server_tick():
+    """Server side, simulation thread: publishes the finished tick's snapshot, then the events it recorded.
+
+    The network threads only read what is published here, so they never touch
+    the maze objects while the simulation changes them.
+    """
+    snapshot_publisher.publish(build_full_game_state())
+    for maze in (maze_state_p1, maze_state_p2):
+        if maze:
+            for event in maze.take_events():
+                client_event_stream.push(event)
+
+def apply_client_input():
+    """Server side: applies the client's input for this simulation step and records it for the ack."""
+    direction = client_input_queue.pop()
+    if maze_state_p2 and maze_state_p2.player:
+        if direction is not None: # Nothing arrived in time: keep going the way the player was
+            maze_state_p2.player.desired_direction = direction
+        maze_state_p2.last_input_seq = client_input_queue.last_seq
+
+def server_reader_thread(connection, snapshot_history, event_stream):
+    """Reads client input as it arrives, independently of the snapshot broadcast."""
+    while game_running_flag and connection.open:
+        client_input = connection.receive(MSG_INPUT)
+        if client_input is None:
+            print("Client disconnected or error receiving input.")
+            connection.close()
+            break
+        snapshot_history.acknowledge(client_input['ack'])
+        client_input_queue.push(client_input['inputs'])
+        event_stream.acknowledge(client_input['event_ack'])
+
+def session_held():
+    """Server side: True while a dropped client may still resume its session. Its maze is paused meanwhile."""
+    return session_lost_at is not None and time.monotonic() - session_lost_at < SESSION_GRACE_PERIOD
+
+def start_client_session(join):
+    """Server side: seats the client that sent `join` on maze 2, resuming its session if the token allows.
+
+    Returns the EventStream for the client, or None if the seat is taken or held for another client.
+    """
+    global client_event_stream, client_input_queue, session_token, session_lost_at
+    given_up = session_lost_at is not None and not session_held()
+    resume = join['session_token'] != 0 and join['session_token'] == session_token and not given_up
+    seat_taken = (client_connection is not None and client_connection.open) or session_held()
+    if seat_taken and not resume:
+        return None
+    if not resume:
+        # A new player: nothing from the previous session applies to it
+        session_token = secrets.randbits(64) or 1
+        client_event_stream = EventStream()
+        client_input_queue = InputQueue()
+    session_lost_at = None
+    # On resume the event stream and input queue carry on: unacked events are resent and
+    # inputs the server already applied are skipped
+    return client_event_stream
+
+def server_thread_function(connection, addr):
+    """Handles communication with a single client over a Tcp/UdpGameConnection: broadcasts snapshots at up to NET_SEND_RATE.
+
+    A client that reconnects with its session token within SESSION_GRACE_PERIOD gets maze 2
+    back, starting with a full snapshot; any other client is refused while the seat is held.
+    """
+    global is_connected, client_connection, session_lost_at, net_metrics
 
     print(f"Accepted connection from {addr}")
+    snapshot_history = SnapshotHistory() # Snapshots sent to this client, delta-encoded against its last ack. Empty: the first one is full
+
+    join = connection.receive(MSG_JOIN)
+    if join is None or join['spectate']:
+        # This server runs a single match for one client; spectators need --match-server
+        print(f"Refusing {addr}: only the dedicated match server accepts spectators.")
+        refuse_connection(connection)
+        return
+
+    while snapshot_publisher.wait_newer(0, timeout=0.1) is None:
+        print("DEBUG Server: Waiting for the first simulation tick before sending to client...")
+
+    event_stream = start_client_session(join)
+    if event_stream is None:
+        print(f"Refusing {addr}: maze 2 is taken or held for a disconnected player.")
+        refuse_connection(connection)
+        return
+    resumed = join['session_token'] == session_token
+    previous_connection, client_connection = client_connection, connection
+    if previous_connection is not None:
+        previous_connection.close() # Half-open after a network blip: the client has already moved on
     is_connected = True
-
-    while (maze_state_p1 is None or maze_state_p2 is None or maze_state_p1.player is None or maze_state_p2.player is None):
-        print("DEBUG Server: Waiting for maze states to be initialized before sending to client...")
-        time.sleep(0.1)
+    net_metrics = connection.metrics
+    print(f"Client {addr} {'resumed its session' if resumed else 'started a new session'}")
+
+    # The threaded server hosts a single match and the client always plays maze 2
+    compressor = accept_compression(join['compression'])
+    welcome = {'player_id': 2, 'match_id': 0, 'compression': offered_compression() if compressor else 0,
+               'session_token': session_token}
+    connection.send(MSG_WELCOME, welcome, reliable=True)
+    if compressor:
+        connection.use_compression(compressor)
+
+    # Input is read on its own thread, so a slow client never delays the broadcast
+    threading.Thread(target=server_reader_thread, args=(connection, snapshot_history, event_stream), daemon=True).start()
+    if NET_METRICS_FILE:
+        threading.Thread(target=net_metrics_dump_thread, args=(connection,), daemon=True).start()
+    send_timer = FixedRate(NET_SEND_RATE)
+    send_rate = AdaptiveSendRate(NET_SEND_RATE, MIN_NET_SEND_RATE)
+    sent_status = None
+    sent_version = 0
 
     try:
-        while game_running_flag and is_connected:
-            # DEBUG: Check what we're sending
-            if maze_state_p1:
-                print(f"DEBUG Server: P1 exists, player: {maze_state_p1.player is not None}, state: {overall_game_state}")
-            if maze_state_p2:
-                print(f"DEBUG Server: P2 exists, player: {maze_state_p2.player is not None}")
-            
-            # Server sends full game state to client FIRST
-            full_game_state = {
-                'maze_state_p1': maze_state_p1.get_serializable_state() if maze_state_p1 else None,
-                'maze_state_p2': maze_state_p2.get_serializable_state() if maze_state_p2 else None,
-                'overall_game_state': overall_game_state,
-                'winning_player_id': winning_player_id,
-                'electricity_particles_global': [(p.x, p.y, p.radius, p.color) for p in electricity_particles_global]
-            }
-            
-            print(f"DEBUG Server: Sending state - P1: {full_game_state['maze_state_p1'] is not None}, P2: {full_game_state['maze_state_p2'] is not None}, game_state: {overall_game_state}")
-            
-            send_game_state(conn, full_game_state)
-            
-            # Then receive client's player input
-            client_input = receive_game_state(conn)
-            if client_input is None:
-                print("Client disconnected or error receiving input.")
-                break
-
-            # Update maze_state_p2 (client's player) based on client_input
-            if maze_state_p2 and maze_state_p2.player and client_input.get('player_desired_direction') is not None:
-                maze_state_p2.player.desired_direction = client_input['player_desired_direction']
-            
-            time.sleep(0.016)  # ~60 FPS
+        while game_running_flag and connection.open:
+            # Send the changes since the client's last acknowledged snapshot. The published
+            # snapshot is never mutated, so it is safe to read while the next tick runs.
+            # A new tick goes out as soon as it is published; the last one again if none
+            # comes within a send interval, so a paused game still reaches the client.
+            published = snapshot_publisher.wait_newer(sent_version, send_timer.interval) or snapshot_publisher.latest()
+            sent_version = published.version
+            if event_stream.overflowed:
+                resync_events(event_stream, snapshot_history, addr)
+            seq, base_seq, delta = snapshot_history.make_delta(published.state)
+
+            # Level changes and game over must not wait for a snapshot that gets through
+            status = match_status(published.state)
+            if status != sent_status:
+                connection.send(MSG_MATCH_STATUS, status, reliable=True)
+                sent_status = status
+
+            # Events ride along until acked, so coalescing snapshots never drops one
+            send_start = time.perf_counter()
+            connection.send(MSG_SNAPSHOT, {'seq': seq, 'base': base_seq, 'delta': delta, 'events': event_stream.unacked()})
+            send_time = time.perf_counter() - send_start
+            connection.ping()
+
+            # Fewer snapshots while the client's link or this machine can't keep up; the simulation stays at SIM_RATE
+            rate = send_rate.update(connection.metrics.rtt, send_time / send_timer.interval, server_load.load)
+            send_timer.set_rate(rate)
+            connection.metrics.set_gauge('send_rate', round(rate))
+            connection.metrics.set_gauge('server_load', round(server_load.load, 2))
+            connection.metrics.set_gauge('input_queue', len(client_input_queue))
+            connection.metrics.set_gauge('unacked_events', len(event_stream))
+            send_timer.wait()
     except Exception as e:
         print(f"Error in server thread: {e}")
         import traceback
         traceback.print_exc()
     finally:
-        conn.close()
+        connection.close()
         print(f"Connection with {addr} closed.")
+        # Do NOT set game_running_flag to False here: the client may come back and resume
+        if client_connection is connection: # Not replaced by a resumed connection already
+            client_connection = None
+            is_connected = False
+            if game_running_flag and overall_game_state == GAME_STATE_PLAYING:
+                session_lost_at = time.monotonic()
+                print(f"Holding maze 2 for {SESSION_GRACE_PERIOD:.0f}s so the client can resume.")
+
+def refuse_connection(connection):
+    global is_connected
+    connection.close()
+    if client_connection is None: # The UDP listener counted this peer as the client
         is_connected = False
-        # Do NOT set game_running_flag to False here, as the server might want to wait for another client
-
 
-        # Or handle this more gracefully depending on game design (e.g., reset and wait for new connection)
 def server_listener_thread():
-    """Dedicated thread to listen for and accept new client connections."""
+    """Dedicated thread to listen for and accept new client connections (over NET_TRANSPORT)."""
     global server_socket, is_connected, game_running_flag
+    if NET_TRANSPORT == 'udp':
+        udp_listener()
+        return
     try:
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -1971,10 +2790,9 @@ def server_listener_thread():
                 conn, addr = server_socket.accept()
                 print(f"[SERVER] Accepted connection from {addr}")
                 client_handler_thread = threading.Thread(
-                    target=server_thread_function, args=(conn, addr), daemon=True
+                    target=server_thread_function, args=(TcpGameConnection(conn, f"client {addr[0]}:{addr[1]}"), addr), daemon=True
                 )
-                client_handler_thread.start()
-                is_connected = True
+                client_handler_thread.start() # It sets is_connected once the client is seated
             except socket.timeout:
                 continue
             except Exception as e:
@@ -1992,6 +2810,37 @@ def server_listener_thread():
         is_connected = False
 
 
+def udp_listener():
+    """UDP counterpart of the accept loop: one socket receives every datagram and hands the client's to its connection."""
+    global server_socket, is_connected
+    try:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server_socket.bind((HOST, PORT))
+        print(f"[SERVER] Listening for UDP on {HOST}:{PORT}")
+        datagrams = None
+        while game_running_flag:
+            data, addr = server_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            if datagrams is None or datagrams.closed or addr != datagrams.peer:
+                if is_connected:
+                    continue # Like the TCP server, one client at a time
+                print(f"[SERVER] New UDP client {addr}")
+                datagrams = DatagramConnection(server_socket, addr)
+                is_connected = True
+                threading.Thread(target=server_thread_function, args=(UdpGameConnection(datagrams, f"client {addr[0]}:{addr[1]}"), addr), daemon=True).start()
+            datagrams.deliver(data)
+    except Exception as e:
+        print(f"[SERVER] UDP listener stopped: {e}")
+    finally:
+        server_socket.close()
+        is_connected = False
+
+
+def apply_maze_delta(maze_view, game_delta, maze_key, maze_state):
+    """Brings one client-side maze view up to date from a whole-game snapshot delta."""
+    if maze_key in game_delta.get('set', {}):
+        maze_view.set_state(maze_state) # First snapshot for this maze: full sync
+    elif maze_key in game_delta.get('sub', {}):
+        maze_view.apply_delta(game_delta['sub'][maze_key], maze_state)
 
 # def client_thread_function(server_addr):
 #     """Handles communication with the server."""
@@ -2003,76 +2852,150 @@ def server_listener_thread():
 #         client_socket.connect(server_addr)
 #         print(f"Connected to server at {server_addr}")
 #         is_connected = True
-def client_thread_function(server_addr):
-    print(f"[CLIENT] Attempting to connect to: {server_addr}")
-    """Handles communication with the server."""
-    global client_socket, is_connected, game_running_flag
-    global maze_state_p1_view, maze_state_p2_view, overall_game_state, winning_player_id
-    global electricity_particles_global, animating_coins_p1_visual, animating_coins_p2_visual
-    global previous_collectibles_p1, previous_collectibles_p2
+def open_client_connection(server_addr, deadline=None):
+    """Client side: connects to the server over NET_TRANSPORT.
+
+    Over TCP, retries until the server accepts or `deadline` (time.monotonic()) passes; returns None then.
+    """
+    name = f"server {server_addr[0]}:{server_addr[1]}"
+    if NET_TRANSPORT == 'udp':
+        # No connection to wait for: the join message is resent until the server answers
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect(server_addr)
+        return UdpGameConnection(DatagramConnection(sock), name)
+
+    # Retry connection until successful
+    while game_running_flag and (deadline is None or time.monotonic() < deadline):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.connect(server_addr)
+            print(f"[CLIENT] Connected to server at {server_addr}")
+            return TcpGameConnection(sock, name)
+        except ConnectionRefusedError:
+            print("[CLIENT] Waiting for server to start...")
+        except Exception as e:
+            print(f"[CLIENT] Connection error: {e}")
+        sock.close()
+        time.sleep(1)
+    return None
 
-    try:
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # Retry connection until successful
-        while True:
-            try:
-                client_socket.connect(server_addr)
-                print(f"[CLIENT] Connected to server at {server_addr}")
-                break
-            except ConnectionRefusedError:
-                print("[CLIENT] Waiting for server to start...")
-                time.sleep(1)
-            except Exception as e:
-                print(f"[CLIENT] Connection error: {e}")
-                time.sleep(1)
+def client_thread_function(server_addr, spectate=False):
+    """Handles communication with the server, as a player or, with `spectate`, as a read-only spectator.
 
-        is_connected = True
+    When the connection drops, a player reconnects and resumes its session for up to
+    SESSION_GRACE_PERIOD; only then does the game end.
+    """
+    global client_socket, is_connected, game_running_flag, reconnect_deadline
 
-        while game_running_flag and is_connected:
-            # Client receives full game state from server FIRST
-            full_game_state = receive_game_state(client_socket)
-            if full_game_state is None:
-                print("Server disconnected or error receiving state.")
+    print(f"[CLIENT] Attempting to connect to: {server_addr}")
+    event_receiver = EventReceiver() # Kept across reconnects: the server resends the events we have not acknowledged
+    try:
+        while game_running_flag:
+            connection = open_client_connection(server_addr, reconnect_deadline)
+            if connection is None:
                 break
+            client_socket = connection.sock
+            try:
+                joined = play_client_session(connection, spectate, event_receiver)
+            finally:
+                connection.close()
+                is_connected = False
+
+            if spectate or not session_token:
+                break # Nothing to resume
+            if joined:
+                reconnect_deadline = time.monotonic() + SESSION_GRACE_PERIOD
+                print(f"[CLIENT] Connection lost, trying to resume for {SESSION_GRACE_PERIOD:.0f}s...")
+            elif time.monotonic() >= reconnect_deadline:
+                print("[CLIENT] Could not resume the session in time.")
+                break
+            else:
+                time.sleep(1) # Refused, or no welcome: the server may not have noticed the drop yet
+    except Exception as e:
+        print(f"Error in client thread: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        print("Disconnected from server.")
+        is_connected = False
+        reconnect_deadline = None
+        game_running_flag = False
 
-            # DEBUG: What did we receive?
-            print(
-                f"DEBUG Client: Received state - "
-                f"P1: {full_game_state.get('maze_state_p1') is not None}, "
-                f"P2: {full_game_state.get('maze_state_p2') is not None}, "
-                f"game_state: {full_game_state.get('overall_game_state')}"
-            )
-
-            # Store current collectible positions before updating maze states
-            current_collectibles_p1_coords = set()
-            if full_game_state.get('maze_state_p1'):
-                for c_state in full_game_state['maze_state_p1'].get('collectibles', []):
-                    current_collectibles_p1_coords.add((c_state['x'], c_state['y']))
+def play_client_session(connection, spectate, event_receiver):
+    """Client side: joins, or resumes our session, over `connection` and applies snapshots until it drops.
 
-            current_collectibles_p2_coords = set()
-            if full_game_state.get('maze_state_p2'):
-                for c_state in full_game_state['maze_state_p2'].get('collectibles', []):
-                    current_collectibles_p2_coords.add((c_state['x'], c_state['y']))
+    Returns False if the server did not welcome us.
+    """
+    global is_connected, maze_state_p1_view, maze_state_p2_view, overall_game_state, winning_player_id
+    global electricity_particles_global, local_player_id, session_token, reconnect_deadline, net_metrics
 
-            # Update client's view of both mazes
+    is_connected = True
+    net_metrics = connection.metrics
+    snapshot_receiver = SnapshotReceiver() # Rebuilds full snapshots from the server's deltas; a new connection starts with a full one
+
+    join = {'spectate': spectate, 'match_id': 0, 'compression': offered_compression(), 'session_token': session_token}
+    connection.send(MSG_JOIN, join, reliable=True)
+    welcome = connection.receive(MSG_WELCOME)
+    if welcome is None:
+        print("[CLIENT] Server did not send a welcome message.")
+        return False
+    if session_token and welcome['session_token'] != session_token:
+        print("[CLIENT] Our session was given up; joined as a new player.")
+    session_token = welcome['session_token']
+    reconnect_deadline = None
+    local_player_id = welcome['player_id']
+    if welcome['compression']: # The server only accepts the dictionary we offered
+        connection.use_compression(frame_compressor)
+    print(f"[CLIENT] Joined match {welcome['match_id']} as player {local_player_id}"
+          f"{' with compression' if welcome['compression'] else ''}")
+
+    # Input goes out on its own thread; this one only reads snapshots. Spectators send nothing.
+    if local_player_id != SPECTATOR_ID:
+        threading.Thread(target=client_writer_thread, args=(connection, snapshot_receiver, event_receiver), daemon=True).start()
+    if NET_METRICS_FILE:
+        threading.Thread(target=net_metrics_dump_thread, args=(connection,), daemon=True).start()
+
+    while game_running_flag and connection.open:
+        received = connection.receive_any(MSG_SNAPSHOT, MSG_MATCH_STATUS)
+        if received is None:
+            print("Server disconnected or error receiving state.")
+            break
+        msg_type, snapshot_message = received
+        if msg_type == MSG_MATCH_STATUS:
+            apply_match_status(snapshot_message)
+            continue
+
+        received = snapshot_receiver.receive(snapshot_message['seq'], snapshot_message['base'], snapshot_message['delta'])
+        if received is None:
+            connection.metrics.count('dropped_snapshots') # Its base is no longer known; a later one will be
+            continue
+        full_game_state, local_delta = received
+
+        # Update client's view of both mazes, touching only what changed
+        with prediction_lock:
             if full_game_state.get('maze_state_p1'):
                 if maze_state_p1_view is None:
                     maze_state_p1_view = MazeState(1)
                     print("DEBUG Client: Created maze_state_p1_view")
-                maze_state_p1_view.set_state(full_game_state['maze_state_p1'])
-                print(f"DEBUG Client: P1 updated - player exists: {maze_state_p1_view.player is not None}")
+                apply_maze_delta(maze_state_p1_view, local_delta, 'maze_state_p1', full_game_state['maze_state_p1'])
 
             if full_game_state.get('maze_state_p2'):
                 if maze_state_p2_view is None:
                     maze_state_p2_view = MazeState(2)
                     print("DEBUG Client: Created maze_state_p2_view")
-                maze_state_p2_view.set_state(full_game_state['maze_state_p2'])
-                print(f"DEBUG Client: P2 updated - player exists: {maze_state_p2_view.player is not None}")
+                apply_maze_delta(maze_state_p2_view, local_delta, 'maze_state_p2', full_game_state['maze_state_p2'])
 
-            overall_game_state = full_game_state.get('overall_game_state', GAME_STATE_PLAYING)
-            winning_player_id = full_game_state.get('winning_player_id', 0)
+            own_maze_state = full_game_state.get(f'maze_state_p{local_player_id}') # None for spectators
+            if own_maze_state:
+                reconcile_local_player(local_maze_view(), own_maze_state)
 
-            # Update global electricity particles
+        remote_interpolation.push(time.monotonic(), {key: obj.rect.topleft for key, obj in remote_entities()})
+
+        overall_game_state = full_game_state.get('overall_game_state', GAME_STATE_PLAYING)
+        winning_player_id = full_game_state.get('winning_player_id', 0)
+
+        # Update global electricity particles
+        if 'electricity_particles_global' in local_delta.get('set', {}):
             electricity_particles_global.clear()
             for p_data in full_game_state.get('electricity_particles_global', []):
                 x, y, radius, color = p_data
@@ -2081,65 +3004,391 @@ def client_thread_function(server_addr):
                 p.color = color
                 electricity_particles_global.append(p)
 
-            # Coin animation triggers
-            if maze_state_p1_view:
-                for prev_c_state in previous_collectibles_p1:
-                    prev_x, prev_y, prev_item_type = prev_c_state
-                    if prev_item_type == 'gold' and (prev_x, prev_y) not in current_collectibles_p1_coords:
-                        animating_coins_p1_visual.append(
-                            AnimatedCoinVisual(
-                                (prev_x + TILE_SIZE // 2, prev_y + TILE_SIZE // 2),
-                                (game_width_single_maze - 100, game_area_height_single_maze + 30),
-                                x_offset=0
-                            )
-                        )
-                        if pickup_sound:
-                            pickup_sound.play()
-
-            if maze_state_p2_view:
-                maze2_x_offset = game_width_single_maze + MAZE_GAP
-                for prev_c_state in previous_collectibles_p2:
-                    prev_x, prev_y, prev_item_type = prev_c_state
-                    if prev_item_type == 'gold' and (prev_x, prev_y) not in current_collectibles_p2_coords:
-                        animating_coins_p2_visual.append(
-                            AnimatedCoinVisual(
-                                (prev_x + TILE_SIZE // 2, prev_y + TILE_SIZE // 2),
-                                (game_width_single_maze - 100, game_area_height_single_maze + 30),
-                                x_offset=maze2_x_offset
-                            )
-                        )
-                        if pickup_sound:
-                            pickup_sound.play()
-
-            previous_collectibles_p1 = [
-                (c.rect.x, c.rect.y, c.item_type)
-                for c in maze_state_p1_view.collectibles
-            ] if maze_state_p1_view else []
-
-            previous_collectibles_p2 = [
-                (c.rect.x, c.rect.y, c.item_type)
-                for c in maze_state_p2_view.collectibles
-            ] if maze_state_p2_view else []
-
-            # THEN send client's player input
-            if maze_state_p2_view and maze_state_p2_view.player:
-                player_input = {'player_desired_direction': maze_state_p2_view.player.desired_direction}
-                send_game_state(client_socket, player_input)
-            else:
-                send_game_state(client_socket, {'player_desired_direction': NO_DIRECTION})
+        # One-off effects come from the event stream, which also covers snapshots that were dropped
+        missed = event_receiver.missed
+        for event in event_receiver.accept(snapshot_message['events']):
+            handle_game_event(event)
+        if event_receiver.missed > missed:
+            print(f"[CLIENT] Server skipped {event_receiver.missed - missed} events and resent the full state instead")
+    return True
+
+
+def apply_match_status(status):
+    """Client side: applies a reliable MSG_MATCH_STATUS ahead of the snapshots."""
+    global overall_game_state, winning_player_id, current_level_index
+    overall_game_state = status['overall_game_state']
+    winning_player_id = status['winning_player_id']
+    current_level_index = status['level_index']
+
+def handle_game_event(event):
+    """Client side: plays the sound and animation for one gameplay event from the server."""
+    if event['type'] == 'collectible_picked' and ITEM_TYPES[event['value']] == 'gold':
+        maze_x_offset = 0 if event['maze'] == 1 else game_width_single_maze + MAZE_GAP
+        animating_coins = animating_coins_p1_visual if event['maze'] == 1 else animating_coins_p2_visual
+        animating_coins.append(
+            AnimatedCoinVisual(
+                (event['x'] + TILE_SIZE // 2, event['y'] + TILE_SIZE // 2),
+                (game_width_single_maze - 100, game_area_height_single_maze + 30),
+                x_offset=maze_x_offset
+            )
+        )
+        if pickup_sound:
+            pickup_sound.play()
+    elif event['type'] == 'level_advanced' and event['maze'] == (local_player_id or 1): # Spectators follow maze 1
+        play_level_music(event['value'])
+
+def local_maze_view():
+    """Client side: the view of the maze this client controls (None for spectators)."""
+    return {1: maze_state_p1_view, 2: maze_state_p2_view}.get(local_player_id)
+
+def remote_entities():
+    """Client side: yields (key, object) for everything this client does not predict: the other player and all enemies."""
+    own_view = local_maze_view()
+    for maze_key, maze_view in (('maze_state_p1', maze_state_p1_view), ('maze_state_p2', maze_state_p2_view)):
+        if maze_view is None:
+            continue
+        if maze_view.player and maze_view is not own_view:
+            yield (maze_key, 'player'), maze_view.player
+        for enemy in maze_view.enemies:
+            yield (maze_key, 'enemy', enemy.entity_id), enemy
+
+def smooth_remote_entities(now):
+    """Client side: places every remote entity where the interpolation buffer says it was INTERPOLATION_DELAY ago."""
+    positions = remote_interpolation.sample(now)
+    for key, obj in remote_entities():
+        obj.smoothed_topleft = positions.get(key)
+
+def reconcile_local_player(own_view, own_maze_state):
+    """Client side: resets the local player to the server's state, then replays the inputs the server has not applied yet.
+
+    Must be called with prediction_lock held, right after the snapshot was applied to `own_view`.
+    """
+    player = own_view.player
+    if player is None or not own_maze_state['player']:
+        return
+    local_direction = player.desired_direction # What the keyboard says now, not what the server last saw
+    pending_inputs.acknowledge(own_maze_state['last_input_seq'])
+    player.set_state(own_maze_state['player'])
+    for _seq, direction in pending_inputs.unacked():
+        player.desired_direction = direction
+        player.update(own_view.wall_grid)
+    player.desired_direction = local_direction
+
+def client_writer_thread(connection, snapshot_receiver, event_receiver):
+    """Sends the local player's pending inputs at NET_SEND_RATE, acking the newest snapshot so the server can delta-encode against it
+    and the newest event so it stops resending events."""
+    send_timer = FixedRate(NET_SEND_RATE)
+    while game_running_flag and connection.open:
+        # Every input the server has not acknowledged is resent, so none is lost with a late message
+        player_input = {'inputs': pending_inputs.unacked(), 'ack': snapshot_receiver.latest_seq,
+                        'event_ack': event_receiver.last_seq}
+        connection.send(MSG_INPUT, player_input)
+        connection.ping()
+        connection.metrics.set_gauge('unacked_inputs', len(pending_inputs))
+        send_timer.wait()
+
+def net_metrics_dump_thread(connection):
+    """Appends the connection's metrics to NET_METRICS_FILE every NET_METRICS_DUMP_INTERVAL seconds while it is open."""
+    dump_timer = FixedRate(1 / NET_METRICS_DUMP_INTERVAL)
+    try:
+        while game_running_flag and connection.open:
+            dump_timer.wait()
+            connection.metrics.dump(NET_METRICS_FILE)
+    except OSError as e:
+        print(f"Cannot write network metrics to {NET_METRICS_FILE}: {e}")
+
+
+# --- Multi-Match Server (asyncio) ---
+# The threaded server above hosts one match through the maze_state_p1/p2
+# globals. MatchServer instead hosts any number of independent matches from a
+# single event loop: every match owns its mazes, and one TickScheduler steps
+# all of them and broadcasts their snapshots.
+
+class MatchSeat:
+    """A client connected to one of the two player slots of a Match."""
+
+    def __init__(self, player_id, writer, name):
+        self.player_id = player_id
+        self.writer = writer
+        self.compressor = None # Set once the welcome message has accepted compression
+        self.snapshot_history = SnapshotHistory()
+        self.input_queue = InputQueue()
+        self.events = EventStream() # Resent with every snapshot until the client acknowledges them
+        self.metrics = ConnectionMetrics(name) # Only the round trip is measured per seat
+        self.send_rate = AdaptiveSendRate(NET_SEND_RATE, MIN_NET_SEND_RATE)
+        self.send_credit = 0.0 # Snapshots owed to the client; one is sent whenever it reaches 1
+
+    def snapshot_due(self, tick_rate, load):
+        """Called once per tick: True if the client should get a snapshot now, at its current send rate."""
+        backlog = self.writer.transport.get_write_buffer_size() / SEAT_MAX_BUFFERED
+        self.send_credit += self.send_rate.update(self.metrics.rtt, backlog, load) / tick_rate
+        if self.send_credit < 1.0:
+            return False
+        self.send_credit -= 1.0
+        return True
+
+    def send(self, msg_type, message):
+        """Queues one message for the client; returns its size in bytes."""
+        frame = encode_frame(game_wire_codec.encode(msg_type, message), self.compressor)
+        self.writer.write(frame)
+        return len(frame)
+
+
+class Match:
+    """One two-player dungeon: a maze pair plus the level and game state that the threaded server keeps in globals."""
+
+    def __init__(self, match_id):
+        self.match_id = match_id
+        self.electricity_particles = []
+        self.maze_state_p1 = MazeState(1, self.electricity_particles)
+        self.maze_state_p2 = MazeState(2, self.electricity_particles)
+        self.seats = {} # player_id -> MatchSeat
+        self.spectators = SnapshotBroadcast(encode_spectator_snapshot)
+        self.current_level_index = 0
+        self.overall_game_state = GAME_STATE_START # Waiting for the second player
+        self.winning_player_id = 0
+        self.load_level(0)
+
+    def mazes(self):
+        return (self.maze_state_p1, self.maze_state_p2)
+
+    def is_open(self):
+        return len(self.seats) < 2 and self.overall_game_state == GAME_STATE_START
+
+    def add_seat(self, writer):
+        player_id = 1 if 1 not in self.seats else 2
+        seat = MatchSeat(player_id, writer, f"match {self.match_id} player {player_id}")
+        self.seats[player_id] = seat
+        if len(self.seats) == 2:
+            self.overall_game_state = GAME_STATE_PLAYING
+        return seat
+
+    def remove_seat(self, seat):
+        self.seats.pop(seat.player_id, None)
+
+    def load_level(self, level_index):
+        self.current_level_index = level_index
+        for maze in self.mazes():
+            maze.current_level_index = level_index
+            maze.load_level(ALL_LEVEL_MAPS[level_index]) # Health, score and keys live on the MazeState and carry over
+
+    def advance_level(self):
+        if self.current_level_index + 1 < len(ALL_LEVEL_MAPS):
+            self.load_level(self.current_level_index + 1)
+            for maze in self.mazes():
+                maze.add_event('level_advanced', value=self.current_level_index)
+        else:
+            self.overall_game_state = GAME_STATE_GAME_OVER
+            self.winning_player_id = 1 # Same rule as the threaded server's advance_level
 
-            time.sleep(0.016)  # ~60 FPS
+    def tick(self):
+        """Advances the simulation by one SIM_RATE step, then queues its events on every seat."""
+        if self.overall_game_state != GAME_STATE_PLAYING:
+            return
+        self._step()
+        for maze in self.mazes():
+            for event in maze.take_events():
+                for seat in self.seats.values():
+                    seat.events.push(event)
+                self.spectators.add_event(event)
+
+    def _step(self):
+        for maze in self.mazes():
+            seat = self.seats.get(maze.player_id)
+            if seat:
+                direction = seat.input_queue.pop()
+                if direction is not None:
+                    maze.player.desired_direction = direction
+                maze.last_input_seq = seat.input_queue.last_seq
+            maze.update_game_logic()
+
+            if maze.player.health <= 0:
+                self.overall_game_state = GAME_STATE_GAME_OVER
+                self.winning_player_id = 2 if maze.player_id == 1 else 1
+                return
+            if maze.level_exit_rect and maze.player.rect.colliderect(maze.level_exit_rect):
+                self.advance_level()
+                return
+
+    def build_snapshot(self):
+        return build_game_snapshot(self.maze_state_p1, self.maze_state_p2, self.overall_game_state,
+                                   self.winning_player_id, self.electricity_particles)
+
+
+class MatchServer:
+    """asyncio server that pairs incoming clients into Matches and runs them all on one tick scheduler."""
+
+    def __init__(self, host=HOST, port=PORT, tick_rate=SIM_RATE, send_rate=NET_SEND_RATE):
+        self.host = host
+        self.port = port
+        self.metrics = ConnectionMetrics('match server') # Tick time, dropped ticks and bytes sent, over all matches
+        self.scheduler = TickScheduler(tick_rate, self.metrics)
+        self.tick_rate = tick_rate
+        self.send_every = max(1, round(tick_rate / send_rate)) # Ticks between two spectator broadcasts; players adapt theirs
+        self.dump_every = max(1, round(tick_rate * NET_METRICS_DUMP_INTERVAL)) # Ticks between two lines of NET_METRICS_FILE
+        self.matches = {}
+        self.next_match_id = 1
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.scheduler.add(self._tick)
+        print(f"[MATCH SERVER] Listening on {self.host}:{self.port}")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.scheduler.run())
+
+    def _open_match(self):
+        for match in self.matches.values():
+            if match.is_open():
+                return match
+        match = Match(self.next_match_id)
+        self.matches[match.match_id] = match
+        self.next_match_id += 1
+        return match
+
+    async def _handle_connection(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        try:
+            data = await read_frame_async(reader)
+            if data is None:
+                writer.close()
+                return
+            msg_type, join = game_wire_codec.decode(data)
+            if msg_type != MSG_JOIN:
+                raise WireFormatError(f"expected message type {MSG_JOIN}, got {msg_type}")
+        except (ConnectionError, WireFormatError) as e:
+            print(f"[MATCH SERVER] Error receiving from {addr}: {e}")
+            writer.close()
+            return
 
-    except Exception as e:
-        print(f"Error in client thread: {e}")
-        import traceback
-        traceback.print_exc()
-    finally:
-        if client_socket:
-            client_socket.close()
-        print("Disconnected from server.")
-        is_connected = False
-        game_running_flag = False
+        compressor = accept_compression(join['compression'])
+        if join['spectate']:
+            await self._watch_match(reader, writer, addr, join['match_id'], compressor)
+        else:
+            await self._play_match(reader, writer, addr, compressor)
+
+    async def _watch_match(self, reader, writer, addr, match_id, compressor):
+        match = self.matches.get(match_id) if match_id else next(iter(self.matches.values()), None)
+        if match is None:
+            print(f"[MATCH SERVER] {addr} asked to watch match {match_id}, which is not running")
+            writer.close()
+            return
+        welcome = {'player_id': SPECTATOR_ID, 'match_id': match.match_id, 'compression': offered_compression() if compressor else 0,
+                   'session_token': 0}
+        writer.write(encode_frame(game_wire_codec.encode(MSG_WELCOME, welcome)))
+        match.spectators.subscribe(writer, compressor)
+        print(f"[MATCH SERVER] {addr} is watching match {match.match_id}")
+
+        try:
+            # Spectators send nothing; reading only tells us when they leave
+            while await read_frame_async(reader, compressor=compressor) is not None:
+                pass
+        except (ConnectionError, WireFormatError) as e:
+            print(f"[MATCH SERVER] Error receiving from {addr}: {e}")
+        finally:
+            match.spectators.unsubscribe(writer)
+            writer.close()
+            print(f"[MATCH SERVER] {addr} stopped watching match {match.match_id}")
+
+    async def _play_match(self, reader, writer, addr, compressor):
+        match = self._open_match()
+        seat = match.add_seat(writer)
+        print(f"[MATCH SERVER] {addr} joined match {match.match_id} as player {seat.player_id}")
+        seat.send(MSG_WELCOME, {'player_id': seat.player_id, 'match_id': match.match_id,
+                                'compression': offered_compression() if compressor else 0,
+                                'session_token': 0}) # Sessions are not resumed here: a dropped seat is simply left
+        seat.compressor = compressor
+
+        try:
+            while True:
+                data = await read_frame_async(reader, compressor=compressor)
+                if data is None:
+                    break
+                msg_type, client_input = game_wire_codec.decode(data)
+                if msg_type == MSG_PING:
+                    self.metrics.record_sent(seat.send(MSG_PONG, client_input))
+                    continue
+                if msg_type == MSG_PONG:
+                    seat.metrics.record_pong(client_input['stamp'])
+                    continue
+                if msg_type != MSG_INPUT:
+                    raise WireFormatError(f"expected message type {MSG_INPUT}, got {msg_type}")
+                seat.snapshot_history.acknowledge(client_input['ack'])
+                seat.input_queue.push(client_input['inputs'])
+                seat.events.acknowledge(client_input['event_ack'])
+        except (ConnectionError, WireFormatError) as e:
+            print(f"[MATCH SERVER] Error receiving from {addr}: {e}")
+        finally:
+            match.remove_seat(seat)
+            if not match.seats:
+                self._close_match(match)
+            writer.close()
+            print(f"[MATCH SERVER] {addr} left match {match.match_id}")
+
+    def _tick(self, tick):
+        spectate = tick % self.send_every == 0
+        load = self.scheduler.load_meter.load
+        for match in list(self.matches.values()):
+            try:
+                match.tick()
+                self._broadcast(match, spectate, load)
+            except Exception:
+                # One broken match must not take the others down with it
+                traceback.print_exc()
+                self._close_match(match)
+        if NET_METRICS_FILE and tick % self.dump_every == 0:
+            self._dump_metrics()
+
+    def _broadcast(self, match, spectate, load):
+        """Sends a snapshot to the seats that are due one (see MatchSeat.snapshot_due), and to spectators if `spectate`."""
+        snapshot = None
+        for seat in match.seats.values():
+            stamp = seat.metrics.ping_stamp()
+            if stamp is not None:
+                self.metrics.record_sent(seat.send(MSG_PING, {'stamp': stamp}))
+            if not seat.snapshot_due(self.tick_rate, load):
+                continue
+            if snapshot is None:
+                snapshot = match.build_snapshot()
+            if seat.events.overflowed:
+                resync_events(seat.events, seat.snapshot_history, seat.metrics.name)
+            seq, base_seq, delta = seat.snapshot_history.make_delta(snapshot)
+            message = {'seq': seq, 'base': base_seq, 'delta': delta, 'events': seat.events.unacked()}
+            self.metrics.record_sent(seat.send(MSG_SNAPSHOT, message))
+        if spectate:
+            # Encoded once for all spectators, however many there are
+            match.spectators.publish(snapshot or match.build_snapshot())
+
+    def _dump_metrics(self):
+        seats = [seat for match in self.matches.values() for seat in match.seats.values()]
+        rates = [seat.send_rate.rate for seat in seats]
+        self.metrics.set_gauge('matches', len(self.matches))
+        self.metrics.set_gauge('players', len(seats))
+        self.metrics.set_gauge('sim_rate', self.tick_rate)
+        self.metrics.set_gauge('send_rate_mean', round(sum(rates) / len(rates), 1) if rates else 0)
+        self.metrics.set_gauge('send_rate_min', round(min(rates), 1) if rates else 0)
+        self.metrics.set_gauge('server_load', round(self.scheduler.load_meter.load, 2))
+        try:
+            self.metrics.dump(NET_METRICS_FILE)
+        except OSError as e:
+            print(f"[MATCH SERVER] Cannot write metrics to {NET_METRICS_FILE}: {e}")
+
+    def _close_match(self, match):
+        self.matches.pop(match.match_id, None)
+        for seat in list(match.seats.values()):
+            seat.writer.close()
+        for writer in list(match.spectators.subscribers):
+            writer.close()
+
+
+def run_match_server(host=HOST, port=PORT):
+    """Entry point for the headless dedicated server (python Main_v1.py --dedicated).
+
+    Runs the simulation and networking of every match without a window, fonts or audio.
+    """
+    try:
+        asyncio.run(MatchServer(host, port).serve_forever())
+    except KeyboardInterrupt:
+        print("[MATCH SERVER] Shutting down.")
 
 
 # --- Game Logic Functions ---
@@ -2192,6 +3441,9 @@ def advance_level():
         maze_state_p2.score = p2_score
         maze_state_p2.keys = p2_keys
 
+        for maze in (maze_state_p1, maze_state_p2):
+            maze.add_event('level_advanced', value=current_level_index)
+
         overall_game_state = GAME_STATE_PLAYING
         play_level_music(current_level_index)
 
@@ -2212,6 +3464,73 @@ def advance_level():
         fireworks_manager.is_active = True
 
 
+def play_game_over_music():
+    pygame.mixer.music.stop()
+    try:
+        pygame.mixer.music.load('game_over_music.mp3')
+        pygame.mixer.music.play(-1)
+    except pygame.error as e:
+        print(f"Error playing game over music: {e}")
+
+def step_simulation():
+    """Advances the game by one fixed SIM_RATE step (server: both mazes, client: its own player)."""
+    global overall_game_state, winning_player_id
+
+    if is_server_instance:
+        step_start = time.perf_counter()
+        for maze in (maze_state_p1, maze_state_p2):
+            if maze:
+                remember_render_positions(maze)
+        # Server updates both mazes' logic. A game over or level change ends the tick, so the
+        # level advances at most once even if both players reach the exit in the same step.
+        level_index = current_level_index
+        if maze_state_p1:
+            maze_state_p1.update_game_logic()
+            if maze_state_p1.player.health <= 0:
+                overall_game_state = GAME_STATE_GAME_OVER
+                winning_player_id = 2 # P2 wins if P1 dies
+                play_game_over_music()
+
+            if maze_state_p1.level_exit_rect and maze_state_p1.player.rect.colliderect(maze_state_p1.level_exit_rect):
+                print(f"DEBUG (Server): Player 1 collided with exit. Advancing level.") # DEBUG PRINT
+                advance_level()
+
+        # Maze 2 waits while it is held for a disconnected client (see session_held)
+        if maze_state_p2 and overall_game_state == GAME_STATE_PLAYING and current_level_index == level_index \
+                and not session_held():
+            apply_client_input()
+            maze_state_p2.update_game_logic()
+            if maze_state_p2.player.health <= 0:
+                overall_game_state = GAME_STATE_GAME_OVER
+                winning_player_id = 1 # P1 wins if P2 dies
+                play_game_over_music()
+
+            if maze_state_p2.level_exit_rect and maze_state_p2.player.rect.colliderect(maze_state_p2.level_exit_rect):
+                print(f"DEBUG (Server): Player 2 collided with exit. Advancing level.") # DEBUG PRINT
+                advance_level()
+        publish_server_tick()
+        server_load.record(time.perf_counter() - step_start)
+    else:
+        # Client only updates its own player's desired direction based on input
+        # The actual game state is received from the server
+        for maze in (maze_state_p1_view, maze_state_p2_view):
+            if maze:
+                remember_render_positions(maze)
+        own_view = local_maze_view()
+        if own_view and own_view.player:
+            # Client's player logic (only movement input), predicted ahead of the server: the
+            # input is numbered and kept until a snapshot acknowledges it (see reconcile_local_player)
+            with prediction_lock:
+                pending_inputs.add(own_view.player.desired_direction)
+                own_view.player.update(own_view.wall_grid)
+
+def remember_render_positions(maze):
+    """Records where the maze's moving objects are before a step, for render interpolation."""
+    if maze.player:
+        maze.player.prev_topleft = maze.player.rect.topleft
+    for enemy in maze.enemies:
+        enemy.prev_topleft = enemy.rect.topleft
+
 
 def start_game():
     """Initializes game state and starts playing."""
@@ -2240,6 +3559,7 @@ def start_game():
         maze_state_p2.current_level_index = 0
         maze_state_p2.load_level(ALL_LEVEL_MAPS[0])
         print(f"DEBUG: P2 maze loaded. Player: {maze_state_p2.player}")
+        publish_server_tick() # Lets the client connect before the first tick
     else:
         # Client side - just wait for server state
         print("DEBUG: Client waiting for server state...")
@@ -2277,6 +3597,16 @@ def handle_login(username, password):
 
 
 
+def present_frame():
+    """Shows the frame drawn on `screen`, scaled down to the window if the display is too small for it."""
+    if screen is not window:
+        pygame.transform.smoothscale(screen, window.get_size(), window)
+    pygame.display.flip()
+
+def to_game_pos(window_pos):
+    """Maps a window position (a mouse click's) to the matching point of `screen`."""
+    return (int(window_pos[0] / display_scale), int(window_pos[1] / display_scale))
+
 def draw_text(surface, text, color, x, y, center=False):
     text_surface = font.render(text, True, color)
     text_rect = text_surface.get_rect()
@@ -2295,6 +3625,17 @@ def draw_large_text(surface, text, color, x, y, center=False):
         text_rect.topleft = (x, y)
     surface.blit(text_surface, text_rect)
 
+def draw_net_overlay(surface, metrics):
+    """Draws the connection metrics (toggled with F3) over the top-left corner."""
+    lines = metrics.overlay_lines()
+    line_height = overlay_font.get_linesize()
+    width = max(overlay_font.size(line)[0] for line in lines) + 10
+    backdrop = pygame.Surface((width, line_height * len(lines) + 10), pygame.SRCALPHA)
+    backdrop.fill((0, 0, 0, 180))
+    surface.blit(backdrop, (0, 0))
+    for i, line in enumerate(lines):
+        surface.blit(overlay_font.render(line, True, WHITE), (5, 5 + i * line_height))
+
 def draw_info_bar(surface, maze_state, x_offset):
     bar_rect = pygame.Rect(x_offset, game_area_height_single_maze, game_width_single_maze, INFO_BAR_HEIGHT)
     pygame.draw.rect(surface, BLACK, bar_rect)
@@ -2491,7 +3832,7 @@ def run_game():
            login_error_message, login_successful, username_input, password_input, active_input_field, \
            last_skip_time, intro_start_time, intro_logo, ring_base_img, violet_arc_img, intro_angle_arc, intro_angle_logo, \
            login_music_playing, pickup_sound, coin_pile_drop_sound, \
-           animating_coins_p1_visual, animating_coins_p2_visual, previous_collectibles_p1, previous_collectibles_p2
+           animating_coins_p1_visual, animating_coins_p2_visual, show_net_overlay
 
     clock = pygame.time.Clock()
 
@@ -2547,15 +3888,20 @@ def run_game():
         except pygame.error as e:
             print(f"Error playing login music: {e}")
 
+    sim_clock = FixedTimestep(SIM_RATE)
+
     while game_running_flag:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 game_running_flag = False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                show_net_overlay = not show_net_overlay
             
             if overall_game_state == GAME_STATE_MODE_SELECT:
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     server_rect, client_rect = draw_mode_select_screen()
-                    if server_rect.collidepoint(event.pos):
+                    click_pos = to_game_pos(event.pos)
+                    if server_rect.collidepoint(click_pos):
                         global is_server_instance, maze_state_p1, maze_state_p2
                         is_server_instance = True
                         overall_game_state = GAME_STATE_LOGIN
@@ -2571,7 +3917,7 @@ def run_game():
                         server_listener = threading.Thread(target=server_listener_thread, daemon=True)
                         server_listener.start()
 
-                    elif client_rect.collidepoint(event.pos):
+                    elif client_rect.collidepoint(click_pos):
                         global client_socket
                         is_server_instance = False
                         overall_game_state = GAME_STATE_LOGIN
@@ -2585,7 +3931,7 @@ def run_game():
                         # Start client thread
                         client_thread = threading.Thread(
                             target=client_thread_function,
-                            args=(('127.0.0.1', PORT),),  # <-- FIXED: always use localhost for client
+                            args=(('127.0.0.1', PORT), SPECTATE),  # <-- FIXED: always use localhost for client
                             daemon=True
                         )
                         client_thread.start()
@@ -2593,11 +3939,12 @@ def run_game():
             elif overall_game_state == GAME_STATE_LOGIN:
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     login_button_rect = draw_login_screen() # Get rect for click detection
-                    if username_box_rect.collidepoint(event.pos):
+                    click_pos = to_game_pos(event.pos)
+                    if username_box_rect.collidepoint(click_pos):
                         active_input_field = "username"
-                    elif password_box_rect.collidepoint(event.pos):
+                    elif password_box_rect.collidepoint(click_pos):
                         active_input_field = "password"
-                    elif login_button_rect.collidepoint(event.pos):
+                    elif login_button_rect.collidepoint(click_pos):
                         handle_login(username_input, password_input)
                 elif event.type == pygame.KEYDOWN:
                     if active_input_field == "username":
@@ -2624,7 +3971,7 @@ def run_game():
 
             elif overall_game_state == GAME_STATE_PLAYING:
                 if event.type == pygame.KEYDOWN:
-                    player_maze_state = maze_state_p1 if is_server_instance else maze_state_p2_view
+                    player_maze_state = maze_state_p1 if is_server_instance else local_maze_view()
                     if player_maze_state and player_maze_state.player:
                         if event.key == pygame.K_UP:
                             player_maze_state.player.desired_direction = UP
@@ -2637,10 +3984,10 @@ def run_game():
                         elif event.key == pygame.K_SPACE: # Attack key
                             # Only server processes attacks
                             if is_server_instance:
-                                player_maze_state.player.attack(player_maze_state.enemies, player_maze_state.walls, player_maze_state.current_map_layout)
+                                player_maze_state.player.attack(player_maze_state.enemy_index, player_maze_state.breakable_index, player_maze_state.current_map_layout)
 
                 elif event.type == pygame.KEYUP:
-                    player_maze_state = maze_state_p1 if is_server_instance else maze_state_p2_view
+                    player_maze_state = maze_state_p1 if is_server_instance else local_maze_view()
                     if player_maze_state and player_maze_state.player:
                         if event.key == pygame.K_UP and player_maze_state.player.desired_direction == UP:
                             player_maze_state.player.desired_direction = NO_DIRECTION
@@ -2652,47 +3999,12 @@ def run_game():
                             player_maze_state.player.desired_direction = NO_DIRECTION
 
         # --- Game State Updates ---
+        # The simulation runs in fixed SIM_RATE steps however long the last frame took
+        for _ in range(sim_clock.advance()):
+            if overall_game_state == GAME_STATE_PLAYING:
+                step_simulation()
+
         if overall_game_state == GAME_STATE_PLAYING:
-            if is_server_instance:
-                # Server updates both mazes' logic
-                if maze_state_p1:
-                    maze_state_p1.update_game_logic()
-                    if maze_state_p1.player.health <= 0:
-                        overall_game_state = GAME_STATE_GAME_OVER
-                        winning_player_id = 2 # P2 wins if P1 dies
-                        pygame.mixer.music.stop()
-                        try:
-                            pygame.mixer.music.load('game_over_music.mp3')
-                            pygame.mixer.music.play(-1)
-                        except pygame.error as e:
-                            print(f"Error playing game over music: {e}")
-
-                    if maze_state_p1.level_exit_rect and maze_state_p1.player.rect.colliderect(maze_state_p1.level_exit_rect):
-                        print(f"DEBUG (Server): Player 1 collided with exit. Advancing level.") # DEBUG PRINT
-                        advance_level()
-                
-                if maze_state_p2:
-                    maze_state_p2.update_game_logic()
-                    if maze_state_p2.player.health <= 0:
-                        overall_game_state = GAME_STATE_GAME_OVER
-                        winning_player_id = 1 # P1 wins if P2 dies
-                        pygame.mixer.music.stop()
-                        try:
-                            pygame.mixer.music.load('game_over_music.mp3')
-                            pygame.mixer.music.play(-1)
-                        except pygame.error as e:
-                            print(f"Error playing game over music: {e}")
-
-                    if maze_state_p2.level_exit_rect and maze_state_p2.player.rect.colliderect(maze_state_p2.level_exit_rect):
-                        print(f"DEBUG (Server): Player 2 collided with exit. Advancing level.") # DEBUG PRINT
-                        advance_level()
-            else:
-                # Client only updates its own player's desired direction based on input
-                # The actual game state is received from the server
-                if maze_state_p2_view and maze_state_p2_view.player:
-                    # Client's player logic (only movement input)
-                    maze_state_p2_view.player.update(maze_state_p2_view.walls)
-            
             # Update visual coin animations (client-side only)
             coins_to_remove_p1 = []
             for i, anim_coin in enumerate(animating_coins_p1_visual):
@@ -2723,6 +4035,12 @@ def run_game():
         elif overall_game_state == GAME_STATE_INTRO:
             draw_intro_screen()
         elif overall_game_state == GAME_STATE_PLAYING:
+            # Moving objects are drawn between their last two simulation steps; on the
+            # client, remote ones are drawn between the last snapshots instead
+            render_alpha = sim_clock.alpha
+            if not is_server_instance:
+                smooth_remote_entities(time.monotonic())
+
             # Draw Maze 1 (Server's Maze)
             current_maze_p1 = maze_state_p1 if is_server_instance else maze_state_p1_view
             if current_maze_p1:
@@ -2740,9 +4058,9 @@ def run_game():
                 for collectible in current_maze_p1.collectibles:
                     collectible.draw(screen)
                 for enemy in current_maze_p1.enemies:
-                    enemy.draw(screen)
+                    enemy.draw(screen, 0, render_alpha)
                 if current_maze_p1.player:
-                    current_maze_p1.player.draw(screen)
+                    current_maze_p1.player.draw(screen, 0, render_alpha)
                 draw_info_bar(screen, current_maze_p1, 0)
             else:
                 draw_text(screen, "Waiting for server to initialize P1 maze...", WHITE, game_width_single_maze // 2, game_area_height_single_maze // 2, center=True)
@@ -2768,9 +4086,9 @@ def run_game():
                 for collectible in current_maze_p2.collectibles:
                     collectible.draw(screen, maze2_x_offset)
                 for enemy in current_maze_p2.enemies:
-                    enemy.draw(screen, maze2_x_offset)
+                    enemy.draw(screen, maze2_x_offset, render_alpha)
                 if current_maze_p2.player:
-                    current_maze_p2.player.draw(screen, maze2_x_offset)
+                    current_maze_p2.player.draw(screen, maze2_x_offset, render_alpha)
                 draw_info_bar(screen, current_maze_p2, maze2_x_offset)
             else:
                 draw_text(screen, "Waiting for server to initialize P2 maze...", WHITE, maze2_x_offset + game_width_single_maze // 2, game_area_height_single_maze // 2, center=True)
@@ -2785,6 +4103,16 @@ def run_game():
             for anim_coin in animating_coins_p2_visual:
                 anim_coin.draw(screen)
 
+            # A dropped connection: the client is resuming its session, the server holds maze 2 for it
+            if reconnect_deadline is not None:
+                remaining = max(0.0, reconnect_deadline - time.monotonic())
+                draw_text(screen, f"Connection lost - reconnecting ({remaining:.0f}s)", RED,
+                          game_width_total // 2, game_area_height_single_maze // 2, center=True)
+            elif is_server_instance and session_held():
+                remaining = SESSION_GRACE_PERIOD - (time.monotonic() - session_lost_at)
+                draw_text(screen, f"Player 2 disconnected - waiting {remaining:.0f}s", RED,
+                          maze2_x_offset + game_width_single_maze // 2, game_area_height_single_maze // 2, center=True)
+
         elif overall_game_state == GAME_STATE_LEVEL_COMPLETE:
             draw_level_complete_screen()
         elif overall_game_state == GAME_STATE_GAME_OVER:
@@ -2792,7 +4120,10 @@ def run_game():
             draw_game_over_screen()
             fireworks_manager.update()
 
-        pygame.display.flip()
+        if show_net_overlay and net_metrics:
+            draw_net_overlay(screen, net_metrics)
+
+        present_frame()
         clock.tick(FPS)
 
     # Cleanup
@@ -2804,4 +4135,7 @@ def run_game():
     sys.exit()
 
 if __name__ == "__main__":
-    run_game()
+    if HEADLESS:
+        run_match_server()
+    else:
+        run_game()
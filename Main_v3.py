@@ -3,11 +3,15 @@ import math
 import random
 import socket
 import threading
-import pickle
+import itertools
 import sys
 from enum import Enum
 from dataclasses import dataclass
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
+
+from dungeon_net import (WireCodec, NodeSchema, RecordSchema, TableSchema, FieldType, EnumField, OptionalField,
+                         ArrayField, FrameReader, send_frame, LatestSlot, FixedRate, FixedTimestep, SnapshotPublisher,
+                         DatagramConnection, MAX_DATAGRAM_SIZE)
 
 # ============================================================================
 # CONFIGURATION & CONSTANTS
@@ -32,11 +36,15 @@ class Direction(Enum):
 HOST = ''
 PORT = 5050
 BUFFER_SIZE = 8192
+NETWORK_TICK_RATE = 60  # State broadcasts (server) and input messages (client) per second
+NETWORK_TRANSPORT = 'udp' if '--udp' in sys.argv else 'tcp'  # UDP drops late states instead of stalling behind a lost one
 
 # Display Configuration
 SCREEN_WIDTH = 1600
 SCREEN_HEIGHT = 900
 FPS = 60
+SIM_RATE = 60  # Fixed simulation steps per second; rendering runs at whatever rate FPS allows
+# Enemies are always simulated one by one here: the NumPy enemy batch (--batched-enemies) is Main_v1-only
 TILE_SIZE = 40
 INFO_BAR_HEIGHT = 100
 MAZE_GAP = 20
@@ -284,6 +292,127 @@ class Position:
     def distance_to(self, other: 'Position') -> float:
         return math.hypot(self.x - other.x, self.y - other.y)
 
+class TileGrid:
+    FLOOR, WALL, BREAKABLE = 0, 1, 2
+    
+    def __init__(self, rows: int, cols: int):
+        self.rows = rows
+        self.cols = cols
+        self.cells = bytearray(rows * cols)
+        self.version = 0
+    
+    def set(self, row: int, col: int, tile: int):
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            self.cells[row * self.cols + col] = tile
+            self.version += 1
+    
+    def load_cells(self, cells: bytes):
+        self.cells = bytearray(cells)
+        self.version += 1
+    
+    def blocks(self, rect: pygame.Rect, breakable: bool = True) -> bool:
+        first_col = max(0, rect.left // TILE_SIZE)
+        last_col = min(self.cols - 1, (rect.right - 1) // TILE_SIZE)
+        first_row = max(0, rect.top // TILE_SIZE)
+        last_row = min(self.rows - 1, (rect.bottom - 1) // TILE_SIZE)
+        if first_col > last_col:
+            return False
+        for row in range(first_row, last_row + 1):
+            row_start = row * self.cols
+            for tile in self.cells[row_start + first_col:row_start + last_col + 1]:
+                if tile == self.WALL or (tile == self.BREAKABLE and breakable):
+                    return True
+        return False
+
+class FlowField:
+    STEPS = (Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT)
+    
+    def __init__(self, wall_grid: TileGrid, target: Tuple[int, int]):
+        self.target = target
+        self.grid_version = wall_grid.version
+        self.rows = wall_grid.rows
+        self.cols = wall_grid.cols
+        self.steps = bytearray(self.rows * self.cols)
+        
+        row, col = target
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return
+        visited = bytearray(self.rows * self.cols)
+        queue = [row * self.cols + col]
+        visited[queue[0]] = 1
+        for index in queue:
+            row, col = divmod(index, self.cols)
+            for code, step in enumerate(self.STEPS, 1):
+                dx, dy = step.value
+                n_row, n_col = row - dy, col - dx
+                if 0 <= n_row < self.rows and 0 <= n_col < self.cols:
+                    neighbor = n_row * self.cols + n_col
+                    if not visited[neighbor] and wall_grid.cells[neighbor] != TileGrid.WALL:
+                        visited[neighbor] = 1
+                        self.steps[neighbor] = code
+                        queue.append(neighbor)
+    
+    def step_at(self, row: int, col: int) -> Direction:
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            code = self.steps[row * self.cols + col]
+            if code:
+                return self.STEPS[code - 1]
+        return Direction.NONE
+    
+    def next_target(self, pos: 'Position', goal: 'Position') -> 'Position':
+        row, col = pos.to_grid()
+        step = self.step_at(row, col)
+        if step == Direction.NONE:
+            return goal
+        dx, dy = step.value
+        return Position((col + dx) * TILE_SIZE + TILE_SIZE // 2, (row + dy) * TILE_SIZE + TILE_SIZE // 2)
+
+class SpatialHash:
+    
+    def __init__(self, entities=()):
+        self.buckets: Dict[Tuple[int, int], Dict['Entity', None]] = {}
+        self.cells: Dict['Entity', Tuple[int, int]] = {}
+        for entity in entities:
+            self.add(entity)
+    
+    def __len__(self) -> int:
+        return len(self.cells)
+    
+    def add(self, entity: 'Entity'):
+        cell = entity.pos.to_grid()
+        self.cells[entity] = cell
+        self.buckets.setdefault(cell, {})[entity] = None
+    
+    def remove(self, entity: 'Entity'):
+        cell = self.cells.pop(entity, None)
+        if cell is not None:
+            bucket = self.buckets[cell]
+            del bucket[entity]
+            if not bucket:
+                del self.buckets[cell]
+    
+    def move(self, entity: 'Entity'):
+        if self.cells.get(entity) != entity.pos.to_grid():
+            self.remove(entity)
+            self.add(entity)
+    
+    def query_rect(self, rect: pygame.Rect) -> List['Entity']:
+        rows = range(rect.top // TILE_SIZE - 1, (rect.bottom - 1) // TILE_SIZE + 2)
+        cols = range(rect.left // TILE_SIZE - 1, (rect.right - 1) // TILE_SIZE + 2)
+        return [entity for entity in self._near(rows, cols) if rect.colliderect(entity.rect)]
+    
+    def query_radius(self, pos: 'Position', radius: float) -> List['Entity']:
+        rows = range(int((pos.y - radius) // TILE_SIZE), int((pos.y + radius) // TILE_SIZE) + 1)
+        cols = range(int((pos.x - radius) // TILE_SIZE), int((pos.x + radius) // TILE_SIZE) + 1)
+        return [entity for entity in self._near(rows, cols) if pos.distance_to(entity.pos) < radius]
+    
+    def _near(self, rows: range, cols: range):
+        for row in rows:
+            for col in cols:
+                bucket = self.buckets.get((row, col))
+                if bucket:
+                    yield from bucket
+
 class Particle:
     def __init__(self, x: float, y: float, vx: float, vy: float, 
                  color: Tuple[int, int, int], lifespan: int, size: int = 3):
@@ -321,13 +450,23 @@ class Entity:
         self.width = width
         self.height = height
         self.rect = pygame.Rect(x - width // 2, y - height // 2, width, height)
+        self.entity_id = 0
+        self.prev_pos = (x, y)
     
     def update_rect(self):
         self.rect.x = self.pos.x - self.width // 2
         self.rect.y = self.pos.y - self.height // 2
     
+    def render_pos(self, alpha: float) -> Tuple[float, float]:
+        prev_x, prev_y = self.prev_pos
+        if abs(self.pos.x - prev_x) > TILE_SIZE or abs(self.pos.y - prev_y) > TILE_SIZE:
+            return self.pos.x, self.pos.y
+        return (prev_x + (self.pos.x - prev_x) * alpha,
+                prev_y + (self.pos.y - prev_y) * alpha)
+    
     def get_state(self) -> dict:
         return {
+            'id': self.entity_id,
             'x': self.pos.x,
             'y': self.pos.y
         }
@@ -361,6 +500,19 @@ class Wall(Entity):
         draw_rect.x += offset_x
         pygame.draw.rect(surface, color, draw_rect)
         pygame.draw.rect(surface, COLORS['black'], draw_rect, 2)
+    
+    def get_state(self) -> dict:
+        state = super().get_state()
+        state.update({
+            'breakable': self.breakable,
+            'health': self.health
+        })
+        return state
+    
+    def set_state(self, state: dict):
+        super().set_state(state)
+        self.breakable = state['breakable']
+        self.health = state['health']
 
 class Player(Entity):
     def __init__(self, x: float, y: float, player_id: int):
@@ -379,7 +531,7 @@ class Player(Entity):
         self.mouth_open = True
         self.anim_timer = 0
     
-    def move(self, dx: int, dy: int, walls: List[Wall]):
+    def move(self, dx: int, dy: int, wall_grid: TileGrid):
         if dx != 0 or dy != 0:
             self.direction = Direction((dx, dy))
             if dx != 0 or dy != 0:
@@ -391,18 +543,12 @@ class Player(Entity):
         test_rect = pygame.Rect(new_x - self.width // 2, new_y - self.height // 2,
                                self.width, self.height)
         
-        collision = False
-        for wall in walls:
-            if test_rect.colliderect(wall.rect):
-                collision = True
-                break
-        
-        if not collision:
+        if not wall_grid.blocks(test_rect):
             self.pos.x = new_x
             self.pos.y = new_y
             self.update_rect()
     
-    def attack(self, enemies: List['Enemy'], walls: List[Wall]) -> List[Particle]:
+    def attack(self, enemy_index: SpatialHash, breakable_index: SpatialHash) -> List[Particle]:
         particles = []
         now = pygame.time.get_ticks()
         
@@ -411,30 +557,28 @@ class Player(Entity):
         
         self.last_attack_time = now
         
-        for enemy in enemies:
-            if self.pos.distance_to(enemy.pos) < PLAYER_ATTACK_RANGE:
-                enemy.take_damage(PLAYER_ATTACK_DAMAGE)
-                for _ in range(5):
+        for enemy in enemy_index.query_radius(self.pos, PLAYER_ATTACK_RANGE):
+            enemy.take_damage(PLAYER_ATTACK_DAMAGE)
+            for _ in range(5):
+                angle = random.uniform(0, 2 * math.pi)
+                speed = random.uniform(2, 5)
+                particles.append(Particle(
+                    enemy.pos.x, enemy.pos.y,
+                    math.cos(angle) * speed, math.sin(angle) * speed,
+                    COLORS['red'], 30, 3
+                ))
+        
+        for wall in breakable_index.query_radius(self.pos, PLAYER_ATTACK_RANGE):
+            if wall.take_damage(PLAYER_ATTACK_DAMAGE):
+                for _ in range(10):
                     angle = random.uniform(0, 2 * math.pi)
-                    speed = random.uniform(2, 5)
+                    speed = random.uniform(2, 6)
                     particles.append(Particle(
-                        enemy.pos.x, enemy.pos.y,
+                        wall.pos.x, wall.pos.y,
                         math.cos(angle) * speed, math.sin(angle) * speed,
-                        COLORS['red'], 30, 3
+                        COLORS['gray'], 40, 4
                     ))
         
-        for wall in walls:
-            if wall.breakable and self.pos.distance_to(wall.pos) < PLAYER_ATTACK_RANGE:
-                if wall.take_damage(PLAYER_ATTACK_DAMAGE):
-                    for _ in range(10):
-                        angle = random.uniform(0, 2 * math.pi)
-                        speed = random.uniform(2, 6)
-                        particles.append(Particle(
-                            wall.pos.x, wall.pos.y,
-                            math.cos(angle) * speed, math.sin(angle) * speed,
-                            COLORS['gray'], 40, 4
-                        ))
-        
         return particles
     
     def take_damage(self, amount: int):
@@ -447,8 +591,9 @@ class Player(Entity):
         if self.health > self.max_health:
             self.health = self.max_health
     
-    def draw(self, surface: pygame.Surface, offset_x: int = 0):
-        center = (int(self.pos.x + offset_x), int(self.pos.y))
+    def draw(self, surface: pygame.Surface, offset_x: int = 0, alpha: float = 1.0):
+        x, y = self.render_pos(alpha)
+        center = (int(x + offset_x), int(y))
         radius = self.width // 2
         
         if pygame.time.get_ticks() - self.anim_timer > 150:
@@ -521,13 +666,13 @@ class Enemy(Entity):
         self.last_attack_time = 0
         self.next_patrol_time = pygame.time.get_ticks()
     
-    def update(self, player: Player, walls: List[Wall]):
-        dist = self.pos.distance_to(player.pos)
+    def update(self, player: Player, wall_grid: TileGrid, flow_field: Optional[FlowField] = None):
+        player_dist = self.pos.distance_to(player.pos)
         
-        if dist < ENEMY_DETECTION_RANGE:
+        if player_dist < ENEMY_DETECTION_RANGE:
             self.state = 'chase'
             self.speed = ENEMY_SPEED_CHASE
-            target = player.pos
+            target = flow_field.next_target(self.pos, player.pos) if flow_field else player.pos
         else:
             self.state = 'patrol'
             self.speed = ENEMY_SPEED_PATROL
@@ -553,34 +698,34 @@ class Enemy(Entity):
             new_x = self.pos.x + dx
             new_y = self.pos.y + dy
             
-            test_rect = pygame.Rect(new_x - self.width // 2, new_y - self.height // 2,
-                                   self.width, self.height)
-            
-            collision = False
-            for wall in walls:
-                if not wall.breakable and test_rect.colliderect(wall.rect):
-                    collision = True
-                    break
-            
-            if not collision:
-                self.pos.x = new_x
-                self.pos.y = new_y
-                self.update_rect()
+            if not self._try_move(new_x, new_y, wall_grid):
+                self._try_move(new_x, self.pos.y, wall_grid) or self._try_move(self.pos.x, new_y, wall_grid)
         
-        if self.state == 'chase' and dist < ENEMY_ATTACK_RANGE:
+        if self.state == 'chase' and player_dist < ENEMY_ATTACK_RANGE:
             now = pygame.time.get_ticks()
             if now - self.last_attack_time > ENEMY_ATTACK_COOLDOWN:
                 player.take_damage(ENEMY_DAMAGE)
                 self.last_attack_time = now
     
+    def _try_move(self, new_x: float, new_y: float, wall_grid: TileGrid) -> bool:
+        test_rect = pygame.Rect(new_x - self.width // 2, new_y - self.height // 2,
+                               self.width, self.height)
+        if wall_grid.blocks(test_rect, breakable=False):
+            return False
+        self.pos.x = new_x
+        self.pos.y = new_y
+        self.update_rect()
+        return True
+    
     def take_damage(self, amount: int):
         self.health -= amount
         if self.health < 0:
             self.health = 0
     
-    def draw(self, surface: pygame.Surface, offset_x: int = 0):
-        draw_rect = self.rect.copy()
-        draw_rect.x += offset_x
+    def draw(self, surface: pygame.Surface, offset_x: int = 0, alpha: float = 1.0):
+        x, y = self.render_pos(alpha)
+        draw_rect = pygame.Rect(int(x) - self.width // 2 + offset_x, int(y) - self.height // 2,
+                                self.width, self.height)
         
         color = COLORS['red'] if self.state == 'chase' else COLORS['orange']
         pygame.draw.rect(surface, color, draw_rect)
@@ -653,51 +798,122 @@ class Collectible(Entity):
 # MAZE STATE
 # ============================================================================
 
+@dataclass(frozen=True)
+class CompiledLevel:
+    rows: int
+    cols: int
+    cells: bytes
+    walls: Tuple[Tuple[int, int, bool], ...]
+    player_spawn: Optional[Tuple[int, int]]
+    enemy_spawns: Tuple[Tuple[int, int], ...]
+    collectible_spawns: Tuple[Tuple[int, int, str], ...]
+    exit_rect: Optional[Tuple[int, int, int, int]]
+
+def compile_level(level_map: List[str]) -> CompiledLevel:
+    rows, cols = len(level_map), len(level_map[0])
+    cells = bytearray(rows * cols)
+    walls = []
+    enemy_spawns = []
+    collectible_spawns = []
+    player_spawn = None
+    exit_rect = None
+    for row_idx, row in enumerate(level_map):
+        for col_idx, tile in enumerate(row):
+            x = col_idx * TILE_SIZE
+            y = row_idx * TILE_SIZE
+            
+            if tile == '#' or tile == 'B':
+                walls.append((x, y, tile == 'B'))
+                cells[row_idx * cols + col_idx] = TileGrid.BREAKABLE if tile == 'B' else TileGrid.WALL
+            elif tile == 'P':
+                player_spawn = (x + TILE_SIZE // 2, y + TILE_SIZE // 2)
+            elif tile == 'E':
+                enemy_spawns.append((x + TILE_SIZE // 2, y + TILE_SIZE // 2))
+            elif tile in ['G', 'H', 'K']:
+                collectible_spawns.append((x, y, tile))
+            elif tile == 'L':
+                exit_rect = (x, y, TILE_SIZE, TILE_SIZE)
+    return CompiledLevel(rows, cols, bytes(cells), tuple(walls), player_spawn, tuple(enemy_spawns),
+                         tuple(collectible_spawns), exit_rect)
+
+compiled_levels: Dict[Tuple[int, int], CompiledLevel] = {}
+
+def compiled_level(level_index: int) -> CompiledLevel:
+    level_map = LEVELS[level_index]
+    key = (level_index, hash(tuple(level_map)))
+    level = compiled_levels.get(key)
+    if level is None:
+        level = compiled_levels[key] = compile_level(level_map)
+    return level
+
+entity_ids = itertools.count(1)
+
 class MazeState:
-    def __init__(self, player_id: int, level_map: List[str]):
+    def __init__(self, player_id: int, level: CompiledLevel):
         self.player_id = player_id
         self.player: Optional[Player] = None
         self.enemies: List[Enemy] = []
         self.collectibles: List[Collectible] = []
         self.walls: List[Wall] = []
+        self.wall_grid = TileGrid(0, 0)
+        self.enemy_index = SpatialHash()
+        self.collectible_index = SpatialHash()
+        self.breakable_index = SpatialHash()
+        self.flow_field: Optional[FlowField] = None
         self.exit_rect: Optional[pygame.Rect] = None
         self.particles: List[Particle] = []
         
-        self.load_level(level_map)
+        self.load_level(level)
     
-    def load_level(self, level_map: List[str]):
+    def load_level(self, level: CompiledLevel):
         self.enemies.clear()
         self.collectibles.clear()
         self.walls.clear()
         self.particles.clear()
         
-        for row_idx, row in enumerate(level_map):
-            for col_idx, tile in enumerate(row):
-                x = col_idx * TILE_SIZE
-                y = row_idx * TILE_SIZE
-                
-                if tile == '#':
-                    self.walls.append(Wall(x, y, False))
-                elif tile == 'B':
-                    self.walls.append(Wall(x, y, True))
-                elif tile == 'P':
-                    self.player = Player(x + TILE_SIZE // 2, y + TILE_SIZE // 2, 
-                                        self.player_id)
-                elif tile == 'E':
-                    self.enemies.append(Enemy(x + TILE_SIZE // 2, y + TILE_SIZE // 2))
-                elif tile in ['G', 'H', 'K']:
-                    self.collectibles.append(Collectible(x, y, tile))
-                elif tile == 'L':
-                    self.exit_rect = pygame.Rect(x, y, TILE_SIZE, TILE_SIZE)
+        for x, y, breakable in level.walls:
+            self.walls.append(self._new_entity(Wall(x, y, breakable)))
+        if level.player_spawn:
+            self.player = Player(*level.player_spawn, self.player_id)
+        for x, y in level.enemy_spawns:
+            self.enemies.append(self._new_entity(Enemy(x, y)))
+        for x, y, tile in level.collectible_spawns:
+            self.collectibles.append(self._new_entity(Collectible(x, y, tile)))
+        if level.exit_rect:
+            self.exit_rect = pygame.Rect(level.exit_rect)
+        
+        self.wall_grid = TileGrid(level.rows, level.cols)
+        self.wall_grid.load_cells(level.cells)
+        self.flow_field = None
+        self._rebuild_indexes()
+    
+    def _rebuild_indexes(self):
+        self.enemy_index = SpatialHash(self.enemies)
+        self.collectible_index = SpatialHash(self.collectibles)
+        self.breakable_index = SpatialHash(w for w in self.walls if w.breakable)
+    
+    def chase_field(self) -> FlowField:
+        target = self.player.pos.to_grid()
+        field = self.flow_field
+        if field is None or field.target != target or field.grid_version != self.wall_grid.version:
+            self.flow_field = FlowField(self.wall_grid, target)
+        return self.flow_field
+    
+    def _new_entity(self, entity: Entity) -> Entity:
+        entity.entity_id = next(entity_ids)
+        return entity
     
     def update(self):
         if not self.player:
             return
         
+        flow_field = self.chase_field() if self.enemies else None
         for enemy in self.enemies[:]:
-            enemy.update(self.player, self.walls)
+            enemy.update(self.player, self.wall_grid, flow_field)
+            self.enemy_index.move(enemy)
             if enemy.health <= 0:
                 self.enemies.remove(enemy)
+                self.enemy_index.remove(enemy)
                 self.player.score += 50
                 for _ in range(15):
                     angle = random.uniform(0, 2 * math.pi)
@@ -708,30 +924,34 @@ class MazeState:
                         COLORS['red'], 50, 4
                     ))
         
-        for collectible in self.collectibles[:]:
-            if self.player.rect.colliderect(collectible.rect):
-                if collectible.item_type == 'G':
-                    self.player.score += GOLD_VALUE
-                elif collectible.item_type == 'H':
-                    self.player.heal(HEALTH_POTION_HEAL)
-                elif collectible.item_type == 'K':
-                    self.player.keys += 1
-                self.collectibles.remove(collectible)
-                
-                for _ in range(8):
-                    angle = random.uniform(0, 2 * math.pi)
-                    speed = random.uniform(2, 5)
-                    color = COLORS['gold'] if collectible.item_type == 'G' else COLORS['green']
-                    self.particles.append(Particle(
-                        collectible.pos.x, collectible.pos.y,
-                        math.cos(angle) * speed, math.sin(angle) * speed,
-                        color, 30, 3
-                    ))
+        for collectible in self.collectible_index.query_rect(self.player.rect):
+            if collectible.item_type == 'G':
+                self.player.score += GOLD_VALUE
+            elif collectible.item_type == 'H':
+                self.player.heal(HEALTH_POTION_HEAL)
+            elif collectible.item_type == 'K':
+                self.player.keys += 1
+            self.collectibles.remove(collectible)
+            self.collectible_index.remove(collectible)
+            
+            for _ in range(8):
+                angle = random.uniform(0, 2 * math.pi)
+                speed = random.uniform(2, 5)
+                color = COLORS['gold'] if collectible.item_type == 'G' else COLORS['green']
+                self.particles.append(Particle(
+                    collectible.pos.x, collectible.pos.y,
+                    math.cos(angle) * speed, math.sin(angle) * speed,
+                    color, 30, 3
+                ))
         
+        for wall in self.walls:
+            if wall.breakable and wall.health <= 0:
+                self.wall_grid.set(*wall.pos.to_grid(), TileGrid.FLOOR)
+                self.breakable_index.remove(wall)
         self.walls = [w for w in self.walls if not w.breakable or w.health > 0]
         self.particles = [p for p in self.particles if p.update()]
     
-    def draw(self, surface: pygame.Surface, offset_x: int = 0):
+    def draw(self, surface: pygame.Surface, offset_x: int = 0, alpha: float = 1.0):
         maze_width = len(LEVELS[0][0]) * TILE_SIZE
         maze_height = len(LEVELS[0]) * TILE_SIZE
         pygame.draw.rect(surface, COLORS['floor'],
@@ -758,21 +978,24 @@ class MazeState:
             collectible.draw(surface, offset_x)
         
         for enemy in self.enemies:
-            enemy.draw(surface, offset_x)
+            enemy.draw(surface, offset_x, alpha)
         
         if self.player:
-            self.player.draw(surface, offset_x)
+            self.player.draw(surface, offset_x, alpha)
         
         for particle in self.particles:
             particle.draw(surface, offset_x)
     
+    def remember_positions(self):
+        for entity in ([self.player] if self.player else []) + self.enemies:
+            entity.prev_pos = (entity.pos.x, entity.pos.y)
+    
     def get_state(self) -> dict:
         return {
             'player': self.player.get_state() if self.player else None,
             'enemies': [e.get_state() for e in self.enemies],
             'collectibles': [c.get_state() for c in self.collectibles],
-            'walls': [{'x': w.pos.x, 'y': w.pos.y, 'breakable': w.breakable, 
-                      'health': w.health} for w in self.walls],
+            'walls': [w.get_state() for w in self.walls if w.breakable],
             'exit': (self.exit_rect.x, self.exit_rect.y) if self.exit_rect else None
         }
     
@@ -780,26 +1003,83 @@ class MazeState:
         if state['player'] and self.player:
             self.player.set_state(state['player'])
         
-        while len(self.enemies) < len(state['enemies']):
-            self.enemies.append(Enemy(0, 0))
-        while len(self.enemies) > len(state['enemies']):
-            self.enemies.pop()
-        for enemy, e_state in zip(self.enemies, state['enemies']):
-            enemy.set_state(e_state)
-        
-        while len(self.collectibles) < len(state['collectibles']):
-            self.collectibles.append(Collectible(0, 0, 'G'))
-        while len(self.collectibles) > len(state['collectibles']):
-            self.collectibles.pop()
-        for collectible, c_state in zip(self.collectibles, state['collectibles']):
-            collectible.set_state(c_state)
-        
-        self.walls.clear()
-        for w_state in state['walls']:
-            wall = Wall(w_state['x'] - TILE_SIZE // 2, w_state['y'] - TILE_SIZE // 2,
-                       w_state['breakable'])
-            wall.health = w_state['health']
-            self.walls.append(wall)
+        self.enemies, _, despawned = self._sync_entities(self.enemies, state['enemies'],
+                                                         lambda e_state: Enemy(0, 0))
+        self._sync_index(self.enemy_index, self.enemies, despawned)
+        self.collectibles, _, despawned = self._sync_entities(self.collectibles, state['collectibles'],
+                                                              lambda c_state: Collectible(0, 0, c_state['type']))
+        self._sync_index(self.collectible_index, self.collectibles, despawned)
+        breakable_walls, built, destroyed = self._sync_entities(
+            [w for w in self.walls if w.breakable], state['walls'], lambda w_state: Wall(0, 0, w_state['breakable']))
+        self.walls = [w for w in self.walls if not w.breakable] + breakable_walls
+        self._sync_index(self.breakable_index, breakable_walls, destroyed)
+        for wall in destroyed:
+            self.wall_grid.set(*wall.pos.to_grid(), TileGrid.FLOOR)
+        for wall in built:
+            self.wall_grid.set(*wall.pos.to_grid(), TileGrid.BREAKABLE)
+    
+    def _sync_entities(self, entities: list, states: List[dict], factory) -> Tuple[list, list, list]:
+        by_id = {entity.entity_id: entity for entity in entities}
+        synced = []
+        spawned = []
+        for entity_state in states:
+            entity = by_id.pop(entity_state['id'], None)
+            if entity is None:
+                entity = factory(entity_state)
+                entity.entity_id = entity_state['id']
+                spawned.append(entity)
+            entity.set_state(entity_state)
+            synced.append(entity)
+        return synced, spawned, list(by_id.values())
+    
+    def _sync_index(self, index: SpatialHash, entities: list, despawned: list):
+        for entity in despawned:
+            index.remove(entity)
+        for entity in entities:
+            index.move(entity)
+
+# ============================================================================
+# WIRE FORMAT
+# ============================================================================
+
+# Bump WIRE_VERSION whenever a schema changes so mismatched builds refuse to talk
+WIRE_VERSION = 6
+MSG_STATE = 1   # Server -> client: both mazes
+MSG_INPUT = 2   # Client -> server: pressed keys
+MSG_STATUS = 3  # Server -> client, reliable: level and game state, sent whenever they change
+
+ENTITY_WIRE_FIELDS = [('id', 'I'), ('x', 'f'), ('y', 'f')]
+
+PLAYER_WIRE_SCHEMA = NodeSchema(fields=ENTITY_WIRE_FIELDS + [
+    ('health', 'h'), ('score', 'i'), ('keys', 'H'), ('player_id', 'B'),
+    ('facing', EnumField(*[d.value for d in Direction]))
+])
+
+ENEMY_WIRE_RECORD = RecordSchema(*ENTITY_WIRE_FIELDS, ('health', 'h'),
+                                 ('state', EnumField('patrol', 'chase')),
+                                 ('patrol_x', 'f'), ('patrol_y', 'f'))
+COLLECTIBLE_WIRE_RECORD = RecordSchema(*ENTITY_WIRE_FIELDS, ('type', EnumField('G', 'H', 'K')))
+WALL_WIRE_RECORD = RecordSchema(*ENTITY_WIRE_FIELDS, ('breakable', '?'), ('health', 'h'))
+
+MAZE_WIRE_SCHEMA = NodeSchema(
+    fields=[('exit', OptionalField(FieldType('hh')))],
+    tables={
+        'enemies': TableSchema(None, ENEMY_WIRE_RECORD),
+        'collectibles': TableSchema(None, COLLECTIBLE_WIRE_RECORD),
+        'walls': TableSchema(None, WALL_WIRE_RECORD)
+    },
+    children={'player': PLAYER_WIRE_SCHEMA}
+)
+
+wire_codec = WireCodec(WIRE_VERSION, {
+    MSG_STATE: NodeSchema(fields=[('level', 'B'), ('state', 'B')],
+                          children={'maze1': MAZE_WIRE_SCHEMA, 'maze2': MAZE_WIRE_SCHEMA}),
+    MSG_INPUT: NodeSchema(fields=[('keys', ArrayField(FieldType('I'))), ('attack', '?')]),
+    MSG_STATUS: NodeSchema(fields=[('level', 'B'), ('state', 'B')])
+}, required={
+    MSG_INPUT: ('keys', 'attack'),
+    MSG_STATUS: ('level', 'state')
+})
 
 # ============================================================================
 # GAME MANAGER
@@ -823,9 +1103,15 @@ class Game:
         self.maze1: Optional[MazeState] = None
         self.maze2: Optional[MazeState] = None
         self.current_level = 0
+        self.loaded_level: Optional[int] = None
+        self.sim_clock = FixedTimestep(SIM_RATE)
         
         self.socket: Optional[socket.socket] = None
-        self.connection: Optional[socket.socket] = None
+        self.connection = None
+        self.client_input_slot = LatestSlot()
+        self.server_state_slot = LatestSlot()
+        self.server_status_slot = LatestSlot()
+        self.snapshot_publisher = SnapshotPublisher()
         
         self.username = ""
         self.password = ""
@@ -835,8 +1121,14 @@ class Game:
         self.keys_pressed = set()
         self.mouse_pos = (0, 0)
     
-    def start_server(self):
+    def start_server(self, transport: str = NETWORK_TRANSPORT):
         self.is_server = True
+        if transport == 'udp':
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.bind((HOST, PORT))
+            print(f"[SERVER] Listening for UDP on port {PORT}")
+            threading.Thread(target=self._server_listen_udp, daemon=True).start()
+            return
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind((HOST, PORT))
@@ -853,46 +1145,81 @@ class Game:
         except Exception as e:
             print(f"[SERVER] Error: {e}")
     
+    def _server_listen_udp(self):
+        try:
+            while self.running:
+                data, addr = self.socket.recvfrom(MAX_DATAGRAM_SIZE)
+                if self.connection is None:
+                    print(f"[SERVER] Client connected from {addr}")
+                    self.connection = DatagramConnection(self.socket, addr)
+                    self.is_connected = True
+                    threading.Thread(target=self._server_communicate, daemon=True).start()
+                if addr == self.connection.peer:
+                    self.connection.deliver(data)
+        except Exception as e:
+            print(f"[SERVER] Error: {e}")
+    
+    def _send_message(self, msg_type: int, message: dict, reliable: bool = False):
+        payload = wire_codec.encode(msg_type, message)
+        if isinstance(self.connection, DatagramConnection):
+            self.connection.send(payload, reliable)
+        else:
+            send_frame(self.connection, payload)
+    
+    def _payload_reader(self):
+        if isinstance(self.connection, DatagramConnection):
+            return self.connection.receive
+        return FrameReader(self.connection, BUFFER_SIZE).read_frame
+    
     def _server_communicate(self):
+        threading.Thread(target=self._server_receive, daemon=True).start()
+        send_timer = FixedRate(NETWORK_TICK_RATE)
+        sent_status = None
+        sent_version = 0
         while self.running and self.is_connected:
             try:
-                if self.maze1 and self.maze2:
-                    game_state = {
-                        'maze1': self.maze1.get_state(),
-                        'maze2': self.maze2.get_state(),
-                        'level': self.current_level,
-                        'state': self.state.value
-                    }
-                    data = pickle.dumps(game_state)
-                    self.connection.sendall(len(data).to_bytes(4, 'big'))
-                    self.connection.sendall(data)
+                published = (self.snapshot_publisher.wait_newer(sent_version, send_timer.interval)
+                             or self.snapshot_publisher.latest())
+                if published:
+                    sent_version = published.version
+                    status = {'level': published.state['level'], 'state': published.state['state']}
+                    if status != sent_status:
+                        self._send_message(MSG_STATUS, status, reliable=True)
+                        sent_status = status
+                    self._send_message(MSG_STATE, published.state)
                 
-                size_data = self.connection.recv(4)
-                if not size_data:
-                    break
-                size = int.from_bytes(size_data, 'big')
-                data = b''
-                while len(data) < size:
-                    packet = self.connection.recv(min(size - len(data), BUFFER_SIZE))
-                    if not packet:
-                        break
-                    data += packet
-                
-                if data:
-                    client_input = pickle.loads(data)
-                    self._process_client_input(client_input)
-                
-                pygame.time.wait(16)
+                send_timer.wait()
             except Exception as e:
                 print(f"[SERVER] Communication error: {e}")
                 self.is_connected = False
                 break
     
-    def connect_to_server(self, host: str):
+    def _server_receive(self):
+        read_payload = self._payload_reader()
+        while self.running and self.is_connected:
+            try:
+                data = read_payload()
+                if data is None:
+                    break
+                msg_type, client_input = wire_codec.decode(data)
+                self.client_input_slot.put(client_input)
+            except Exception as e:
+                print(f"[SERVER] Communication error: {e}")
+                break
+        self.is_connected = False
+    
+    def connect_to_server(self, host: str, transport: str = NETWORK_TRANSPORT):
         self.is_server = False
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((host, PORT))
+            if transport == 'udp':
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.socket.connect((host, PORT))
+                self.connection = DatagramConnection(self.socket)
+                self._send_message(MSG_INPUT, {'keys': [], 'attack': False}, reliable=True)
+            else:
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.socket.connect((host, PORT))
+                self.connection = self.socket
             print(f"[CLIENT] Connected to {host}:{PORT}")
             self.is_connected = True
             threading.Thread(target=self._client_communicate, daemon=True).start()
@@ -901,45 +1228,45 @@ class Game:
             self.error_message = f"Connection failed: {e}"
     
     def _client_communicate(self):
+        threading.Thread(target=self._client_send, daemon=True).start()
+        read_payload = self._payload_reader()
         while self.running and self.is_connected:
             try:
-                size_data = self.socket.recv(4)
-                if not size_data:
+                data = read_payload()
+                if data is None:
                     break
-                size = int.from_bytes(size_data, 'big')
-                data = b''
-                while len(data) < size:
-                    packet = self.socket.recv(min(size - len(data), BUFFER_SIZE))
-                    if not packet:
-                        break
-                    data += packet
-                
-                if data:
-                    game_state = pickle.loads(data)
-                    self._process_server_state(game_state)
-                
+                msg_type, message = wire_codec.decode(data)
+                if msg_type == MSG_STATUS:
+                    self.server_status_slot.put(message)
+                else:
+                    self.server_state_slot.put(message)
+            except Exception as e:
+                print(f"[CLIENT] Communication error: {e}")
+                break
+        self.is_connected = False
+    
+    def _client_send(self):
+        send_timer = FixedRate(NETWORK_TICK_RATE)
+        while self.running and self.is_connected:
+            try:
                 if self.maze2 and self.maze2.player:
                     client_input = {
                         'keys': list(self.keys_pressed),
                         'attack': pygame.K_SPACE in self.keys_pressed
                     }
-                    data = pickle.dumps(client_input)
-                    self.socket.sendall(len(data).to_bytes(4, 'big'))
-                    self.socket.sendall(data)
+                    self._send_message(MSG_INPUT, client_input)
                 
-                pygame.time.wait(16)
+                send_timer.wait()
             except Exception as e:
                 print(f"[CLIENT] Communication error: {e}")
                 self.is_connected = False
                 break
     
-    def _process_client_input(self, input_data: dict):
-        if not self.maze2 or not self.maze2.player:
+    def _apply_player_input(self, maze: MazeState, keys: set, can_attack: bool = True):
+        if not maze.player:
             return
         
-        keys = set(input_data.get('keys', []))
         dx, dy = 0, 0
-        
         if pygame.K_UP in keys:
             dy -= 1
         if pygame.K_DOWN in keys:
@@ -949,31 +1276,42 @@ class Game:
         if pygame.K_RIGHT in keys:
             dx += 1
         
-        self.maze2.player.move(dx, dy, self.maze2.walls)
+        maze.player.move(dx, dy, maze.wall_grid)
         
-        if input_data.get('attack'):
-            particles = self.maze2.player.attack(self.maze2.enemies, self.maze2.walls)
-            self.maze2.particles.extend(particles)
+        if can_attack and pygame.K_SPACE in keys:
+            particles = maze.player.attack(maze.enemy_index, maze.breakable_index)
+            maze.particles.extend(particles)
     
     def _process_server_state(self, state: dict):
         self.current_level = state.get('level', 0)
         self.state = GameState(state.get('state', GameState.PLAYING.value))
         
+        if self.loaded_level != self.current_level or not self.maze1 or not self.maze2:
+            self.maze1 = MazeState(1, compiled_level(self.current_level))
+            self.maze2 = MazeState(2, compiled_level(self.current_level))
+            self.loaded_level = self.current_level
+        
         if state.get('maze1'):
-            if not self.maze1:
-                self.maze1 = MazeState(1, LEVELS[self.current_level])
             self.maze1.set_state(state['maze1'])
         
         if state.get('maze2'):
-            if not self.maze2:
-                self.maze2 = MazeState(2, LEVELS[self.current_level])
             self.maze2.set_state(state['maze2'])
     
     def start_game(self):
         self.state = GameState.PLAYING
         self.current_level = 0
-        self.maze1 = MazeState(1, LEVELS[0])
-        self.maze2 = MazeState(2, LEVELS[0])
+        self.maze1 = MazeState(1, compiled_level(0))
+        self.maze2 = MazeState(2, compiled_level(0))
+        if self.is_server:
+            self._publish_snapshot()
+    
+    def _publish_snapshot(self):
+        self.snapshot_publisher.publish({
+            'maze1': self.maze1.get_state(),
+            'maze2': self.maze2.get_state(),
+            'level': self.current_level,
+            'state': self.state.value
+        })
     
     def advance_level(self):
         self.current_level += 1
@@ -989,8 +1327,8 @@ class Game:
         p2_score = self.maze2.player.score if self.maze2 and self.maze2.player else 0
         p2_keys = self.maze2.player.keys if self.maze2 and self.maze2.player else 0
         
-        self.maze1 = MazeState(1, LEVELS[self.current_level])
-        self.maze2 = MazeState(2, LEVELS[self.current_level])
+        self.maze1 = MazeState(1, compiled_level(self.current_level))
+        self.maze2 = MazeState(2, compiled_level(self.current_level))
         
         if self.maze1.player:
             self.maze1.player.health = p1_health
@@ -1099,26 +1437,28 @@ class Game:
             self.error_message = "Invalid credentials"
     
     def update(self):
-        if self.state == GameState.PLAYING and self.is_server:
+        if not self.is_server:
+            server_status = self.server_status_slot.take()
+            if server_status:
+                self.current_level = server_status['level']
+                self.state = GameState(server_status['state'])
+            server_state = self.server_state_slot.take()
+            if server_state:
+                self._process_server_state(server_state)
+        
+        for _ in range(self.sim_clock.advance()):
+            if self.state == GameState.PLAYING:
+                self._simulation_step()
+    
+    def _simulation_step(self):
+        for maze in (self.maze1, self.maze2):
+            if maze:
+                maze.remember_positions()
+        
+        if self.is_server:
+            level = self.current_level
             if self.maze1:
-                dx, dy = 0, 0
-                if pygame.K_UP in self.keys_pressed:
-                    dy -= 1
-                if pygame.K_DOWN in self.keys_pressed:
-                    dy += 1
-                if pygame.K_LEFT in self.keys_pressed:
-                    dx -= 1
-                if pygame.K_RIGHT in self.keys_pressed:
-                    dx += 1
-                
-                if self.maze1.player:
-                    self.maze1.player.move(dx, dy, self.maze1.walls)
-                    
-                    if pygame.K_SPACE in self.keys_pressed:
-                        particles = self.maze1.player.attack(self.maze1.enemies, 
-                                                            self.maze1.walls)
-                        self.maze1.particles.extend(particles)
-                
+                self._apply_player_input(self.maze1, self.keys_pressed)
                 self.maze1.update()
                 
                 if self.maze1.player and self.maze1.exit_rect:
@@ -1128,7 +1468,10 @@ class Game:
                 if self.maze1.player and self.maze1.player.health <= 0:
                     self.state = GameState.GAME_OVER
             
-            if self.maze2:
+            if self.maze2 and self.state == GameState.PLAYING and self.current_level == level:
+                client_input = self.client_input_slot.get()
+                if client_input:
+                    self._apply_player_input(self.maze2, set(client_input.get('keys', [])))
                 self.maze2.update()
                 
                 if self.maze2.player and self.maze2.exit_rect:
@@ -1137,20 +1480,11 @@ class Game:
                 
                 if self.maze2.player and self.maze2.player.health <= 0:
                     self.state = GameState.GAME_OVER
+            
+            self._publish_snapshot()
         
-        elif self.state == GameState.PLAYING and not self.is_server:
-            if self.maze2 and self.maze2.player:
-                dx, dy = 0, 0
-                if pygame.K_UP in self.keys_pressed:
-                    dy -= 1
-                if pygame.K_DOWN in self.keys_pressed:
-                    dy += 1
-                if pygame.K_LEFT in self.keys_pressed:
-                    dx -= 1
-                if pygame.K_RIGHT in self.keys_pressed:
-                    dx += 1
-                
-                self.maze2.player.move(dx, dy, self.maze2.walls)
+        elif self.maze2:
+            self._apply_player_input(self.maze2, self.keys_pressed, can_attack=False)
     
     def draw(self):
         self.screen.fill(COLORS['ui_bg'])
@@ -1305,12 +1639,12 @@ class Game:
         maze_height = len(LEVELS[0]) * TILE_SIZE
         
         if self.maze1:
-            self.maze1.draw(self.screen, 50)
+            self.maze1.draw(self.screen, 50, self.sim_clock.alpha)
             self._draw_info_bar(self.maze1, 50, maze_height + 20, "PLAYER 1", COLORS['yellow'])
         
         if self.maze2:
             offset_x = 50 + maze_width + MAZE_GAP
-            self.maze2.draw(self.screen, offset_x)
+            self.maze2.draw(self.screen, offset_x, self.sim_clock.alpha)
             self._draw_info_bar(self.maze2, offset_x, maze_height + 20, "PLAYER 2", COLORS['green'])
         
         # Level indicator with style
@@ -1496,5 +1830,7 @@ class Game:
 # ============================================================================
 
 if __name__ == "__main__":
+    if '--batched-enemies' in sys.argv:
+        print("Warning: --batched-enemies is only supported by Main_v1; simulating enemies one by one.")
     game = Game()
     game.run()
\ No newline at end of file
@@ -7,13 +7,16 @@ import random
 import time
 import socket
 import threading
-import pickle
+import struct
 import sys
 
+from dungeon_net import (WireCodec, WireFormatError, NodeSchema, RecordSchema, TableSchema, FieldType, EnumField,
+                         OptionalField, ArrayField, FrameReader, send_frame)
+
 # --- Networking Constants ---
 HOST = '' # Listen on all available interfaces for the server
 PORT = 5000 # Port for the game connection
-RECV_BUFFER_SIZE = 4096 * 2 # Increased buffer size for larger game state data (two mazes)
+RECV_BUFFER_SIZE = 4096 * 2 # Initial size of each connection's receive buffer; it grows for larger frames
 
 # --- Pygame Initialization ---
 pygame.init()
@@ -1849,33 +1852,86 @@ animating_coins_p2_visual = []
 previous_collectibles_p1 = []
 previous_collectibles_p2 = []
 
+# --- Wire Format ---
+# Schemas for the binary messages exchanged between server and client. Bump
+# WIRE_VERSION whenever a schema changes so mismatched builds refuse to talk.
+WIRE_VERSION = 3
+MSG_GAME_STATE = 1 # Server -> client: both mazes
+MSG_INPUT = 2 # Client -> server: player input
+
+DIRECTION_FIELD = EnumField(NO_DIRECTION, UP, DOWN, LEFT, RIGHT)
+
+PLAYER_WIRE_SCHEMA = NodeSchema(fields=[
+    ('x', 'h'), ('y', 'h'), ('health', 'h'), ('keys', 'H'), ('score', 'i'),
+    ('desired_direction', DIRECTION_FIELD), ('current_direction', DIRECTION_FIELD),
+    ('mouth_open', '?'), ('player_id', 'B')
+])
+
+ENEMY_WIRE_RECORD = RecordSchema(
+    ('x', 'h'), ('y', 'h'), ('health', 'h'), ('state', EnumField('patrol', 'chase')),
+    ('patrol_target_x', 'i'), ('patrol_target_y', 'i'), ('next_patrol_move_time', 'I')
+)
+
+COLLECTIBLE_WIRE_RECORD = RecordSchema(
+    ('x', 'h'), ('y', 'h'), ('item_type', EnumField('gold', 'health', 'key'))
+)
+
+WALL_WIRE_RECORD = RecordSchema(
+    ('x', 'h'), ('y', 'h'), ('row', OptionalField(FieldType('h'))), ('col', OptionalField(FieldType('h'))),
+    ('health', 'h'), ('is_breakable', '?')
+)
+
+MAZE_WIRE_SCHEMA = NodeSchema(
+    fields=[
+        ('score', 'i'), ('health', 'h'), ('keys', 'H'), ('current_level_index', 'B'),
+        ('level_exit_rect', OptionalField(FieldType('hhhh'))),
+        ('electricity_active', '?'), ('electricity_spawn_time', 'I'),
+        ('bonus_enemies_spawned_this_level', '?'), ('level_21_respawn_pending', '?'), ('player_id', 'B')
+    ],
+    tables={
+        'enemies': TableSchema(None, ENEMY_WIRE_RECORD),
+        'collectibles': TableSchema(None, COLLECTIBLE_WIRE_RECORD),
+        'walls': TableSchema(None, WALL_WIRE_RECORD)
+    },
+    children={'player': PLAYER_WIRE_SCHEMA}
+)
+
+ELECTRICITY_PARTICLE_FIELD = FieldType('fffBBB', pack=lambda p: (p[0], p[1], p[2], *p[3]), unpack=lambda v: (v[0], v[1], v[2], v[3:]))
+
+game_wire_codec = WireCodec(WIRE_VERSION, {
+    MSG_GAME_STATE: NodeSchema(
+        fields=[
+            ('overall_game_state', 'b'), ('winning_player_id', 'B'),
+            ('electricity_particles_global', ArrayField(ELECTRICITY_PARTICLE_FIELD))
+        ],
+        children={'maze_state_p1': MAZE_WIRE_SCHEMA, 'maze_state_p2': MAZE_WIRE_SCHEMA}
+    ),
+    MSG_INPUT: NodeSchema(fields=[('player_desired_direction', DIRECTION_FIELD)])
+})
+
 # --- Networking Functions ---
 
-def send_game_state(sock, state_data):
-    """Sends the entire game state from server to client."""
+def send_game_state(sock, msg_type, message):
+    """Encodes a message with the binary wire format and sends it as one frame."""
     try:
-        serialized_data = pickle.dumps(state_data)
-        sock.sendall(serialized_data)
-    except (socket.error, TypeError) as e:
+        serialized_data = game_wire_codec.encode(msg_type, message)
+        send_frame(sock, serialized_data)
+    except (socket.error, struct.error, KeyError, TypeError) as e:
         print(f"Error sending game state: {e}")
         global is_connected, game_running_flag
         is_connected = False
         game_running_flag = False # Stop game if connection breaks
 
-def receive_game_state(sock):
-    """Receives game state from the server."""
+def receive_game_state(frame_reader, expected_type):
+    """Receives the next frame from `frame_reader`; returns it as a dict if it is a message of `expected_type`."""
     try:
-        data = b''
-        while True:
-            packet = sock.recv(RECV_BUFFER_SIZE)
-            if not packet:
-                break
-            data += packet
-            if len(packet) < RECV_BUFFER_SIZE: # Assume packet is complete if it's smaller than buffer
-                break
-        if data:
-            return pickle.loads(data)
-    except (socket.error, EOFError, pickle.UnpicklingError) as e:
+        data = frame_reader.read_frame()
+        if data is not None:
+            msg_type, message = game_wire_codec.decode(data)
+            if msg_type != expected_type:
+                raise WireFormatError(f"expected message type {expected_type}, got {msg_type}")
+            return message
+    except (socket.error, WireFormatError) as e:
         print(f"Error receiving game state: {e}")
         global is_connected, game_running_flag
         is_connected = False
@@ -1888,11 +1944,12 @@ def server_thread_function(conn, addr):
 
     print(f"Accepted connection from {addr}")
     is_connected = True
+    frame_reader = FrameReader(conn, RECV_BUFFER_SIZE)
 
     try:
         while game_running_flag and is_connected:
             # Server receives client's player input
-            client_input = receive_game_state(conn) # Using receive_game_state for generic data
+            client_input = receive_game_state(frame_reader, MSG_INPUT)
             if client_input is None:
                 print("Client disconnected or error receiving input.")
                 break
@@ -1909,7 +1966,7 @@ def server_thread_function(conn, addr):
                 'winning_player_id': winning_player_id,
                 'electricity_particles_global': [(p.x, p.y, p.radius, p.color) for p in electricity_particles_global]
             }
-            send_game_state(conn, full_game_state)
+            send_game_state(conn, MSG_GAME_STATE, full_game_state)
             time.sleep(0.01) # Small delay to prevent busy-waiting
     finally:
         conn.close()
@@ -1965,17 +2022,18 @@ def client_thread_function(server_addr):
         client_socket.connect(server_addr)
         print(f"Connected to server at {server_addr}")
         is_connected = True
+        frame_reader = FrameReader(client_socket, RECV_BUFFER_SIZE)
 
         while game_running_flag and is_connected:
             # Client sends its player input to server
             if maze_state_p2_view and maze_state_p2_view.player:
                 player_input = {'player_desired_direction': maze_state_p2_view.player.desired_direction}
-                send_game_state(client_socket, player_input)
+                send_game_state(client_socket, MSG_INPUT, player_input)
             else:
-                send_game_state(client_socket, {'player_desired_direction': NO_DIRECTION}) # Send empty input if player not ready
+                send_game_state(client_socket, MSG_INPUT, {'player_desired_direction': NO_DIRECTION}) # Send empty input if player not ready
 
             # Client receives full game state from server
-            full_game_state = receive_game_state(client_socket)
+            full_game_state = receive_game_state(frame_reader, MSG_GAME_STATE)
             if full_game_state is None:
                 print("Server disconnected or error receiving state.")
                 break
@@ -0,0 +1,78 @@
+"""Times one maze's enemy simulation, one Enemy at a time against the NumPy batch.
+
+Fills a level with enemies on random floor tiles and, for each count, steps
+the maze's update_game_logic with the player walking about, first with the
+per-object enemies and then with the EnemyBatch (--batched-enemies). It
+reports the mean and worst step time against the 60 Hz budget of one
+simulation step. Both runs start from the same enemies; no enemy is killed,
+and the player is kept alive so the enemies keep chasing.
+
+    python bench_enemies.py [--enemies 250,1000,2000,4000] [--ticks N] [--level I]
+"""
+import argparse
+import os
+import random
+import time
+
+os.environ.setdefault('DUNGEON_HEADLESS', '1')
+
+import Main_v1 as game
+
+BUDGET_MS = 1000 / game.SIM_RATE
+
+
+def build_maze(level_index, enemy_count, batched, seed):
+    """A maze with `enemy_count` enemies spread over the level's floor tiles (several to a tile if need be)."""
+    game.BATCHED_ENEMIES = batched
+    maze = game.MazeState(1)
+    maze.current_level_index = level_index
+    maze.load_level(game.ALL_LEVEL_MAPS[level_index])
+    floor = [(r, c) for r, row in enumerate(maze.current_map_layout) for c, tile in enumerate(row) if tile == '.']
+    rng = random.Random(seed)
+    while len(maze.enemies) < enemy_count:
+        row, col = rng.choice(floor)
+        maze._spawn_enemy(*game.get_tile_center_pixel_coords(row, col))
+    return maze
+
+
+def run(maze, ticks, seed):
+    """Steps the maze `ticks` times; returns the step times in milliseconds."""
+    rng = random.Random(seed)
+    directions = (game.UP, game.DOWN, game.LEFT, game.RIGHT)
+    times = []
+    for tick in range(ticks):
+        if tick % 15 == 0:
+            maze.player.desired_direction = rng.choice(directions)
+        maze.health = 100
+        start = time.perf_counter()
+        maze.update_game_logic()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-object against batched enemy simulation.")
+    parser.add_argument('--enemies', default='250,1000,2000,4000', help="comma-separated enemy counts")
+    parser.add_argument('--ticks', type=int, default=300)
+    parser.add_argument('--level', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if game.EnemyBatch is None:
+        raise SystemExit("enemy_batch needs NumPy")
+    print(f"level {args.level + 1}, {args.ticks} steps, budget {BUDGET_MS:.1f} ms per step")
+    print(f"{'enemies':>8}  {'objects ms':>10}  {'max':>6}  {'batch ms':>8}  {'max':>6}  {'speedup':>7}")
+    for count in (int(n) for n in args.enemies.split(',')):
+        results = []
+        for batched in (False, True):
+            maze = build_maze(args.level, count, batched, args.seed)
+            times = run(maze, args.ticks, args.seed)
+            results.append((sum(times) / len(times), max(times)))
+        (object_mean, object_max), (batch_mean, batch_max) = results
+        flag = "" if batch_mean < BUDGET_MS else "  over budget"
+        print(f"{count:>8}  {object_mean:>10.2f}  {object_max:>6.1f}  {batch_mean:>8.2f}  {batch_max:>6.1f}  "
+              f"{object_mean / batch_mean:>6.1f}x{flag}")
+
+
+if __name__ == "__main__":
+    main()
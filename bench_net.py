@@ -0,0 +1,170 @@
+"""Compares the binary wire format against pickle on real Main_v1 snapshots.
+
+Runs one match headless for a number of ticks and, for every tick, measures
+the size and encode/decode time of both the full snapshot and the delta
+against the previous tick. They are compared with the baseline, the whole
+game state (every wall included) that the server used to pickle every tick,
+and with pickling the same messages. It then reports how much the frame
+compression (zlib with the preset dictionary, see FrameCompressor) saves on
+the binary messages and what it costs per tick.
+
+    python bench_net.py [ticks]
+    python bench_net.py --train-dict    # rebuilds Main_v1.SNAPSHOT_ZDICT_FILE
+"""
+import os
+import sys
+import time
+import pickle
+import random
+import zlib
+
+os.environ.setdefault('DUNGEON_HEADLESS', '1')
+
+import Main_v1 as game
+from dungeon_net import SnapshotHistory
+
+ZDICT_SIZE = 32 * 1024 # zlib only looks back 32 KiB, so a larger dictionary is never used
+
+
+def time_us(func, arg, repeat=20):
+    """Average wall time of func(arg) in microseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(arg)
+    return (time.perf_counter() - start) * 1e6 / repeat
+
+
+def baseline_state(match, snapshot):
+    """What the server pickled every tick before the binary wire format: both mazes in full,
+    entity tables as lists and every wall of the level."""
+    state = dict(snapshot)
+    for key, maze in (('maze_state_p1', match.maze_state_p1), ('maze_state_p2', match.maze_state_p2)):
+        maze_state = dict(state[key])
+        maze_state['enemies'] = list(maze_state['enemies'].values())
+        maze_state['collectibles'] = list(maze_state['collectibles'].values())
+        del maze_state['level_manifest'], maze_state['wall_changes'], maze_state['last_input_seq']
+        maze_state['walls'] = [dict(wall.get_state(), is_breakable=True) if isinstance(wall, game.BreakableWall)
+                               else wall.get_state() for wall in maze.walls]
+        state[key] = maze_state
+    return state
+
+
+def collect_messages(ticks, seed=1, level_index=0):
+    """Steps a match and returns (baseline state, full, delta) snapshot messages per tick."""
+    random.seed(seed)
+    match = game.Match(1)
+    match.load_level(level_index)
+    match.overall_game_state = game.GAME_STATE_PLAYING
+
+    history = SnapshotHistory()
+    directions = [game.UP, game.DOWN, game.LEFT, game.RIGHT]
+    messages = []
+    for tick in range(ticks):
+        if tick % 15 == 0:
+            for maze in match.mazes():
+                maze.player.desired_direction = random.choice(directions)
+        match.tick()
+
+        snapshot = match.build_snapshot()
+        seq, base_seq, delta = history.make_delta(snapshot)
+        history.acknowledge(seq)
+        full = {'seq': seq, 'base': 0, 'delta': {'set': snapshot}, 'events': []}
+        delta_message = {'seq': seq, 'base': base_seq, 'delta': delta, 'events': []}
+        messages.append((baseline_state(match, snapshot), full, delta_message))
+    return messages
+
+
+def measure(encode, decode, samples):
+    """Average (bytes, encode us, decode us) per sample."""
+    size = encode_us = decode_us = 0
+    for sample in samples:
+        encoded = encode(sample)
+        size += len(encoded)
+        encode_us += time_us(encode, sample)
+        decode_us += time_us(decode, encoded)
+    count = len(samples)
+    return size / count, encode_us / count, decode_us / count
+
+
+def print_measure(name, result):
+    size, encode_us, decode_us = result
+    print(f"  {name:<8} {size:9.0f} bytes/tick  encode {encode_us:8.1f} us  decode {decode_us:8.1f} us")
+
+
+def report(label, samples, baseline):
+    """Prints the binary encoding of `samples` next to pickle of the same messages and to the baseline."""
+    codec = game.game_wire_codec
+    binary = measure(lambda message: codec.encode(game.MSG_SNAPSHOT, message), codec.decode, samples)
+    pickled = measure(pickle.dumps, pickle.loads, samples)
+
+    print(f"{label} ({len(samples)} ticks)")
+    print_measure('binary', binary)
+    print_measure('pickle', pickled)
+    print(f"  binary vs pickle of the same messages: {binary[0] / pickled[0]:.0%} of the size,"
+          f" encode {binary[1] / pickled[1]:.1f}x, decode {binary[2] / pickled[2]:.1f}x the time")
+    print(f"  binary vs baseline: {binary[0] / baseline[0]:.1%} of the size,"
+          f" encode {baseline[1] / binary[1]:.1f}x, decode {baseline[2] / binary[2]:.1f}x faster")
+
+
+def report_compression(label, samples, compressor):
+    codec = game.game_wire_codec
+    payloads = [codec.encode(game.MSG_SNAPSHOT, message) for message in samples]
+    raw = sum(len(payload) for payload in payloads)
+    plain = sum(len(zlib.compress(payload)) for payload in payloads)
+    compressed = [compressor.compress(payload) for payload in payloads]
+    packed = sum(len(data) for data in compressed)
+    compress_us = sum(time_us(compressor.compress, payload) for payload in payloads)
+    decompress_us = sum(time_us(compressor.decompress, data) for data in compressed)
+
+    count = len(samples)
+    print(f"{label} ({count} ticks)")
+    print(f"  binary       {raw / count:9.0f} bytes/tick")
+    print(f"  zlib         {plain / count:9.0f} bytes/tick  (no dictionary)")
+    print(f"  zlib + dict  {packed / count:9.0f} bytes/tick"
+          f"  compress {compress_us / count:6.1f} us  decompress {decompress_us / count:6.1f} us")
+    print(f"  compression ratio {raw / packed:.2f}:1")
+
+
+def train_dictionary():
+    """Builds a preset dictionary from full and delta snapshots of every level.
+
+    zlib favours matches near the end of the dictionary, so the samples that
+    occur most (deltas) go last.
+    """
+    codec = game.game_wire_codec
+    fulls, deltas = [], []
+    for level_index in range(len(game.ALL_LEVEL_MAPS)):
+        messages = collect_messages(30, seed=level_index, level_index=level_index)
+        fulls.append(codec.encode(game.MSG_SNAPSHOT, messages[-1][1]))
+        deltas.extend(codec.encode(game.MSG_SNAPSHOT, delta) for _, _, delta in messages[1::3])
+    return (b''.join(fulls) + b''.join(deltas))[-ZDICT_SIZE:]
+
+
+def main():
+    if '--train-dict' in sys.argv:
+        zdict = train_dictionary()
+        with open(game.SNAPSHOT_ZDICT_FILE, 'wb') as zdict_file:
+            zdict_file.write(zdict)
+        print(f"Wrote {len(zdict)} byte dictionary to {game.SNAPSHOT_ZDICT_FILE}")
+        return
+
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    messages = collect_messages(ticks)
+    fulls = [full for _, full, _ in messages]
+    deltas = [delta for _, _, delta in messages[1:]]
+    baseline = measure(pickle.dumps, pickle.loads, [state for state, _, _ in messages])
+    print(f"Baseline: whole game state with every wall, pickled every tick ({len(messages)} ticks)")
+    print_measure('pickle', baseline)
+    report("Full snapshots", fulls, baseline)
+    report("Delta snapshots", deltas, baseline)
+
+    compressor = game.frame_compressor
+    if compressor is None:
+        print(f"No frame compression: run with --train-dict to create {game.SNAPSHOT_ZDICT_FILE}")
+        return
+    report_compression("Compressed full snapshots", fulls, compressor)
+    report_compression("Compressed delta snapshots", deltas, compressor)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Headless bot clients for loading the match server (python Main_v1.py --match-server).
+
+A bot speaks the same protocol as the pygame client: it joins a match, sends
+the numbered input of every simulation step, acknowledges snapshots and
+events, and pings the server. Its direction is either a random walk or a
+script of directions, one per simulation step, played in a loop. Each bot
+records the round trip time, bytes, decode time and snapshot gaps in a
+ConnectionMetrics, plus the rate at which snapshots arrived.
+
+    python bot_client.py [--bots N] [--seconds S] [--host H] [--port P] [--script up,up,right,...]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+os.environ.setdefault('DUNGEON_HEADLESS', '1')
+
+import Main_v1 as game
+from dungeon_net import (ConnectionMetrics, SnapshotReceiver, EventReceiver, PendingInputs, WireFormatError,
+                         MAX_FRAME_SIZE, encode_frame, read_frame_async)
+
+WALK_DIRECTIONS = (game.UP, game.DOWN, game.LEFT, game.RIGHT)
+SCRIPT_DIRECTIONS = {'up': game.UP, 'down': game.DOWN, 'left': game.LEFT, 'right': game.RIGHT, 'none': game.NO_DIRECTION}
+
+
+class BotClient:
+    """One synthetic player. `script` is a list of directions (one per simulation step); None walks at random."""
+
+    def __init__(self, name, script=None, seed=None, turn_every=15):
+        self.name = name
+        self.script = script
+        self.random = random.Random(seed)
+        self.turn_every = turn_every # Random walk: simulation steps between two changes of direction
+        self.direction = game.NO_DIRECTION
+        self.metrics = ConnectionMetrics(name)
+        self.snapshot_receiver = SnapshotReceiver()
+        self.event_receiver = EventReceiver()
+        self.pending_inputs = PendingInputs()
+        self.compressor = None
+        self.writer = None
+        self.player_id = None
+        self.match_id = None
+        self.snapshots = 0
+        self.first_snapshot = None
+        self.last_snapshot = None
+
+    async def run(self, host, port, seconds):
+        """Plays for `seconds`, or until the server closes the connection."""
+        reader, self.writer = await asyncio.open_connection(host, port)
+        try:
+            self._send(game.MSG_JOIN, {'spectate': False, 'match_id': 0, 'compression': game.offered_compression(),
+                                       'session_token': 0})
+            data = await read_frame_async(reader)
+            if data is None:
+                raise ConnectionError("server closed the connection before the welcome")
+            msg_type, welcome = game.game_wire_codec.decode(data)
+            if msg_type != game.MSG_WELCOME:
+                raise WireFormatError(f"expected message type {game.MSG_WELCOME}, got {msg_type}")
+            self.player_id = welcome['player_id']
+            self.match_id = welcome['match_id']
+            if welcome['compression']:
+                self.compressor = game.frame_compressor
+
+            input_task = asyncio.create_task(self._send_inputs())
+            try:
+                await asyncio.wait_for(self._receive(reader), seconds)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                input_task.cancel()
+        finally:
+            self.writer.close()
+
+    def snapshot_rate(self):
+        """Snapshots received per second between the first and the last one."""
+        if self.snapshots < 2:
+            return 0.0
+        return (self.snapshots - 1) / (self.last_snapshot - self.first_snapshot)
+
+    def summary(self):
+        values = self.metrics.snapshot()
+        return {'name': self.name, 'player_id': self.player_id, 'match_id': self.match_id,
+                'snapshots': self.snapshots, 'snapshot_rate': self.snapshot_rate(), **values}
+
+    async def _receive(self, reader):
+        while True:
+            start = time.perf_counter()
+            data = await read_frame_async(reader)
+            if data is None:
+                return
+            self.metrics.record_received(len(data) + 4, time.perf_counter() - start) # + the frame's length prefix
+            if self.compressor:
+                data = self.compressor.decompress(data, MAX_FRAME_SIZE)
+
+            start = time.perf_counter()
+            msg_type, message = game.game_wire_codec.decode(data)
+            self.metrics.record_time('decode', time.perf_counter() - start)
+            if msg_type == game.MSG_SNAPSHOT:
+                self.metrics.record_snapshot_size(len(data))
+                self._on_snapshot(message)
+            elif msg_type == game.MSG_PING:
+                self._send(game.MSG_PONG, message)
+            elif msg_type == game.MSG_PONG:
+                self.metrics.record_pong(message['stamp'])
+
+    def _on_snapshot(self, message):
+        received = self.snapshot_receiver.receive(message['seq'], message['base'], message['delta'])
+        if received is None:
+            self.metrics.count('dropped_snapshots')
+            return
+        now = time.monotonic()
+        if self.last_snapshot is not None:
+            self.metrics.record_time('snapshot_gap', now - self.last_snapshot)
+        else:
+            self.first_snapshot = now
+        self.last_snapshot = now
+        self.snapshots += 1
+
+        own_maze_state = received[0].get(f'maze_state_p{self.player_id}')
+        if own_maze_state:
+            self.pending_inputs.acknowledge(own_maze_state['last_input_seq'])
+        self.metrics.count('events', len(self.event_receiver.accept(message['events'])))
+        self.metrics.set_gauge('unacked_inputs', len(self.pending_inputs))
+
+    async def _send_inputs(self):
+        send_every = max(1, round(game.SIM_RATE / game.NET_SEND_RATE))
+        step = 0
+        next_time = time.monotonic()
+        while True:
+            self.pending_inputs.add(self._next_direction(step))
+            if step % send_every == 0:
+                self._send(game.MSG_INPUT, {'inputs': self.pending_inputs.unacked(), 'ack': self.snapshot_receiver.latest_seq,
+                                            'event_ack': self.event_receiver.last_seq})
+                stamp = self.metrics.ping_stamp()
+                if stamp is not None:
+                    self._send(game.MSG_PING, {'stamp': stamp})
+            step += 1
+            next_time += 1 / game.SIM_RATE
+            await asyncio.sleep(max(0.0, next_time - time.monotonic()))
+
+    def _next_direction(self, step):
+        if self.script:
+            return self.script[step % len(self.script)]
+        if step % self.turn_every == 0:
+            self.direction = self.random.choice(WALK_DIRECTIONS)
+        return self.direction
+
+    def _send(self, msg_type, message):
+        start = time.perf_counter()
+        frame = encode_frame(game.game_wire_codec.encode(msg_type, message), self.compressor)
+        self.metrics.record_time('encode', time.perf_counter() - start)
+        self.writer.write(frame)
+        self.metrics.record_sent(len(frame))
+
+
+async def run_bots(count, host, port, seconds, script=None, seed=0, stagger=0.01):
+    """Starts `count` bots `stagger` seconds apart and returns them once they all finished."""
+    bots = [BotClient(f"bot {i + 1}", script, seed + i) for i in range(count)]
+
+    async def run(bot, delay):
+        await asyncio.sleep(delay)
+        try:
+            await bot.run(host, port, seconds)
+        except (OSError, WireFormatError) as e:
+            print(f"{bot.name}: {e}")
+
+    await asyncio.gather(*(run(bot, i * stagger) for i, bot in enumerate(bots)))
+    return bots
+
+
+def parse_script(text):
+    return [SCRIPT_DIRECTIONS[name.strip().lower()] for name in text.split(',')] if text else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless bots for the match server.")
+    parser.add_argument('--bots', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=game.PORT)
+    parser.add_argument('--script', help="comma-separated directions (up, down, left, right, none), one per simulation step")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    bots = asyncio.run(run_bots(args.bots, args.host, args.port, args.seconds, parse_script(args.script), args.seed))
+    for bot in bots:
+        values = bot.summary()
+        rtt = f"{values['rtt_ms']:.1f} ms" if values['rtt_ms'] is not None else "-"
+        print(f"{bot.name}: match {values['match_id']} player {values['player_id']}  "
+              f"{values['snapshot_rate']:.1f} snapshots/s  rtt {rtt}  "
+              f"max gap {values['timings'].get('snapshot_gap', {}).get('max_ms', 0):.0f} ms  "
+              f"in {values['bytes_received'] / 1024:.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
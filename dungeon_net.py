@@ -0,0 +1,2034 @@
+"""Networking helpers shared by the Dungeon Explorer variants.
+
+Nothing in this module imports pygame, so the same code runs inside the game
+client, the server and any headless tooling.
+"""
+
+import asyncio
+import collections
+import json
+import operator
+import queue
+import socket
+import struct
+import threading
+import time
+import types
+import zlib
+
+# --- Snapshot Deltas ---
+# A snapshot is a plain dict (entity tables are dicts keyed by a stable key).
+# A delta describes how to turn one snapshot into another:
+#     {'set': {key: value}, 'del': [key, ...], 'sub': {key: nested_delta}}
+# Empty sections are left out, so diffing two equal snapshots gives {}.
+
+_MISSING = object()
+
+
+def diff_state(base, current):
+    """Returns the delta that turns the dict `base` into the dict `current`."""
+    changed = {}
+    nested = {}
+    added = 0
+    for key, value in current.items():
+        old = base.get(key, _MISSING)
+        if old is value:
+            continue
+        if old is _MISSING:
+            changed[key] = value
+            added += 1
+        elif old == value:
+            continue
+        elif isinstance(value, dict) and isinstance(old, dict):
+            nested[key] = diff_state(old, value)
+        else:
+            changed[key] = value
+
+    delta = {}
+    if changed:
+        delta['set'] = changed
+    if nested:
+        delta['sub'] = nested
+    if len(base) > len(current) - added:
+        removed = [key for key in base if key not in current]
+        if removed:
+            delta['del'] = removed
+    return delta
+
+
+def apply_state_delta(base, delta):
+    """Returns a new dict equal to `base` with `delta` applied.
+
+    `base` is never modified; untouched values are shared with the result, so
+    applying a small delta to a large snapshot stays cheap.
+    """
+    if not delta:
+        return base
+    result = dict(base)
+    for key in delta.get('del', ()):
+        result.pop(key, None)
+    result.update(delta.get('set', ()))
+    for key, sub_delta in delta.get('sub', {}).items():
+        result[key] = apply_state_delta(result.get(key) or {}, sub_delta)
+    return result
+
+
+class SnapshotHistory:
+    """Server-side record of the snapshots sent to one peer.
+
+    Every outgoing snapshot is delta-encoded against the newest snapshot the
+    peer has acknowledged; until the first ack arrives the full snapshot is sent.
+    Acks may come from a different thread than the one making deltas.
+    """
+
+    def __init__(self, max_pending=64):
+        self.lock = threading.Lock()
+        self.max_pending = max_pending
+        self.next_seq = 1
+        self.pending = {}
+        self.acked_seq = 0
+        self.acked_snapshot = None
+
+    def acknowledge(self, seq):
+        """Marks `seq` as received by the peer and forgets everything older."""
+        with self.lock:
+            if seq <= self.acked_seq or seq not in self.pending:
+                return
+            self.acked_seq = seq
+            self.acked_snapshot = self.pending[seq]
+            for old_seq in [s for s in self.pending if s <= seq]:
+                del self.pending[old_seq]
+
+    def reset(self):
+        """Forgets all acknowledgements so the next snapshot is sent in full."""
+        with self.lock:
+            self.pending.clear()
+            self.acked_seq = 0
+            self.acked_snapshot = None
+
+    def make_delta(self, snapshot):
+        """Registers `snapshot` and returns (seq, base_seq, delta) for sending it."""
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.pending[seq] = snapshot
+            if len(self.pending) > self.max_pending:
+                del self.pending[min(self.pending)]
+            base_seq, base = self.acked_seq, self.acked_snapshot
+
+        if base is None:
+            return seq, 0, diff_state({}, snapshot)
+        return seq, base_seq, diff_state(base, snapshot)
+
+
+class SnapshotReceiver:
+    """Client-side counterpart of SnapshotHistory that rebuilds full snapshots."""
+
+    def __init__(self):
+        self.snapshots = {}
+        self.latest_seq = 0
+        self.latest = None
+
+    def receive(self, seq, base_seq, delta):
+        """Applies one received delta.
+
+        Returns (snapshot, local_delta) where `local_delta` turns the previously
+        received snapshot into the new one, or None if the message is stale or
+        its base snapshot is unknown.
+        """
+        if seq <= self.latest_seq:
+            return None
+        if base_seq == 0:
+            base = {}
+        else:
+            base = self.snapshots.get(base_seq)
+            if base is None:
+                return None
+
+        snapshot = apply_state_delta(base, delta)
+        if self.latest is None:
+            local_delta = diff_state({}, snapshot)
+        elif base_seq == self.latest_seq:
+            local_delta = delta
+        else:
+            local_delta = diff_state(self.latest, snapshot)
+
+        # The server never encodes against anything older than its current base.
+        for old_seq in [s for s in self.snapshots if s < base_seq]:
+            del self.snapshots[old_seq]
+        self.snapshots[seq] = snapshot
+        self.latest_seq = seq
+        self.latest = snapshot
+        return snapshot, local_delta
+
+
+# --- Binary Wire Format ---
+# Messages are encoded against declared schemas instead of being pickled, so
+# they are compact, fast to parse and never execute anything on decode.
+#
+#     message := magic 'DX' | u8 version | u8 message type | node
+#     node    := record of scalar fields | u8 count | (u8 index << 2 | op, table or child)*
+#                | delta children
+#     record  := field mask | fixed-size fields present | variable-size fields present
+#     rows    := u16 group count | (field mask | u16 row count | (key | fields present)*)*
+#
+# A node is always encoded as a delta (see diff_state); a full snapshot is just
+# a delta from an empty dict, so both share one encoder and one decoder. The
+# fixed-size fields of a record (or of a table row, with its key) are packed by
+# a single struct.Struct, compiled once per field mask together with Python
+# functions that pack and unpack whole records or tables for that mask. Those
+# are generated from the schemas only, never from received bytes.
+
+WIRE_MAGIC = b'DX'
+_MESSAGE_HEADER = struct.Struct('<2sBB')
+_COUNT = struct.Struct('<H')
+_U8 = struct.Struct('<B')
+_NO_ROWS = _COUNT.pack(0)
+_NO_VALUES = types.MappingProxyType({}) # Read-only default for the parts a delta leaves out
+
+_OP_PATCH = 1
+_OP_REPLACE = 2
+_OP_NULL = 3
+
+_MAX_LAYOUTS = 256 # Compiled record layouts kept per record (or table)
+_MAX_MEMBERS = 63 # Tables and children per node: an index has 6 bits, next to the op's 2
+
+
+class WireFormatError(ValueError):
+    """Raised when received bytes do not match the expected wire format."""
+
+
+class FieldType:
+    """A struct format plus optional converters between Python values and packed tuples."""
+
+    fixed = True # Always packs to struct.size bytes, so a record can pack it together with its other fields
+
+    def __init__(self, fmt, pack=None, unpack=None):
+        self.format = fmt
+        self.struct = struct.Struct('<' + fmt)
+        self.count = len(self.struct.unpack(bytes(self.struct.size))) # Packed values per field value
+        self.single = self.count == 1
+        self.pack = pack
+        self.unpack = unpack
+
+    def write(self, value, out):
+        if self.pack:
+            value = self.pack(value)
+        out += self.struct.pack(value) if self.single else self.struct.pack(*value)
+
+    def read(self, data, offset):
+        values = self.struct.unpack_from(data, offset)
+        value = values[0] if self.single else values
+        if self.unpack:
+            value = self.unpack(value)
+        return value, offset + self.struct.size
+
+
+class EnumField(FieldType):
+    """Encodes one of a fixed set of values (strings, direction tuples...) as a byte."""
+
+    def __init__(self, *values):
+        index = {value: i for i, value in enumerate(values)}
+        super().__init__('B', pack=index.__getitem__, unpack=values.__getitem__)
+
+
+class OptionalField(FieldType):
+    """Wraps a field type so that None can be sent as well."""
+
+    fixed = False
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def write(self, value, out):
+        if value is None:
+            out += _U8.pack(0)
+        else:
+            out += _U8.pack(1)
+            self.inner.write(value, out)
+
+    def read(self, data, offset):
+        if data[offset] == 0:
+            return None, offset + 1
+        return self.inner.read(data, offset + 1)
+
+
+class ArrayField(FieldType):
+    """A variable-length list (up to 65535 items) of one field type, decoded as a list."""
+
+    fixed = False
+
+    def __init__(self, item):
+        self.item = item
+
+    def write(self, value, out):
+        out += _COUNT.pack(len(value))
+        item = self.item
+        if not item.fixed:
+            for value_item in value:
+                item.write(value_item, out)
+            return
+        pack, convert = item.struct.pack, item.pack
+        for value_item in value:
+            if convert:
+                value_item = convert(value_item)
+            out += pack(value_item) if item.single else pack(*value_item)
+
+    def read(self, data, offset):
+        (count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        item = self.item
+        if not count:
+            return [], offset
+        if not item.fixed:
+            items = []
+            for _ in range(count):
+                value_item, offset = item.read(data, offset)
+                items.append(value_item)
+            return items, offset
+        end = offset + count * item.struct.size
+        if end > len(data):
+            raise WireFormatError(f"array of {count} items runs past the end of the message")
+        items = list(item.struct.iter_unpack(data[offset:end]))
+        if item.single:
+            items = [values[0] for values in items]
+        if item.unpack:
+            items = [item.unpack(value_item) for value_item in items]
+        return items, end
+
+
+def _field_type(spec):
+    return spec if isinstance(spec, FieldType) else FieldType(spec)
+
+
+class _RecordLayout:
+    """How a record is packed for one field mask: one struct for the fixed-size fields, preceded by
+    `prefix` (the mask, or a table row's key and mask), then the variable-size fields one by one."""
+
+    def __init__(self, fields, prefix, prefix_count, mask):
+        fixed = [(name, field_type) for name, field_type in fields if field_type.fixed]
+        self.variable = [(name, field_type) for name, field_type in fields if not field_type.fixed]
+        self.struct = struct.Struct('<' + prefix + ''.join(field_type.format for _, field_type in fixed))
+        self.mask = mask
+        self.names = [name for name, _ in fixed]
+        self.get = operator.itemgetter(*self.names) if len(self.names) > 1 else lambda values: (values[self.names[0]],)
+        self.prefix_count = prefix_count
+        # With one packed value per field (the usual case), values map to packed values one to one and
+        # only the fields with converters need more than a single struct call
+        self.flat = all(field_type.single for _, field_type in fixed)
+        self.packs = [(i, field_type.pack) for i, (_, field_type) in enumerate(fixed) if field_type.pack]
+        self.unpacks = [(name, field_type.unpack) for name, field_type in fixed if field_type.unpack]
+        self.slots = [] # (name, index of its first packed value, packed value count, pack, unpack)
+        index = prefix_count
+        for name, field_type in fixed:
+            self.slots.append((name, index, field_type.count, field_type.pack, field_type.unpack))
+            index += field_type.count
+        # Compiled for the layouts _LayoutCache keeps; the methods below serve the others
+        self.write_fields = self.read_fields = None
+        self.pack_rows = self.unpack_rows = None
+
+    def _sources(self, bound):
+        """Source code for the struct arguments that pack a dict `v`, for the names that unpack them
+        and for the dict entries made from those names; binds the converters they call in `bound`."""
+        packed, columns, entries = [], [], []
+        for i, (name, _index, count, pack, unpack) in enumerate(self.slots):
+            bound[f'pack{i}'] = pack
+            bound[f'unpack{i}'] = unpack
+            value = f'pack{i}(v[{name!r}])' if pack else f'v[{name!r}]'
+            packed.append(value if count == 1 else '*' + value)
+            names = [f'f{i}_{j}' for j in range(count)]
+            columns.extend(names)
+            value = names[0] if count == 1 else f"({', '.join(names)})"
+            entries.append(f'{name!r}: unpack{i}({value})' if unpack else f'{name!r}: {value}')
+        return packed, columns, entries
+
+    def compile_fields(self):
+        """Compiles write_fields(values, out) and read_fields(data, offset) for a layout whose prefix is
+        the mask: straight-line code with the field names, converters and struct bound in."""
+        bound = {'pack': self.struct.pack, 'unpack_from': self.struct.unpack_from}
+        packed, columns, entries = self._sources(bound)
+        write = [f"    out += pack({', '.join([str(self.mask)] + packed)})"]
+        read = [f"    _, {''.join(column + ', ' for column in columns)}= unpack_from(data, offset)",
+                f"    values = {{{', '.join(entries)}}}",
+                f"    offset += {self.struct.size}"]
+        for i, (name, field_type) in enumerate(self.variable):
+            bound[f'variable{i}'] = field_type
+            write.append(f"    variable{i}.write(v[{name!r}], out)")
+            read.append(f"    values[{name!r}], offset = variable{i}.read(data, offset)")
+        exec("def write_fields(v, out):\n" + '\n'.join(write) + "\n"
+             "def read_fields(data, offset):\n" + '\n'.join(read) + "\n    return values, offset\n", bound)
+        self.write_fields = bound['write_fields']
+        self.read_fields = bound['read_fields']
+
+    def compile_rows(self):
+        """Compiles pack_rows(rows) -> bytes and unpack_rows(data) -> rows for a layout without
+        variable-size fields whose prefix is a table row's key. Each is one comprehension over the
+        rows with the field names, converters and struct bound in: a struct call per row, no lookups.
+        A single row, the usual case in a delta, skips the comprehension."""
+        bound = {'pack': self.struct.pack, 'unpack': self.struct.unpack, 'iter_unpack': self.struct.iter_unpack}
+        packed, columns, entries = self._sources(bound)
+        keys = [f'k{i}' for i in range(self.prefix_count)]
+        key = keys[0] if len(keys) == 1 else f"({', '.join(keys)})"
+        row = f"pack({', '.join(keys + packed)})"
+        names = ''.join(name + ', ' for name in keys + columns)
+        value = f"{{{key}: {{{', '.join(entries)}}}"
+        exec(f"def pack_rows(rows):\n"
+             f"    if len(rows) == 1:\n"
+             f"        for {key}, v in rows.items():\n"
+             f"            return {row}\n"
+             f"    return b''.join([{row} for {key}, v in rows.items()])\n"
+             f"def unpack_rows(data):\n"
+             f"    if len(data) == {self.struct.size}:\n"
+             f"        {names}= unpack(data)\n"
+             f"        return {value}}}\n"
+             f"    return {value} for {names}in iter_unpack(data)}}\n",
+             bound)
+        self.pack_rows = bound['pack_rows']
+        self.unpack_rows = bound['unpack_rows']
+
+    def write(self, prefix, values, out):
+        if not self.names:
+            out += self.struct.pack(*prefix)
+        elif self.flat:
+            packed = self.get(values)
+            if self.packs:
+                packed = list(packed)
+                for i, pack in self.packs:
+                    packed[i] = pack(packed[i])
+            out += self.struct.pack(*prefix, *packed)
+        else:
+            packed = list(prefix)
+            for name, _index, count, pack, _unpack in self.slots:
+                value = values[name]
+                if pack:
+                    value = pack(value)
+                if count == 1:
+                    packed.append(value)
+                else:
+                    packed.extend(value)
+            out += self.struct.pack(*packed)
+        for name, field_type in self.variable:
+            field_type.write(values[name], out)
+
+    def read(self, data, offset):
+        """Reads a record whose prefix starts at `offset`; returns (values, new_offset)."""
+        packed = self.struct.unpack_from(data, offset)
+        offset += self.struct.size
+        if self.flat:
+            values = dict(zip(self.names, packed[self.prefix_count:]))
+            for name, unpack in self.unpacks:
+                values[name] = unpack(values[name])
+        else:
+            values = {}
+            for name, index, count, _pack, unpack in self.slots:
+                value = packed[index] if count == 1 else packed[index:index + count]
+                values[name] = unpack(value) if unpack else value
+        for name, field_type in self.variable:
+            values[name], offset = field_type.read(data, offset)
+        return values, offset
+
+
+class _LayoutCache:
+    """The _RecordLayouts of one record behind one prefix, compiled on first use: by mask for
+    reading, and by the key set of the dict being written, which repeats from record to record.
+    `compile` says what the cached layouts get: 'fields' when the prefix is the mask (a record),
+    'rows' when it is a table row's key, None for nothing."""
+
+    def __init__(self, record, prefix, prefix_count, compile=None):
+        self.record = record
+        self.prefix = prefix
+        self.prefix_count = prefix_count
+        self.compile = compile
+        self.by_mask = {}
+        self.by_names = {}
+
+    def for_mask(self, mask):
+        mask &= self.record.all_bits
+        layout = self.by_mask.get(mask)
+        if layout is None:
+            fields = [field for i, field in enumerate(self.record.fields) if mask >> i & 1]
+            layout = _RecordLayout(fields, self.prefix, self.prefix_count, mask)
+            if len(self.by_mask) < _MAX_LAYOUTS: # A peer sending every possible mask can't grow the cache without bound
+                self.by_mask[mask] = layout
+                # Only cached layouts are compiled, so a peer can't make us compile without bound either
+                if self.compile == 'fields':
+                    layout.compile_fields()
+                elif self.compile == 'rows' and not layout.variable:
+                    layout.compile_rows()
+        return layout
+
+    def for_names(self, names):
+        """`names` is the tuple of keys of a dict being written."""
+        layout = self.by_names.get(names)
+        if layout is None:
+            mask = 0
+            for name in names:
+                mask |= self.record.bits.get(name, 0) # Keys that are not fields of the record are skipped
+            layout = self.for_mask(mask)
+            if len(self.by_names) < _MAX_LAYOUTS:
+                self.by_names[names] = layout
+        return layout
+
+
+class RecordSchema:
+    """An ordered set of named fields; any subset can be sent, selected by a bit mask."""
+
+    def __init__(self, *fields):
+        self.names = [name for name, _ in fields]
+        self.types = [_field_type(spec) for _, spec in fields]
+        self.fields = list(zip(self.names, self.types))
+        self.bits = {name: 1 << i for i, name in enumerate(self.names)}
+        self.all_bits = (1 << len(fields)) - 1
+        if len(fields) <= 8:
+            self.mask_format = 'B'
+        elif len(fields) <= 16:
+            self.mask_format = 'H'
+        else:
+            self.mask_format = 'I'
+        self.mask_struct = struct.Struct('<' + self.mask_format)
+        self.empty = self.mask_struct.pack(0)
+        self.layouts = _LayoutCache(self, self.mask_format, 1, compile='fields')
+
+    def write(self, values, out):
+        """Writes the fields of `values` (a dict) that belong to this record."""
+        if not values:
+            out += self.empty
+            return
+        names = tuple(values)
+        layout = self.layouts.by_names.get(names) or self.layouts.for_names(names)
+        if layout.write_fields:
+            layout.write_fields(values, out)
+        else:
+            layout.write((layout.mask,), values, out)
+
+    def read(self, data, offset):
+        (mask,) = self.mask_struct.unpack_from(data, offset)
+        if not mask:
+            return {}, offset + self.mask_struct.size
+        layout = self.layouts.by_mask.get(mask) or self.layouts.for_mask(mask)
+        if layout.read_fields:
+            return layout.read_fields(data, offset)
+        return layout.read(data, offset)
+
+
+class TableSchema:
+    """A dict of records keyed by `key` (or a plain list of records when key is None).
+
+    Rows are sent in groups that share a field mask. When the key has a plain
+    struct format (no converters) and the group's fields are all fixed-size,
+    which is the usual case, the whole group is packed and unpacked by the
+    functions compiled for its layout (see _RecordLayout.compile_rows).
+    """
+
+    def __init__(self, key, record):
+        self.key = _field_type(key) if key is not None else _field_type('H')
+        self.is_list = key is None
+        self.record = record
+        key_type = self.key
+        self.fast_rows = key_type.fixed and not key_type.pack and not key_type.unpack
+        self.group_head = struct.Struct('<' + record.mask_format + 'H')
+        self.one_group = struct.Struct('<H' + record.mask_format + 'H') # Group count 1 and its head
+        if self.fast_rows:
+            self.layouts = _LayoutCache(record, key_type.format, key_type.count, compile='rows')
+        else:
+            self.layouts = _LayoutCache(record, '', 0)
+
+    def write_rows(self, records, out):
+        """Writes the rows of `records` (a dict of key -> record values)."""
+        if not records:
+            out += _NO_ROWS
+            return
+        rows = records.values()
+        names = tuple(next(iter(rows)))
+        layouts = self.layouts
+        layout = layouts.by_names.get(names) or layouts.for_names(names)
+        # Usually (always in full snapshots) every row has the first one's fields, and one call packs
+        # them all: a row lacking one of them raises KeyError, a row with more fails the count
+        if layout.pack_rows and len(layout.names) == len(names) and sum(map(len, rows)) == len(names) * len(records):
+            try:
+                packed = layout.pack_rows(records)
+            except KeyError:
+                packed = None
+            if packed is not None:
+                out += self.one_group.pack(1, layout.mask, len(records))
+                out += packed
+                return
+        groups = {}
+        for key, values in records.items():
+            groups.setdefault(tuple(values), {})[key] = values
+        out += _COUNT.pack(len(groups))
+        for names, group in groups.items():
+            layout = layouts.by_names.get(names) or layouts.for_names(names)
+            out += self.group_head.pack(layout.mask, len(group))
+            if layout.pack_rows:
+                out += layout.pack_rows(group)
+            elif self.fast_rows:
+                single = self.key.single
+                for key, values in group.items():
+                    layout.write((key,) if single else key, values, out)
+            else:
+                for key, values in group.items():
+                    self.key.write(key, out)
+                    layout.write((), values, out)
+
+    def write_patch(self, delta, out):
+        """Writes a table delta (see diff_state): the rows added, the fields changed in rows, the keys removed."""
+        added = delta.get('set')
+        patched = delta.get('sub')
+        removed = delta.get('del')
+        if added:
+            self.write_rows(added, out)
+        else:
+            out += _NO_ROWS
+        if patched:
+            self.write_rows({key: row_delta.get('set', _NO_VALUES) for key, row_delta in patched.items()}, out)
+        else:
+            out += _NO_ROWS
+        if removed:
+            out += _COUNT.pack(len(removed))
+            for key in removed:
+                self.key.write(key, out)
+        else:
+            out += _NO_ROWS
+
+    def read_patch(self, data, offset):
+        """Reads what write_patch wrote; returns (delta, new_offset)."""
+        delta = {}
+        if data[offset:offset + 2] == _NO_ROWS:
+            offset += 2
+        else:
+            delta['set'], offset = self.read_rows(data, offset)
+        if data[offset:offset + 2] == _NO_ROWS:
+            offset += 2
+        else:
+            patched, offset = self.read_rows(data, offset)
+            delta['sub'] = {key: {'set': values} for key, values in patched.items()}
+        (count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        if count:
+            removed = []
+            for _ in range(count):
+                key, offset = self.key.read(data, offset)
+                removed.append(key)
+            delta['del'] = removed
+        return delta, offset
+
+    def read_rows(self, data, offset):
+        """Reads what write_rows wrote; returns (records, new_offset)."""
+        (group_count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        records = {}
+        layouts = self.layouts
+        for _ in range(group_count):
+            mask, count = self.group_head.unpack_from(data, offset)
+            offset += self.group_head.size
+            layout = layouts.by_mask.get(mask) or layouts.for_mask(mask)
+            if layout.unpack_rows:
+                end = offset + count * layout.struct.size
+                if end > len(data):
+                    raise WireFormatError(f"table of {count} rows runs past the end of the message")
+                records.update(layout.unpack_rows(data[offset:end]))
+                offset = end
+            elif self.fast_rows:
+                key_struct = self.key.struct
+                single = self.key.single
+                for _ in range(count):
+                    key = key_struct.unpack_from(data, offset)
+                    records[key[0] if single else key], offset = layout.read(data, offset)
+            else:
+                for _ in range(count):
+                    key, offset = self.key.read(data, offset)
+                    records[key], offset = layout.read(data, offset)
+        return records, offset
+
+
+class NodeSchema:
+    """A dict made of scalar fields, entity tables and nested nodes.
+
+    Only the tables and children a delta touches are written, each after a
+    byte holding its index and op, so an unchanged one costs nothing.
+    Children listed in `delta_children` carry an already-computed delta (for
+    example the snapshot delta inside a snapshot message) rather than a value.
+    """
+
+    def __init__(self, fields=(), tables=None, children=None, delta_children=None):
+        self.record = RecordSchema(*fields)
+        self.tables = list((tables or {}).items())
+        self.children = list((children or {}).items())
+        self.delta_children = list((delta_children or {}).items())
+        self.members = ([(name, table, True) for name, table in self.tables]
+                        + [(name, child, False) for name, child in self.children])
+        if len(self.members) > _MAX_MEMBERS:
+            raise ValueError(f"a node can have at most {_MAX_MEMBERS} tables and children")
+        self.entries = {name: index << 2 for index, (name, _, _) in enumerate(self.members)} # OR'ed with the op
+        # The encoding of an empty delta, the most common one
+        self.unchanged = (self.record.empty + (bytes(1) if self.members else b'')
+                          + b''.join(child.unchanged for _, child in self.delta_children))
+
+    def write(self, delta, out):
+        """Writes a delta for this node."""
+        if not delta:
+            out += self.unchanged
+            return
+        changed = delta.get('set', _NO_VALUES)
+        nested = delta.get('sub', _NO_VALUES)
+        if changed:
+            self.record.write(changed, out)
+        else:
+            out += self.record.empty
+
+        if self.members:
+            count_at = len(out)
+            out.append(0)
+            count = 0
+            if changed:
+                entries = self.entries
+                for name, member, is_table in self.members:
+                    if name not in changed:
+                        continue
+                    value = changed[name]
+                    count += 1
+                    if is_table:
+                        out.append(entries[name] | _OP_REPLACE)
+                        member.write_rows(dict(enumerate(value)) if member.is_list else value, out)
+                    elif value is None:
+                        out.append(entries[name] | _OP_NULL)
+                    else:
+                        out.append(entries[name] | _OP_REPLACE)
+                        member.write({'set': value}, out)
+            for name, member_delta in nested.items():
+                entry = self.entries.get(name)
+                if entry is None or name in changed: # Replacing wins over patching
+                    continue
+                count += 1
+                out.append(entry | _OP_PATCH)
+                _, member, is_table = self.members[entry >> 2]
+                if is_table:
+                    member.write_patch(member_delta, out)
+                else:
+                    member.write(member_delta, out)
+            out[count_at] = count
+
+        for name, child in self.delta_children:
+            child.write(changed.get(name) or _NO_VALUES, out)
+
+    def read(self, data, offset):
+        """Reads a delta for this node; returns (delta, new_offset)."""
+        empty = self.record.empty
+        if data[offset:offset + len(empty)] == empty:
+            changed = {}
+            offset += len(empty)
+        else:
+            changed, offset = self.record.read(data, offset)
+        nested = {}
+
+        if self.members:
+            count = data[offset]
+            offset += 1
+            for _ in range(count):
+                entry = data[offset]
+                offset += 1
+                name, member, is_table = self.members[entry >> 2]
+                op = entry & 3
+                if is_table:
+                    if op == _OP_REPLACE:
+                        records, offset = member.read_rows(data, offset)
+                        changed[name] = [records[i] for i in sorted(records)] if member.is_list else records
+                    elif op == _OP_PATCH:
+                        nested[name], offset = member.read_patch(data, offset)
+                    else:
+                        raise WireFormatError(f"bad op {op} for table {name}")
+                elif op == _OP_NULL:
+                    changed[name] = None
+                elif op == _OP_REPLACE:
+                    child_delta, offset = member.read(data, offset)
+                    changed[name] = _as_value(child_delta)
+                elif op == _OP_PATCH:
+                    nested[name], offset = member.read(data, offset)
+                else:
+                    raise WireFormatError(f"bad op {op} for {name}")
+
+        for name, child in self.delta_children:
+            changed[name], offset = child.read(data, offset)
+
+        delta = {}
+        if changed:
+            delta['set'] = changed
+        if nested:
+            delta['sub'] = nested
+        return delta, offset
+
+
+def _as_value(delta):
+    """The value a node delta read by NodeSchema.read gives when applied to an empty dict."""
+    if 'sub' in delta:
+        return apply_state_delta({}, delta)
+    return delta.get('set', {}) # Freshly decoded, so it needs no copy
+
+
+class WireCodec:
+    """Encoder/decoder pair for a versioned set of message schemas.
+
+    `messages` maps a message type number to the NodeSchema of its body; a
+    message is a plain dict that is encoded as a full node. `required` maps a
+    message type to the top-level fields every message of that type must
+    carry: decode() rejects one without them, so handlers can index them.
+    """
+
+    def __init__(self, version, messages, required=None):
+        self.version = version
+        self.messages = dict(messages)
+        self.required = {msg_type: frozenset(names) for msg_type, names in (required or {}).items()}
+
+    def encode(self, msg_type, message):
+        out = bytearray(_MESSAGE_HEADER.pack(WIRE_MAGIC, self.version, msg_type))
+        self.messages[msg_type].write({'set': message}, out)
+        return bytes(out)
+
+    def decode(self, data):
+        """Returns (msg_type, message) or raises WireFormatError."""
+        try:
+            magic, version, msg_type = _MESSAGE_HEADER.unpack_from(data, 0)
+            if magic != WIRE_MAGIC:
+                raise WireFormatError("bad magic")
+            if version != self.version:
+                raise WireFormatError(f"unsupported wire version {version} (expected {self.version})")
+            schema = self.messages.get(msg_type)
+            if schema is None:
+                raise WireFormatError(f"unknown message type {msg_type}")
+            delta, offset = schema.read(data, _MESSAGE_HEADER.size)
+        except (struct.error, IndexError, KeyError) as e:
+            raise WireFormatError(f"malformed message: {e}") from e
+        if offset != len(data):
+            raise WireFormatError(f"{len(data) - offset} trailing bytes after message")
+        message = _as_value(delta)
+        required = self.required.get(msg_type)
+        if required and not message.keys() >= required:
+            raise WireFormatError(f"message type {msg_type} lacks {', '.join(sorted(required.difference(message)))}")
+        return msg_type, message
+
+
+# --- Compression ---
+# Optional, agreed on per connection during the handshake. Each frame payload
+# is compressed on its own (no shared stream state), so one compressed frame
+# can be fanned out to many connections. A preset dictionary of typical
+# snapshot bytes makes even small messages compressible.
+#
+#     compressed payload := u8 method | data    (0: stored as is, 1: raw deflate)
+
+_STORED = 0
+_DEFLATED = 1
+
+
+class FrameCompressor:
+    """zlib with a preset dictionary, applied to every frame payload of a connection.
+
+    `dictionary_id` (a CRC of the dictionary) is what both ends compare during
+    the handshake: compression is only used if they have the same dictionary.
+    Payloads shorter than `min_size`, or that deflate would not shrink, are
+    stored as is.
+    """
+
+    def __init__(self, zdict, level=6, min_size=24):
+        self.zdict = zdict
+        self.min_size = min_size
+        self.dictionary_id = zlib.crc32(zdict) or 1 # 0 means "no compression" in handshakes
+        # Loading the dictionary is most of the cost of a small message, so every
+        # message starts from a copy of (de)compressors that already hold it
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY, zdict)
+        self._decompressor = zlib.decompressobj(-15, zdict=zdict)
+
+    def compress(self, payload):
+        if len(payload) >= self.min_size:
+            compressor = self._compressor.copy()
+            data = compressor.compress(payload) + compressor.flush()
+            if len(data) < len(payload):
+                return _U8.pack(_DEFLATED) + data
+        return _U8.pack(_STORED) + payload
+
+    def decompress(self, data, max_size=None):
+        if not data:
+            raise WireFormatError("empty compressed payload")
+        if data[0] == _STORED:
+            return bytes(data[1:])
+        if data[0] != _DEFLATED:
+            raise WireFormatError(f"unknown compression method {data[0]}")
+        max_size = max_size or MAX_FRAME_SIZE
+        decompressor = self._decompressor.copy()
+        try:
+            payload = decompressor.decompress(data[1:], max_size)
+        except zlib.error as e:
+            raise WireFormatError(f"corrupt compressed payload: {e}") from e
+        if decompressor.unconsumed_tail:
+            raise WireFormatError(f"compressed payload expands past {max_size} bytes")
+        if not decompressor.eof:
+            raise WireFormatError("truncated compressed payload")
+        return payload
+
+
+# --- Framing ---
+# TCP is a byte stream, so every message is sent as a frame:
+#     frame := u32 big-endian payload length | payload
+# FrameReader reads into one reusable buffer and may find several frames (or a
+# fraction of one) per recv call. With a FrameCompressor the payload inside the
+# frame is compressed; the messages above and below the framing do not change.
+
+_FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 1 << 20
+
+
+def encode_frame(payload, compressor=None):
+    """Returns `payload` with its length prefix, ready to be written to a stream."""
+    if compressor:
+        payload = compressor.compress(payload)
+    return _FRAME_HEADER.pack(len(payload)) + payload
+
+
+def send_frame(sock, payload, compressor=None, metrics=None):
+    """Sends `payload` as one length-prefixed frame, recording its size and the time sendall blocked in `metrics`."""
+    frame = encode_frame(payload, compressor)
+    if metrics is None:
+        sock.sendall(frame)
+        return
+    start = time.perf_counter()
+    sock.sendall(frame)
+    metrics.record_sent(len(frame), time.perf_counter() - start)
+
+
+async def read_frame_async(reader, max_frame_size=MAX_FRAME_SIZE, compressor=None):
+    """asyncio counterpart of FrameReader.read_frame for an asyncio.StreamReader."""
+    try:
+        header = await reader.readexactly(_FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ConnectionError("connection closed in the middle of a frame") from e
+        return None
+    (size,) = _FRAME_HEADER.unpack(header)
+    if size > max_frame_size:
+        raise WireFormatError(f"frame of {size} bytes exceeds the {max_frame_size} byte limit")
+    try:
+        payload = await reader.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        raise ConnectionError("connection closed in the middle of a frame") from e
+    return compressor.decompress(payload, max_frame_size) if compressor else payload
+
+
+class FrameReader:
+    """Splits the byte stream of one socket back into frames.
+
+    Set `compressor` once the handshake has agreed on compression; frames read
+    after that are decompressed. With `metrics` (a ConnectionMetrics), every
+    recv is recorded with its size and the time it blocked.
+    """
+
+    def __init__(self, sock, buffer_size=65536, max_frame_size=MAX_FRAME_SIZE, compressor=None, metrics=None):
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        self.compressor = compressor
+        self.metrics = metrics
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0 # First unread byte
+        self.end = 0 # One past the last received byte
+
+    def read_frame(self):
+        """Blocks until a whole frame is available; returns its payload, or None once the peer has closed."""
+        while True:
+            frame = self._next_buffered()
+            if frame is not None:
+                return frame
+            if not self._fill():
+                return None
+
+    def read_frames(self):
+        """Does at most one recv and returns every complete frame buffered so far.
+
+        Returns None once the peer has closed the connection.
+        """
+        frames = []
+        frame = self._next_buffered()
+        if frame is None:
+            if not self._fill():
+                return None
+            frame = self._next_buffered()
+        while frame is not None:
+            frames.append(frame)
+            frame = self._next_buffered()
+        return frames
+
+    def _next_buffered(self):
+        available = self.end - self.start
+        if available < _FRAME_HEADER.size:
+            return None
+        (size,) = _FRAME_HEADER.unpack_from(self.buffer, self.start)
+        if size > self.max_frame_size:
+            raise WireFormatError(f"frame of {size} bytes exceeds the {self.max_frame_size} byte limit")
+        if available < _FRAME_HEADER.size + size:
+            self._reserve(_FRAME_HEADER.size + size)
+            return None
+
+        begin = self.start + _FRAME_HEADER.size
+        frame = bytes(self.view[begin:begin + size])
+        self.start = begin + size
+        if self.start == self.end:
+            self.start = self.end = 0
+        if self.compressor:
+            return self.compressor.decompress(frame, self.max_frame_size)
+        return frame
+
+    def _reserve(self, frame_size):
+        """Makes room for a frame of `frame_size` bytes starting at self.start."""
+        if self.start + frame_size <= len(self.buffer):
+            return
+        available = self.end - self.start
+        if frame_size > len(self.buffer):
+            new_buffer = bytearray(max(frame_size, 2 * len(self.buffer)))
+            new_buffer[:available] = self.view[self.start:self.end]
+            self.view.release()
+            self.buffer = new_buffer
+            self.view = memoryview(new_buffer)
+        else:
+            self.buffer[:available] = self.buffer[self.start:self.end]
+        self.start = 0
+        self.end = available
+
+    def _fill(self):
+        if self.end == len(self.buffer):
+            self._reserve(len(self.buffer) + 1 if self.start == 0 else self.end - self.start + 1)
+        start = time.perf_counter()
+        received = self.sock.recv_into(self.view[self.end:])
+        if self.metrics:
+            self.metrics.record_received(received, time.perf_counter() - start)
+        if received == 0:
+            if self.end != self.start:
+                raise ConnectionError("connection closed in the middle of a frame")
+            return False
+        self.end += received
+        return True
+
+
+# --- Full-Duplex Helpers ---
+# Each connection has a reader thread and a writer loop. They only meet through
+# LatestSlot, so a slow peer never stalls the other direction.
+
+class LatestSlot:
+    """Holds the newest value put into it; older values are simply overwritten."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = None
+        self._fresh = False
+
+    def put(self, value):
+        with self._lock:
+            self._value = value
+            self._fresh = True
+
+    def get(self):
+        """Returns the newest value (None if nothing was put yet), fresh or not."""
+        with self._lock:
+            return self._value
+
+    def take(self):
+        """Returns the newest value if it was not taken yet, otherwise None."""
+        with self._lock:
+            if not self._fresh:
+                return None
+            self._fresh = False
+            return self._value
+
+
+class FixedRate:
+    """Paces a loop at `rate_hz` iterations per second, measured from a fixed schedule."""
+
+    def __init__(self, rate_hz):
+        self.interval = 1.0 / rate_hz
+        self.next_time = time.monotonic()
+
+    def set_rate(self, rate_hz):
+        """Changes the rate from the next tick on."""
+        self.interval = 1.0 / rate_hz
+
+    def wait(self):
+        """Sleeps until the next scheduled tick.
+
+        A loop that falls more than one tick behind restarts the schedule
+        instead of bursting to catch up.
+        """
+        self.next_time += self.interval
+        delay = self.next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -self.interval:
+            self.next_time = time.monotonic()
+
+
+class LoadMeter:
+    """Smoothed fraction of a fixed tick interval that the work of each tick takes (1.0: no headroom left)."""
+
+    def __init__(self, rate_hz, smoothing=0.05):
+        self.interval = 1.0 / rate_hz
+        self.smoothing = smoothing
+        self.load = 0.0
+
+    def record(self, seconds):
+        self.load += (seconds / self.interval - self.load) * self.smoothing
+
+
+class AdaptiveSendRate:
+    """Snapshot send rate for one client, kept between `min_rate` and `max_rate` Hz.
+
+    Call update() before each send with what is known about the client. The
+    rate is cut by `backoff` when the client looks congested (round trip well
+    above the best one seen), the send path backs up, or the server runs out
+    of CPU headroom, at most once per `backoff_interval` seconds. While all is
+    clear it climbs back by `step` Hz per second, much like TCP's congestion
+    window. The simulation rate is never touched.
+    """
+
+    def __init__(self, max_rate, min_rate, step=5.0, backoff=0.75, backoff_interval=1.0,
+                 rtt_margin=0.03, max_backlog=0.25, max_load=0.8):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.step = step
+        self.backoff = backoff
+        self.backoff_interval = backoff_interval
+        self.rtt_margin = rtt_margin # Seconds of queueing delay on top of the best round trip tolerated
+        self.max_backlog = max_backlog
+        self.max_load = max_load
+        self.rate = float(max_rate)
+        self.best_rtt = None
+        self.reason = None # What caused the last backoff: 'rtt', 'backlog' or 'load'
+        self.last_update = time.monotonic()
+        self.last_backoff = 0.0
+
+    def update(self, rtt=None, backlog=0.0, load=0.0):
+        """Returns the rate to use now.
+
+        `rtt` is the latest round trip in seconds (None if unknown), `backlog`
+        how backed up the send path is (0: idle, 1: sending or queueing takes
+        all it can afford), and `load` the server's LoadMeter value.
+        """
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        if rtt is not None:
+            self.best_rtt = rtt if self.best_rtt is None else min(self.best_rtt, rtt)
+
+        if rtt is not None and rtt > self.best_rtt * 1.5 + self.rtt_margin:
+            congested = 'rtt'
+        elif backlog > self.max_backlog:
+            congested = 'backlog'
+        elif load > self.max_load:
+            congested = 'load'
+        else:
+            congested = None
+
+        if congested is None:
+            self.rate = min(self.max_rate, self.rate + self.step * elapsed)
+        elif now - self.last_backoff >= self.backoff_interval:
+            self.rate = max(self.min_rate, self.rate * self.backoff)
+            self.reason = congested
+            self.last_backoff = now
+        return self.rate
+
+
+class FixedTimestep:
+    """Accumulator that decouples a fixed simulation rate from a variable frame rate.
+
+    Call advance() once per rendered frame and run that many simulation steps;
+    `alpha` then tells how far the renderer is between the last two steps.
+    """
+
+    def __init__(self, rate_hz, max_steps=5):
+        self.step_time = 1.0 / rate_hz
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        self.last_time = time.monotonic()
+
+    def advance(self):
+        """Returns how many simulation steps are owed since the previous call.
+
+        After a long stall at most `max_steps` are returned and the rest of
+        the backlog is dropped, so a slow frame cannot snowball.
+        """
+        now = time.monotonic()
+        self.accumulator += now - self.last_time
+        self.last_time = now
+        steps = int(self.accumulator / self.step_time)
+        if steps > self.max_steps:
+            steps = self.max_steps
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= steps * self.step_time
+        return steps
+
+    @property
+    def alpha(self):
+        """Fraction (0..1) of a step that has elapsed since the last simulation step."""
+        return min(1.0, self.accumulator / self.step_time)
+
+
+class TickScheduler:
+    """Runs every registered callback once per tick from a single asyncio task.
+
+    One scheduler drives all the matches of a server process, so they share a
+    clock and never compete for threads. The cost of every tick feeds
+    `load_meter`; with `metrics` (a ConnectionMetrics), it is also recorded as
+    'tick' and the ticks skipped while behind schedule are counted as
+    'dropped_ticks'.
+    """
+
+    def __init__(self, rate_hz, metrics=None):
+        self.interval = 1.0 / rate_hz
+        self.metrics = metrics
+        self.load_meter = LoadMeter(rate_hz)
+        self.tick = 0
+        self.callbacks = []
+
+    def add(self, callback):
+        """Registers callback(tick) to be called every tick."""
+        self.callbacks.append(callback)
+
+    def remove(self, callback):
+        self.callbacks.remove(callback)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        while True:
+            self.tick += 1
+            start = time.perf_counter()
+            for callback in list(self.callbacks):
+                callback(self.tick)
+            cost = time.perf_counter() - start
+            self.load_meter.record(cost)
+            if self.metrics:
+                self.metrics.record_time('tick', cost)
+            next_time += self.interval
+            delay = next_time - loop.time()
+            if delay < -self.interval:
+                # Too far behind to catch up; restart the schedule (see FixedRate)
+                if self.metrics:
+                    self.metrics.count('dropped_ticks', int(-delay / self.interval))
+                next_time = loop.time()
+            await asyncio.sleep(max(0.0, delay))
+
+
+# --- Snapshot Interpolation ---
+# Entities the client does not predict are drawn a little in the past, between
+# two snapshots it has already received, instead of jumping to each new one.
+
+class InterpolationBuffer:
+    """Client-side history of remote entity positions, sampled `delay` seconds in the past.
+
+    With the render time that far behind the newest snapshot there is nearly
+    always a snapshot on each side of it, so the server can send less often
+    without visible stutter. When snapshots stop coming, the last known motion
+    is extrapolated for at most `max_extrapolation` seconds. Entities that
+    moved more than `snap_distance` between two snapshots teleported (respawn,
+    new level) and are not interpolated.
+    """
+
+    def __init__(self, delay=0.1, max_extrapolation=0.25, snap_distance=None, max_snapshots=32):
+        self.lock = threading.Lock()
+        self.delay = delay
+        self.max_extrapolation = max_extrapolation
+        self.snap_distance = snap_distance
+        self.snapshots = collections.deque(maxlen=max_snapshots)
+
+    def push(self, timestamp, positions):
+        """Records {key: (x, y)} for every remote entity in a snapshot received at `timestamp`."""
+        with self.lock:
+            self.snapshots.append((timestamp, positions))
+
+    def clear(self):
+        with self.lock:
+            self.snapshots.clear()
+
+    def sample(self, now):
+        """Returns {key: (x, y)} for the render time `now - delay`."""
+        with self.lock:
+            snapshots = list(self.snapshots)
+        if not snapshots:
+            return {}
+
+        render_time = now - self.delay
+        if render_time <= snapshots[0][0]:
+            return dict(snapshots[0][1])
+        if render_time >= snapshots[-1][0]:
+            if len(snapshots) < 2:
+                return dict(snapshots[-1][1])
+            (t0, older), (t1, newer) = snapshots[-2], snapshots[-1]
+            # Past the newest snapshot: keep going the way things were moving, for a while
+            fraction = 1.0 + min(render_time - t1, self.max_extrapolation) / max(t1 - t0, 1e-6)
+            return self._blend(older, newer, fraction)
+
+        for index in range(len(snapshots) - 1, 0, -1):
+            t0, older = snapshots[index - 1]
+            if t0 <= render_time:
+                t1, newer = snapshots[index]
+                return self._blend(older, newer, (render_time - t0) / max(t1 - t0, 1e-6))
+        return dict(snapshots[-1][1])
+
+    def _blend(self, older, newer, fraction):
+        """Positions `fraction` of the way from `older` to `newer` (beyond 1 extrapolates)."""
+        positions = {}
+        for key, (x1, y1) in newer.items():
+            previous = older.get(key)
+            if previous is None:
+                positions[key] = (x1, y1) # Spawned since the older snapshot
+                continue
+            x0, y0 = previous
+            if self.snap_distance is not None and max(abs(x1 - x0), abs(y1 - y0)) > self.snap_distance:
+                positions[key] = (x1, y1)
+                continue
+            positions[key] = (x0 + (x1 - x0) * fraction, y0 + (y1 - y0) * fraction)
+        return positions
+
+
+# --- Client Prediction ---
+# The client numbers the input of every simulation step and applies it at once.
+# The server applies the same inputs one per step and reports the newest one it
+# applied in each snapshot, so the client can reset to that state and replay
+# only the inputs the server has not seen yet.
+
+class PendingInputs:
+    """Client-side list of the (seq, command) inputs the server has not applied yet.
+
+    Every input message carries all of them, so a lost or late message costs
+    nothing. Inputs are added by the game loop and acknowledged by the reader.
+    """
+
+    def __init__(self, max_pending=64):
+        self.lock = threading.Lock()
+        self.max_pending = max_pending
+        self.next_seq = 1
+        self.inputs = collections.deque()
+
+    def add(self, command):
+        """Records the input of a new simulation step and returns its sequence number."""
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.inputs.append((seq, command))
+            if len(self.inputs) > self.max_pending:
+                self.inputs.popleft()
+            return seq
+
+    def acknowledge(self, seq):
+        """Forgets every input up to and including `seq`."""
+        with self.lock:
+            while self.inputs and self.inputs[0][0] <= seq:
+                self.inputs.popleft()
+
+    def unacked(self):
+        with self.lock:
+            return list(self.inputs)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.inputs)
+
+
+class InputQueue:
+    """Server-side queue of one client's numbered inputs, consumed one per simulation step.
+
+    Inputs are resent until acknowledged, so the ones already queued are
+    skipped. `last_seq` is the newest input applied; it goes back to the client
+    in the snapshots as the acknowledgement.
+    """
+
+    def __init__(self, max_queued=8):
+        self.lock = threading.Lock()
+        self.max_queued = max_queued
+        self.queue = collections.deque()
+        self.last_queued = 0
+        self.last_seq = 0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.queue)
+
+    def push(self, inputs):
+        with self.lock:
+            for seq, command in inputs:
+                if seq > self.last_queued:
+                    self.queue.append((seq, command))
+                    self.last_queued = seq
+            # A queue that keeps growing only adds latency; skip to the newest inputs
+            while len(self.queue) > self.max_queued:
+                self.queue.popleft()
+
+    def pop(self):
+        """Returns the command for the next simulation step, or None if none has arrived."""
+        with self.lock:
+            if not self.queue:
+                return None
+            self.last_seq, command = self.queue.popleft()
+            return command
+
+
+# --- Reliable Events ---
+# Snapshots are latest-wins: one can replace another before it is sent. One-off
+# gameplay events (a pickup, a kill) therefore travel beside them, numbered and
+# repeated in every snapshot message until the client acknowledges them.
+
+class EventStream(PendingInputs):
+    """Server-side outbox of the gameplay events not yet acknowledged by one client.
+
+    Same bookkeeping as PendingInputs, in the other direction: push() numbers
+    an event, unacked() is what goes into the next snapshot message. Unlike
+    inputs, an event is never dropped to make room: past `max_pending` the
+    stream is `overflowed`, and the server resyncs the client with a full
+    snapshot instead (see resync()).
+    """
+
+    def __init__(self, max_pending=256):
+        super().__init__(max_pending)
+        self.overflowed = False
+
+    def push(self, event):
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.inputs.append((seq, event))
+            if len(self.inputs) > self.max_pending:
+                self.overflowed = True
+            return seq
+
+    def resync(self):
+        """Gives up on the queued events of an overflowed stream; the caller must send a full snapshot.
+
+        Numbering carries on, so the client's EventReceiver sees the gap.
+        """
+        with self.lock:
+            self.inputs.clear()
+            self.overflowed = False
+
+
+class EventReceiver:
+    """Client-side filter that lets each numbered event through exactly once.
+
+    `missed` counts the events the server gave up on (a gap in the numbering);
+    their effect on the game state arrives with the full snapshot it sent instead.
+    """
+
+    def __init__(self):
+        self.last_seq = 0
+        self.missed = 0
+
+    def accept(self, events):
+        """Returns the events of a [(seq, event), ...] list that were not seen yet, in order."""
+        new_events = [event for seq, event in events if seq > self.last_seq]
+        if events:
+            if events[0][0] > self.last_seq + 1:
+                self.missed += events[0][0] - self.last_seq - 1
+            self.last_seq = max(self.last_seq, events[-1][0])
+        return new_events
+
+
+# --- Published Snapshots ---
+# The simulation thread owns the live game objects. At the end of every tick it
+# copies their state into a plain snapshot and publishes it; network threads
+# only ever serialize published snapshots, never the objects being simulated.
+
+PublishedSnapshot = collections.namedtuple('PublishedSnapshot', ['version', 'state'])
+
+
+class SnapshotPublisher:
+    """Hands the newest game state snapshot from the simulation to any number of reader threads.
+
+    Each publish() gets the next version number. A published state is treated
+    as immutable: the simulation builds a new one every tick and readers may
+    share it without copying or locking.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._latest = None
+
+    def publish(self, state):
+        with self._condition:
+            version = self._latest.version + 1 if self._latest else 1
+            self._latest = PublishedSnapshot(version, state)
+            self._condition.notify_all()
+            return version
+
+    def latest(self):
+        """The newest PublishedSnapshot, or None before the first publish()."""
+        with self._condition:
+            return self._latest
+
+    def wait_newer(self, version, timeout=None):
+        """Blocks until a snapshot newer than `version` is published and returns it (None on timeout)."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._latest is not None and self._latest.version > version, timeout)
+            if self._latest is not None and self._latest.version > version:
+                return self._latest
+            return None
+
+
+# --- Broadcast ---
+# Players get snapshots delta-encoded against their own acks, which costs one
+# encode per player. Read-only subscribers (spectators) share a single stream
+# instead: every snapshot is encoded at most twice, however many subscribe
+# (plus once for each subscriber still owed events from a skipped snapshot).
+
+class SnapshotBroadcast:
+    """Fans one encoded snapshot stream out to any number of asyncio StreamWriters.
+
+    `encode(seq, base_seq, delta, events)` must return the message payload.
+    For each publish() the delta against the previous snapshot is encoded
+    once and shared by every subscriber that got the previous snapshot; a
+    full snapshot (base 0) is encoded once for the ones that just joined or
+    were skipped. Compressed frames are likewise built once per compressor.
+    A subscriber whose transport still buffers more than `max_buffered`
+    bytes is skipped instead of queued, so a slow one catches up with the
+    newest snapshot rather than falling further behind.
+    Events queued with add_event() are kept for each subscriber until a
+    snapshot is actually written to it (at most `max_events` of them).
+    """
+
+    def __init__(self, encode, max_buffered=64 * 1024, max_events=256):
+        self.encode = encode
+        self.max_buffered = max_buffered
+        self.max_events = max_events
+        self.subscribers = {} # writer -> seq of the last snapshot it was sent (0: none)
+        self.compressors = {} # writer -> FrameCompressor agreed with it, or None
+        self.events_sent = {} # writer -> seq of the last event it was sent
+        self.seq = 0
+        self.previous = None
+        self.events = [] # (seq, event) not yet sent to every subscriber
+        self.next_event_seq = 1
+
+    def subscribe(self, writer, compressor=None):
+        self.subscribers[writer] = 0
+        self.compressors[writer] = compressor
+        self.events_sent[writer] = self.next_event_seq - 1 # Only events from now on
+
+    def unsubscribe(self, writer):
+        self.subscribers.pop(writer, None)
+        self.compressors.pop(writer, None)
+        self.events_sent.pop(writer, None)
+
+    def add_event(self, event):
+        if self.subscribers:
+            self.events.append((self.next_event_seq, event))
+            self.next_event_seq += 1
+            if len(self.events) > self.max_events:
+                del self.events[0] # A subscriber skipped for that long loses the oldest
+
+    def publish(self, snapshot):
+        """Sends `snapshot` to every subscriber that can take it now; returns how many were skipped."""
+        self.seq += 1
+        base, self.previous = self.previous, snapshot
+        last_event_seq = self.next_event_seq - 1
+        payloads = {}
+        frames = {}
+        skipped = 0
+        for writer, last_seq in list(self.subscribers.items()):
+            if writer.is_closing():
+                continue
+            if writer.transport.get_write_buffer_size() > self.max_buffered:
+                skipped += 1
+                continue
+            base_seq = last_seq if last_seq == self.seq - 1 and base is not None else 0
+            payload_key = (base_seq, self.events_sent[writer])
+            if payload_key not in payloads:
+                delta = diff_state(base, snapshot) if base_seq else {'set': snapshot}
+                events = [(seq, event) for seq, event in self.events if seq > self.events_sent[writer]]
+                payloads[payload_key] = self.encode(self.seq, base_seq, delta, events)
+            frame_key = (payload_key, self.compressors[writer])
+            if frame_key not in frames:
+                frames[frame_key] = encode_frame(payloads[payload_key], self.compressors[writer])
+            writer.write(frames[frame_key])
+            self.subscribers[writer] = self.seq
+            self.events_sent[writer] = last_event_seq
+        # Drop the events every subscriber has been sent
+        oldest_unsent = min(self.events_sent.values(), default=last_event_seq)
+        self.events = [(seq, event) for seq, event in self.events if seq > oldest_unsent]
+        return skipped
+
+
+# --- UDP Transport ---
+# Over TCP one lost segment holds back every later snapshot until it is
+# retransmitted. Over UDP each datagram stands alone: a late snapshot or input
+# is simply dropped, because a newer one is already on its way.
+#
+#     packet   := u32 seq | u32 ack | u32 ack bits | u8 reliable count | reliable* | unreliable payload
+#     reliable := u32 reliable seq | u16 length (high bit: more fragments follow) | payload
+#
+# `ack` is the newest packet seq received from the peer and bit i of `ack bits`
+# stands for packet ack - 1 - i, so every packet acknowledges up to 33 packets.
+# The few messages that must arrive (handshake, level changes, game over) go on
+# a reliable sub-channel: they are repeated in the following packets until a
+# packet that carried them is acknowledged, and delivered once and in order.
+#
+# A packet never exceeds MAX_PACKET_SIZE: one that IP has to fragment is lost
+# with any of its fragments. A reliable message too large for one packet is
+# split into fragments, numbered like reliable messages and joined on delivery;
+# an unreliable payload that large is sent reliably instead.
+
+_PACKET_HEADER = struct.Struct('!IIIB')
+_RELIABLE_HEADER = struct.Struct('!IH')
+_MORE_FRAGMENTS = 0x8000 # In a reliable message's length: the message goes on in the next reliable seq
+MAX_DATAGRAM_SIZE = 65507
+MAX_PACKET_SIZE = 1200 # Leaves room for IP and UDP headers within a typical 1500-byte MTU
+_ACK_BITS = 32
+
+
+class PacketChannel:
+    """Sequence numbers, acks and the reliable sub-channel for the datagrams exchanged with one peer.
+
+    Does no I/O itself: build_packet() returns the bytes to send and
+    receive_packet() takes the bytes of a received datagram. An unreliable
+    payload must fit in one packet: at most `max_payload` bytes.
+    """
+
+    def __init__(self, max_reliable_per_packet=8, max_packet_size=MAX_PACKET_SIZE):
+        self.lock = threading.Lock()
+        self.max_reliable_per_packet = max_reliable_per_packet
+        self.max_packet_size = max_packet_size
+        self.max_payload = max_packet_size - _PACKET_HEADER.size
+        self.local_seq = 0
+        self.remote_seq = 0 # Newest packet seq received
+        self.remote_bits = 0 # Bit i: packet remote_seq - 1 - i was received
+        self.next_reliable_seq = 1
+        self.reliable_out = collections.OrderedDict() # reliable seq -> (fragment, more), until acknowledged
+        self.unsent = set() # Reliable seqs no packet has carried yet
+        self.in_flight = {} # packet seq -> reliable seqs it carried
+        self.next_delivery = 1 # Next reliable seq to hand out
+        self.reliable_in = {} # reliable seq -> (fragment, more) received ahead of next_delivery
+        self.reassembly = bytearray() # Fragments delivered so far of a message that goes on
+
+    def send_reliable(self, payload):
+        """Queues `payload` on the reliable sub-channel, in fragments if need be; it goes out with the next packets."""
+        fragment_size = self.max_payload - _RELIABLE_HEADER.size
+        with self.lock:
+            for start in range(0, max(len(payload), 1), fragment_size):
+                more = start + fragment_size < len(payload)
+                self.reliable_out[self.next_reliable_seq] = (payload[start:start + fragment_size], more)
+                self.unsent.add(self.next_reliable_seq)
+                self.next_reliable_seq += 1
+
+    def has_unacked(self):
+        with self.lock:
+            return bool(self.reliable_out)
+
+    def has_unsent(self):
+        with self.lock:
+            return bool(self.unsent)
+
+    def build_packet(self, payload=b''):
+        """Returns the next packet: acks, unacknowledged reliable messages and the unreliable `payload`.
+
+        Reliable messages never sent go first, then the oldest unacknowledged
+        ones, as many as fit beside `payload` within max_packet_size.
+        """
+        if len(payload) > self.max_payload:
+            raise ValueError(f"unreliable payload of {len(payload)} bytes does not fit in a {self.max_packet_size}-byte packet")
+        with self.lock:
+            self.local_seq += 1
+            room = self.max_payload - len(payload)
+            carried = []
+            for reliable_seq in sorted(self.reliable_out, key=lambda seq: seq not in self.unsent):
+                if len(carried) == self.max_reliable_per_packet:
+                    break
+                fragment, more = self.reliable_out[reliable_seq]
+                if _RELIABLE_HEADER.size + len(fragment) <= room:
+                    room -= _RELIABLE_HEADER.size + len(fragment)
+                    carried.append((reliable_seq, fragment, more))
+            if carried:
+                self.in_flight[self.local_seq] = [reliable_seq for reliable_seq, _, _ in carried]
+                self.unsent.difference_update(self.in_flight[self.local_seq])
+            # A packet that far back can no longer be acknowledged by the bitfield
+            self.in_flight.pop(self.local_seq - _ACK_BITS - 1, None)
+
+            out = bytearray(_PACKET_HEADER.pack(self.local_seq, self.remote_seq, self.remote_bits, len(carried)))
+            for reliable_seq, fragment, more in carried:
+                out += _RELIABLE_HEADER.pack(reliable_seq, len(fragment) | (_MORE_FRAGMENTS if more else 0))
+                out += fragment
+            out += payload
+            return bytes(out)
+
+    def receive_packet(self, data):
+        """Processes one datagram.
+
+        Returns (reliable, unreliable): the reliable payloads that are now
+        deliverable in order, and the unreliable payload, or None if there is
+        none or a newer packet already arrived. Raises WireFormatError for a
+        malformed datagram.
+        """
+        try:
+            seq, ack, ack_bits, reliable_count = _PACKET_HEADER.unpack_from(data, 0)
+            offset = _PACKET_HEADER.size
+            reliable = []
+            for _ in range(reliable_count):
+                reliable_seq, size = _RELIABLE_HEADER.unpack_from(data, offset)
+                offset += _RELIABLE_HEADER.size
+                more = bool(size & _MORE_FRAGMENTS)
+                size &= ~_MORE_FRAGMENTS
+                if offset + size > len(data):
+                    raise WireFormatError("reliable message runs past the end of the packet")
+                reliable.append((reliable_seq, (bytes(data[offset:offset + size]), more)))
+                offset += size
+        except struct.error as e:
+            raise WireFormatError(f"malformed packet: {e}") from e
+
+        with self.lock:
+            self._process_acks(ack, ack_bits)
+            newest = self._record_received(seq)
+            for reliable_seq, fragment in reliable:
+                if reliable_seq >= self.next_delivery:
+                    self.reliable_in.setdefault(reliable_seq, fragment)
+            delivered = []
+            while self.next_delivery in self.reliable_in:
+                fragment, more = self.reliable_in.pop(self.next_delivery)
+                self.next_delivery += 1
+                self.reassembly += fragment
+                if not more:
+                    delivered.append(bytes(self.reassembly))
+                    self.reassembly.clear()
+
+        unreliable = bytes(data[offset:]) if newest and offset < len(data) else None
+        return delivered, unreliable
+
+    def _process_acks(self, ack, ack_bits):
+        acked = [ack] + [ack - 1 - i for i in range(_ACK_BITS) if ack_bits & (1 << i)]
+        for packet_seq in acked:
+            for reliable_seq in self.in_flight.pop(packet_seq, ()):
+                self.reliable_out.pop(reliable_seq, None)
+
+    def _record_received(self, seq):
+        """Marks packet `seq` as received; returns True if it is the newest one so far."""
+        if seq > self.remote_seq:
+            shift = seq - self.remote_seq
+            bits = (self.remote_bits << shift) | (1 << (shift - 1)) if self.remote_seq else 0
+            self.remote_bits = bits & ((1 << _ACK_BITS) - 1)
+            self.remote_seq = seq
+            return True
+        if seq < self.remote_seq and self.remote_seq - 1 - seq < _ACK_BITS:
+            self.remote_bits |= 1 << (self.remote_seq - 1 - seq)
+        return False
+
+
+class DatagramConnection:
+    """Payload-level connection to one peer over a UDP socket, built on PacketChannel.
+
+    On the client, pass a socket connect()ed to the server; on the server,
+    which reads one socket for every peer, pass `peer` and feed the peer's
+    datagrams in with deliver(). Unacknowledged reliable messages are resent
+    every `resend_interval` seconds while the line is quiet, and receive()
+    gives up (returns None) after `timeout` seconds without a datagram. With
+    `metrics` (a ConnectionMetrics), every datagram is recorded with its size
+    and the time spent waiting for or sending it. A datagram that cannot be
+    sent is dropped and reported once, like a lost one, never raised.
+    """
+
+    def __init__(self, sock, peer=None, resend_interval=0.25, timeout=5.0, compressor=None, metrics=None):
+        self.sock = sock
+        self.peer = peer
+        self.resend_interval = resend_interval
+        self.timeout = timeout
+        self.compressor = compressor # Set once the handshake has agreed on compression
+        self.metrics = metrics
+        self.channel = PacketChannel()
+        self.inbox = queue.Queue() if peer else None
+        self.received = collections.deque() # Raw payloads; decompressed only when handed out
+        self.last_heard = time.monotonic()
+        self.closed = False
+        self.send_failing = False # The last send raised; reported once until one succeeds again
+        if peer is None:
+            sock.settimeout(resend_interval)
+
+    def send(self, payload, reliable=False):
+        if self.compressor:
+            payload = self.compressor.compress(payload)
+        if not reliable and len(payload) > self.channel.max_payload:
+            # Split into packets by the reliable sub-channel rather than into IP fragments
+            if self.metrics:
+                self.metrics.count('oversized_payloads')
+            reliable = True
+        if reliable:
+            self.channel.send_reliable(payload)
+            payload = b''
+        self._send_packet(self.channel.build_packet(payload))
+        while self.channel.has_unsent(): # The other fragments of a large reliable message
+            self._send_packet(self.channel.build_packet())
+
+    def flush(self):
+        """Sends a packet without payload, which carries acks and any unacknowledged reliable messages."""
+        self._send_packet(self.channel.build_packet())
+
+    def deliver(self, datagram):
+        """Server side: hands over a datagram the shared socket received from this peer."""
+        self.inbox.put(datagram)
+
+    def receive(self):
+        """Blocks until the next payload arrives; returns None once the peer closed or went silent."""
+        while not self.received:
+            start = time.perf_counter()
+            datagram = self._next_datagram()
+            if self.closed:
+                return None
+            if datagram:
+                if self.metrics:
+                    self.metrics.record_received(len(datagram), time.perf_counter() - start)
+                try:
+                    reliable, unreliable = self.channel.receive_packet(datagram)
+                except WireFormatError:
+                    continue # Not one of ours, or corrupted: UDP gives no guarantee
+                self.last_heard = time.monotonic()
+                self.received.extend(reliable)
+                if unreliable is not None:
+                    self.received.append(unreliable)
+            elif time.monotonic() - self.last_heard > self.timeout:
+                return None
+            elif self.channel.has_unacked():
+                self.flush()
+        payload = self.received.popleft()
+        return self.compressor.decompress(payload) if self.compressor else payload
+
+    def close(self):
+        self.closed = True
+        if self.inbox is not None:
+            self.inbox.put(None)
+        else:
+            self.sock.close()
+
+    def _send_packet(self, packet):
+        if self.closed:
+            return
+        start = time.perf_counter()
+        try:
+            if self.peer is None:
+                self.sock.send(packet)
+            else:
+                self.sock.sendto(packet, self.peer)
+        except ConnectionRefusedError:
+            pass # The peer is not listening (yet); reliable messages are resent anyway
+        except OSError as e:
+            # Lost like any datagram (reliable messages are resent); the writer carries on
+            if self.metrics:
+                self.metrics.count('send_errors')
+            if not self.send_failing and not self.closed:
+                print(f"Cannot send a {len(packet)}-byte datagram to {self.peer or 'the server'}: {e}")
+            self.send_failing = True
+            return
+        self.send_failing = False
+        if self.metrics:
+            self.metrics.record_sent(len(packet), time.perf_counter() - start)
+            self.metrics.set_gauge('reliable_queue', len(self.channel.reliable_out))
+
+    def _next_datagram(self):
+        """The next datagram from the peer, or b'' if none came within resend_interval."""
+        try:
+            if self.inbox is not None:
+                return self.inbox.get(timeout=self.resend_interval)
+            return self.sock.recv(MAX_DATAGRAM_SIZE)
+        except (queue.Empty, socket.timeout, ConnectionRefusedError):
+            return b''
+        except OSError:
+            if self.closed:
+                return None
+            raise
+
+
+# --- Connection Metrics ---
+# Counters the reader and writer threads of one connection update as they go.
+# send_frame, FrameReader and DatagramConnection fill in the byte counts and the
+# time blocked in the socket calls when given a ConnectionMetrics; the game adds
+# encode/decode times, snapshot sizes, ping/pong round trips and queue depths.
+
+class TimingStat:
+    """Count, mean and maximum of one kind of duration."""
+
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def summary(self):
+        mean = self.total / self.count if self.count else 0.0
+        return {'count': self.count, 'mean_ms': mean * 1000, 'max_ms': self.max * 1000}
+
+
+class SizeHistogram:
+    """Message sizes in power-of-two buckets: bucket n holds sizes below 2**n."""
+
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, size):
+        self.buckets[size.bit_length()] += 1
+        self.count += 1
+        self.total += size
+        if size > self.max:
+            self.max = size
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction (0..1) of the sizes."""
+        wanted = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= wanted:
+                return 1 << bucket
+        return 0
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.total / self.count if self.count else 0, 'max': self.max,
+                'buckets': {f'<{1 << bucket}': count for bucket, count in sorted(self.buckets.items())}}
+
+
+class RateCounter:
+    """A running total and the amount added during the last whole second."""
+
+    def __init__(self):
+        self.total = 0
+        self.window = int(time.monotonic())
+        self.current = 0 # Added so far in `window`
+        self.last = 0 # Added in the second before `window`
+
+    def add(self, amount):
+        self._roll()
+        self.current += amount
+        self.total += amount
+
+    def per_second(self):
+        self._roll()
+        return self.last
+
+    def _roll(self):
+        window = int(time.monotonic())
+        if window != self.window:
+            self.last = self.current if window == self.window + 1 else 0
+            self.current = 0
+            self.window = window
+
+
+class ConnectionMetrics:
+    """Everything measured about one connection, safe to update and read from any thread.
+
+    RTT comes from ping/pong: the sender stamps a ping with ping_stamp(), the
+    peer echoes the stamp back unchanged and record_pong() turns it into a
+    round trip. Jitter is the smoothed change between consecutive round trips
+    (as in RTP, RFC 3550).
+    """
+
+    def __init__(self, name, ping_interval=1.0):
+        self.name = name
+        self.ping_interval = ping_interval
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.bytes_sent = RateCounter()
+        self.bytes_received = RateCounter()
+        self.snapshot_sizes = SizeHistogram()
+        self.timings = collections.defaultdict(TimingStat) # Any other name given to record_time() is added as it comes
+        for name in ('encode', 'decode', 'send_blocked', 'recv_blocked'):
+            self.timings[name] = TimingStat()
+        self.counters = collections.Counter()
+        self.gauges = {} # Queue depths and the like: the latest value wins
+        self.rtt = None
+        self.jitter = 0.0
+        self.last_ping = 0.0
+
+    def record_sent(self, size, blocked=None):
+        """Records `size` bytes sent; `blocked` is None for writes that never block (asyncio)."""
+        with self.lock:
+            self.bytes_sent.add(size)
+            if blocked is not None:
+                self.timings['send_blocked'].add(blocked)
+
+    def record_received(self, size, blocked):
+        with self.lock:
+            self.bytes_received.add(size)
+            self.timings['recv_blocked'].add(blocked)
+
+    def record_time(self, name, seconds):
+        with self.lock:
+            self.timings[name].add(seconds)
+
+    def record_snapshot_size(self, size):
+        with self.lock:
+            self.snapshot_sizes.add(size)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def ping_stamp(self):
+        """Returns the stamp for a ping if one is due (every `ping_interval` seconds), otherwise None."""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_ping < self.ping_interval:
+                return None
+            self.last_ping = now
+        return int(now * 1000) & 0xFFFFFFFF
+
+    def record_pong(self, stamp):
+        """Records the round trip of the ping that carried `stamp` (milliseconds, wrapping at 32 bits)."""
+        rtt = ((int(time.monotonic() * 1000) - stamp) & 0xFFFFFFFF) / 1000
+        with self.lock:
+            if self.rtt is not None:
+                self.jitter += (abs(rtt - self.rtt) - self.jitter) / 16
+            self.rtt = rtt
+
+    def snapshot(self):
+        """All current values as a plain dict (JSON-serializable)."""
+        with self.lock:
+            return {
+                'name': self.name,
+                'uptime': time.monotonic() - self.started,
+                'rtt_ms': self.rtt * 1000 if self.rtt is not None else None,
+                'jitter_ms': self.jitter * 1000,
+                'bytes_sent': self.bytes_sent.total,
+                'bytes_received': self.bytes_received.total,
+                'sent_per_second': self.bytes_sent.per_second(),
+                'received_per_second': self.bytes_received.per_second(),
+                'snapshot_sizes': self.snapshot_sizes.summary(),
+                'snapshot_size_p95': self.snapshot_sizes.percentile(0.95),
+                'timings': {name: stat.summary() for name, stat in self.timings.items()},
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges)
+            }
+
+    def overlay_lines(self):
+        """A few short lines summing up the connection, for an in-game overlay."""
+        values = self.snapshot()
+        timings = values['timings']
+        rtt = f"{values['rtt_ms']:.1f} ms" if values['rtt_ms'] is not None else "-"
+        lines = [
+            f"{self.name}  rtt {rtt}  jitter {values['jitter_ms']:.1f} ms",
+            f"out {values['sent_per_second'] / 1024:.1f} KiB/s  in {values['received_per_second'] / 1024:.1f} KiB/s",
+            f"snapshot {values['snapshot_sizes']['mean']:.0f} B avg  p95 <{values['snapshot_size_p95']} B"
+            f"  max {values['snapshot_sizes']['max']} B",
+            f"encode {timings['encode']['mean_ms']:.3f} ms  decode {timings['decode']['mean_ms']:.3f} ms",
+            f"blocked send {timings['send_blocked']['max_ms']:.1f} ms  recv {timings['recv_blocked']['max_ms']:.0f} ms (max)"
+        ]
+        extra = {**values['gauges'], **values['counters']}
+        if extra:
+            lines.append("  ".join(f"{name} {value}" for name, value in sorted(extra.items())))
+        return lines
+
+    def dump(self, path):
+        """Appends the current values to `path` as one JSON line, stamped with the wall-clock time."""
+        line = json.dumps({'time': time.time(), **self.snapshot()})
+        with open(path, 'a') as dump_file:
+            dump_file.write(line + '\n')
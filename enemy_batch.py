@@ -0,0 +1,166 @@
+"""Struct-of-arrays enemy simulation for Main_v1 (python Main_v1.py --batched-enemies).
+
+Runs the same chase/patrol rules as Main_v1's Enemy.update, but for all the
+enemies of a maze at once: positions, patrol targets, timers and states live
+in NumPy arrays and every step is a handful of array operations, so a maze
+can hold thousands of enemies. Like dungeon_net, nothing here imports
+pygame; the game passes in its constants, walls, flow field and clock.
+
+NumPy is optional for the game: without it, Main_v1 simulates enemies one
+by one as before.
+"""
+
+import numpy as np
+
+PATROL = 0
+CHASE = 1
+
+
+class EnemyBatch:
+    """The movement state of one maze's enemies, one array element per enemy.
+
+    Rows are kept in the same order as the maze's list of Enemy objects:
+    append() for a spawn, keep() after kills. Positions are rect top-lefts in
+    whole pixels and rects are `enemy_size` square, as in the game.
+    """
+
+    def __init__(self, tile_size, enemy_size, maze_width, maze_height, patrol_speed, chase_speed, chase_range,
+                 patrol_distance, attack_cooldown_ms, flow_directions, seed=None):
+        self.tile_size = tile_size
+        self.enemy_size = enemy_size
+        self.maze_width = maze_width
+        self.maze_height = maze_height
+        self.patrol_speed = patrol_speed
+        self.chase_speed = chase_speed
+        self.chase_range = chase_range
+        self.patrol_distance = patrol_distance
+        self.attack_cooldown_ms = attack_cooldown_ms
+        # Flow field step codes (see Main_v1.FlowField): 0 is no step, code n is flow_directions[n - 1]
+        self.step_dx = np.array([0] + [dx for dx, _dy in flow_directions], dtype=np.int64)
+        self.step_dy = np.array([0] + [dy for _dx, dy in flow_directions], dtype=np.int64)
+        self.random = np.random.default_rng(seed)
+        self.solid = np.zeros((0, 0), dtype=bool)
+        self.changed = np.zeros(0, dtype=np.int64) # Rows whose position, state or patrol target the last update() changed
+        self.clear()
+
+    def __len__(self):
+        return len(self.x)
+
+    def clear(self):
+        self.x = np.zeros(0, dtype=np.int64)
+        self.y = np.zeros(0, dtype=np.int64)
+        self.state = np.zeros(0, dtype=np.uint8)
+        self.target_x = np.zeros(0, dtype=np.int64) # Patrol target
+        self.target_y = np.zeros(0, dtype=np.int64)
+        self.next_patrol = np.zeros(0, dtype=np.int64) # Time (ms) at which a new patrol target is picked
+        self.last_attack = np.zeros(0, dtype=np.int64) # Time (ms) of the last melee hit
+
+    def append(self, x, y, target_x, target_y, next_patrol=0, last_attack=0, state=PATROL):
+        self.x = np.append(self.x, x)
+        self.y = np.append(self.y, y)
+        self.state = np.append(self.state, np.uint8(state))
+        self.target_x = np.append(self.target_x, target_x)
+        self.target_y = np.append(self.target_y, target_y)
+        self.next_patrol = np.append(self.next_patrol, next_patrol)
+        self.last_attack = np.append(self.last_attack, last_attack)
+
+    def keep(self, alive):
+        """Drops the rows whose entry in `alive` (one truth value per row) is false."""
+        alive = np.asarray(alive, dtype=bool)
+        for name in ('x', 'y', 'state', 'target_x', 'target_y', 'next_patrol', 'last_attack'):
+            setattr(self, name, getattr(self, name)[alive])
+
+    def set_walls(self, cells, rows, cols, solid_tile):
+        """Takes the maze's walls from a TileGrid's cells: tiles equal to `solid_tile` block enemies."""
+        self.solid = np.frombuffer(bytes(cells), dtype=np.uint8).reshape(rows, cols) == solid_tile
+
+    def update(self, now, player_rect, flow_steps=None):
+        """Advances every enemy by one simulation step; returns how many of them hit the player.
+
+        `player_rect` is (x, y, width, height) and `flow_steps` the step codes of
+        the flow field toward the player's tile (None: chase in a straight line).
+        A hit starts the enemy's melee cooldown; the damage is the caller's.
+        """
+        size = self.enemy_size
+        old_x, old_y, old_state = self.x.copy(), self.y.copy(), self.state.copy()
+        player_x, player_y, player_w, player_h = player_rect
+        player_cx, player_cy = player_x + player_w // 2, player_y + player_h // 2
+
+        center_x = self.x + size // 2
+        center_y = self.y + size // 2
+        chase = np.hypot(player_cx - center_x, player_cy - center_y) < self.chase_range
+        self.state = np.where(chase, CHASE, PATROL).astype(np.uint8)
+        speed = np.where(chase, self.chase_speed, self.patrol_speed)
+
+        # Patrol: a new random target every few seconds, or once the old one is reached
+        retarget = ~chase & ((now > self.next_patrol) |
+                             (np.hypot(center_x - self.target_x, center_y - self.target_y) < speed * 2))
+        count = int(retarget.sum())
+        if count:
+            self.target_x[retarget] = self.x[retarget] + self.random.integers(-self.patrol_distance, self.patrol_distance + 1, count)
+            self.target_y[retarget] = self.y[retarget] + self.random.integers(-self.patrol_distance, self.patrol_distance + 1, count)
+            self.next_patrol[retarget] = now + self.random.integers(1000, 3001, count)
+
+        if flow_steps is not None:
+            self._follow_flow_field(chase, speed, center_x, center_y, player_cx, player_cy, flow_steps)
+            direct = ~chase
+        else:
+            direct = np.ones(len(self.x), dtype=bool)
+        goal_x = np.where(chase, player_cx, self.target_x)
+        goal_y = np.where(chase, player_cy, self.target_y)
+        self._move_direct(direct, speed, center_x, center_y, goal_x, goal_y)
+
+        # Melee: enemies touching the player whose cooldown is over
+        touching = ((self.x < player_x + player_w) & (player_x < self.x + size) &
+                    (self.y < player_y + player_h) & (player_y < self.y + size))
+        hits = touching & (now - self.last_attack > self.attack_cooldown_ms)
+        self.last_attack[hits] = now
+
+        self.changed = np.flatnonzero((self.x != old_x) | (self.y != old_y) | (self.state != old_state) | retarget)
+        return int(hits.sum())
+
+    def _follow_flow_field(self, chase, speed, center_x, center_y, player_cx, player_cy, flow_steps):
+        """Chasing rows head for the center of the next tile on the path; one axis at a time, like Enemy.follow_flow_field."""
+        tile = self.tile_size
+        rows, cols = self.solid.shape
+        row, col = center_y // tile, center_x // tile
+        inside = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+        steps = np.frombuffer(flow_steps, dtype=np.uint8)
+        code = np.where(inside, steps[np.clip(row, 0, rows - 1) * cols + np.clip(col, 0, cols - 1)], 0)
+        # On the player's tile, or with no path, straight at the player
+        target_x = np.where(code > 0, (col + self.step_dx[code]) * tile + tile // 2, player_cx)
+        target_y = np.where(code > 0, (row + self.step_dy[code]) * tile + tile // 2, player_cy)
+
+        step_x = np.where(chase, np.trunc(np.clip(target_x - center_x, -speed, speed)), 0).astype(np.int64)
+        moved_x = self.x + step_x
+        self.x = np.where(self._blocked(moved_x, self.y), self.x, moved_x)
+        step_y = np.where(chase, np.trunc(np.clip(target_y - center_y, -speed, speed)), 0).astype(np.int64)
+        moved_y = self.y + step_y
+        self.y = np.where(self._blocked(self.x, moved_y), self.y, moved_y)
+
+    def _move_direct(self, rows_mask, speed, center_x, center_y, goal_x, goal_y):
+        """The selected rows step `speed` straight toward their goal; a step into a wall is undone, as in Enemy.update."""
+        dx = goal_x - center_x
+        dy = goal_y - center_y
+        dist = np.hypot(dx, dy)
+        dist[dist == 0] = 1
+        moved_x = self.x + np.where(rows_mask, np.trunc(dx / dist * speed), 0).astype(np.int64)
+        moved_y = self.y + np.where(rows_mask, np.trunc(dy / dist * speed), 0).astype(np.int64)
+        blocked = self._blocked(moved_x, moved_y)
+        moved_x = np.where(blocked, self.x, moved_x)
+        moved_y = np.where(blocked, self.y, moved_y)
+        self.x = np.where(rows_mask, np.clip(moved_x, 0, self.maze_width - self.enemy_size), self.x)
+        self.y = np.where(rows_mask, np.clip(moved_y, 0, self.maze_height - self.enemy_size), self.y)
+
+    def _blocked(self, x, y):
+        """Which rects at (x, y) overlap a solid tile. Enemies are no larger than a tile, so checking the corners is enough."""
+        tile = self.tile_size
+        rows, cols = self.solid.shape
+        blocked = np.zeros(len(x), dtype=bool)
+        if rows == 0 or cols == 0:
+            return blocked
+        for row in (y // tile, (y + self.enemy_size - 1) // tile):
+            for col in (x // tile, (x + self.enemy_size - 1) // tile):
+                inside = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+                blocked |= inside & self.solid[np.clip(row, 0, rows - 1), np.clip(col, 0, cols - 1)]
+        return blocked
@@ -0,0 +1,123 @@
+"""Loopback load test for the match server.
+
+For every bot count, starts a fresh match server on 127.0.0.1 in its own
+process, plays that many BotClients against it for a while, then reports
+the server's tick time, dropped ticks, lowest adaptive send rate and
+outgoing throughput (from the metrics it dumps to DUNGEON_NET_METRICS) next
+to what the bots measured.
+
+    python load_test.py [--bots 2,8,32,64] [--seconds 10] [--port 5151]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DUNGEON_HEADLESS', '1')
+
+from bot_client import run_bots
+
+SERVER_START_TIMEOUT = 10.0 # Seconds to wait for the server to accept connections
+SERVER_CODE = "import sys, Main_v1; Main_v1.run_match_server('127.0.0.1', int(sys.argv[1]))"
+
+
+def start_server(port, metrics_file):
+    env = dict(os.environ, DUNGEON_HEADLESS='1', DUNGEON_NET_METRICS=metrics_file)
+    server = subprocess.Popen([sys.executable, '-c', SERVER_CODE, str(port)], env=env,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"match server did not start on port {port}")
+
+
+def read_server_metrics(metrics_file, since, until):
+    """The lines the server dumped between `since` and `until` (wall-clock times)."""
+    with open(metrics_file) as lines:
+        window = [line for line in map(json.loads, lines) if since <= line['time'] <= until]
+    if len(window) < 2:
+        raise RuntimeError("the server dumped fewer than two metrics lines during the run")
+    return window
+
+
+def server_stats(window):
+    """Tick time, dropped ticks and bytes/s between the first and the last of the metrics lines in `window`."""
+    first, last = window[0], window[-1]
+    elapsed = last['time'] - first['time']
+    ticks_first, ticks_last = first['timings']['tick'], last['timings']['tick']
+    ticks = ticks_last['count'] - ticks_first['count']
+    tick_total_ms = ticks_last['mean_ms'] * ticks_last['count'] - ticks_first['mean_ms'] * ticks_first['count']
+    return {
+        # Bots leave at slightly different times: count the matches at their peak
+        'matches': max(line['gauges'].get('matches', 0) for line in window),
+        'players': max(line['gauges'].get('players', 0) for line in window),
+        'tick_mean_ms': tick_total_ms / ticks if ticks else 0.0,
+        'tick_max_ms': ticks_last['max_ms'],
+        'ticks_per_second': ticks / elapsed,
+        'dropped_ticks': last['counters'].get('dropped_ticks', 0) - first['counters'].get('dropped_ticks', 0),
+        'send_rate_min': min(line['gauges'].get('send_rate_min', 0) for line in window),
+        'sent_per_second': (last['bytes_sent'] - first['bytes_sent']) / elapsed
+    }
+
+
+def bot_stats(bots):
+    rates = [bot.snapshot_rate() for bot in bots]
+    rtts = [bot.metrics.rtt * 1000 for bot in bots if bot.metrics.rtt is not None]
+    return {
+        'snapshot_rate_mean': sum(rates) / len(rates),
+        'snapshot_rate_min': min(rates),
+        'rtt_mean_ms': sum(rtts) / len(rtts) if rtts else None,
+        'rtt_max_ms': max(rtts) if rtts else None
+    }
+
+
+def run_level(bot_count, port, seconds):
+    """Runs `bot_count` bots against a fresh server; returns (server stats, bot stats)."""
+    with tempfile.TemporaryDirectory() as directory:
+        metrics_file = os.path.join(directory, 'server_metrics.jsonl')
+        server = start_server(port, metrics_file)
+        try:
+            started = time.time()
+            bots = asyncio.run(run_bots(bot_count, '127.0.0.1', port, seconds))
+            finished = time.time()
+            time.sleep(1.5) # One more dump after the bots are done
+        finally:
+            server.terminate()
+            server.wait()
+        # The first second is spent connecting; leave it out
+        window = read_server_metrics(metrics_file, started + 1.0, finished)
+        return server_stats(window), bot_stats(bots)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback load test for the match server.")
+    parser.add_argument('--bots', default='2,8,32,64', help="comma-separated bot counts, one run each")
+    parser.add_argument('--seconds', type=float, default=10.0, help="length of each run")
+    parser.add_argument('--port', type=int, default=5151)
+    args = parser.parse_args()
+
+    print(f"{'bots':>5} {'matches':>7} {'tick ms':>8} {'max ms':>7} {'ticks/s':>7} {'dropped':>7}"
+          f" {'send Hz':>7} {'out KiB/s':>9} {'snaps/s':>7} {'min':>5} {'rtt ms':>6} {'max':>5}")
+    for bot_count in (int(count) for count in args.bots.split(',')):
+        server, bots = run_level(bot_count, args.port, args.seconds)
+        rtt_mean = f"{bots['rtt_mean_ms']:6.1f}" if bots['rtt_mean_ms'] is not None else f"{'-':>6}"
+        rtt_max = f"{bots['rtt_max_ms']:5.0f}" if bots['rtt_max_ms'] is not None else f"{'-':>5}"
+        print(f"{bot_count:5d} {server['matches']:7d} {server['tick_mean_ms']:8.2f} {server['tick_max_ms']:7.1f}"
+              f" {server['ticks_per_second']:7.1f} {server['dropped_ticks']:7d}"
+              f" {server['send_rate_min']:7.1f} {server['sent_per_second'] / 1024:9.1f}"
+              f" {bots['snapshot_rate_mean']:7.1f} {bots['snapshot_rate_min']:5.1f} {rtt_mean} {rtt_max}")
+
+
+if __name__ == "__main__":
+    main()